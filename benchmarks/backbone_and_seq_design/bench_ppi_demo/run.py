@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""runs the benchmark as a mlb.run.Pipeline instead of one step after another:
+
+    diffusion (gpu) -> mpnn (cpu) -> af2 (gpu) -> score (cpu) -> summary
+
+every backbone goes to mpnn as soon as diffusion has written it, every threaded design goes to af2 as soon as
+it exists, and so on, so the first scores show up long before the whole benchmark is done. Backbones are given
+to mpnn in batches of --mpnn_batch so the mpnn container and model load are shared. Threaded designs are given
+to af2 in batches of --af2_batch, which run as AF2 batches of one design length each (mlb.run.af2batch) on one
+long-lived AF2 process per gpu (af2_worker.py), so AF2 compiles once per length and gpu. Methods that only
+provide generate_threaded_design.sh run it as one gpu stage in place of diffusion + mpnn
+
+every gpu stage task gets one gpu of its own, through CUDA_VISIBLE_DEVICES
+
+diffusion, mpnn and af2 outputs go in a mlb.run.ArtifactCache keyed by their inputs, scripts and containers,
+so a rerun after changing only the scoring doesn't redo any of them
+"""
+import argparse
+import csv
+import functools
+import glob
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.realpath('ml_benchmarks'))
+import mlb.run
+
+COMMON_SCRIPTS = 'ml_benchmarks/benchmarks/backbone_and_seq_design/common_scripts'
+sys.path.insert(0, os.path.realpath(COMMON_SCRIPTS))
+import af2_batched
+
+STAGE_SCRIPTS = dict(
+    diffusion=['generate_backbones.sh'],
+    mpnn=['scripts/generate_threaded_designs_from_backbones.sh', f'{COMMON_SCRIPTS}/mpnn_batch_ppi.sh'],
+    af2=[f'{COMMON_SCRIPTS}/af2_batched.py', f'{COMMON_SCRIPTS}/af2_worker.py'],
+)
+CONTAINERS = dict(
+    diffusion=[
+        '/software/containers/SE3nv.sif',
+        '/databases/diffusion/models/hotspot_models/base_complex_finetuned_BFF_9.pt',
+    ],
+    mpnn=['/net/software/containers/mlfold.sif'],
+    af2=['/software/containers/users/bcov/bcov_af2.sif'],
+)
+
+def sh(cmd, device=None):
+    """run cmd, seeing only gpu device if it is given"""
+    if device is not None: cmd = f'export CUDA_VISIBLE_DEVICES={device}; {cmd}'
+    stdout, stderr, returncode = mlb.run.bash(cmd)
+    if returncode: raise RuntimeError(f'"{cmd}" failed with exit code {returncode}\n{stderr}')
+    return stdout
+
+def diffusion(line, device):
+    """yields each backbone as soon as diffusion is done with it. diffusion writes the .trb after the .pdb"""
+    pdb, hotspots, contig, n_backbones, n_mpnn = line.split()
+    name = os.path.basename(pdb).replace('.pdb', '')
+    proc = subprocess.Popen(['./generate_backbones.sh', pdb, hotspots, contig, n_backbones],
+                            env=dict(os.environ, CUDA_VISIBLE_DEVICES=device))
+    os.makedirs('backbones', exist_ok=True)
+    for path in mlb.run.watch_files(f'diffusion_out/{name}/{name}_bb_*.pdb',
+                                    until=lambda: proc.poll() is not None,
+                                    ready=lambda path: os.path.exists(path.replace('.pdb', '.trb'))):
+        bb = f"backbones/{os.path.basename(path).replace('bb_', 'bb')}"
+        shutil.copy(path, bb)
+        yield bb, n_mpnn
+    if proc.returncode: raise RuntimeError(f'generate_backbones.sh failed on {line}')
+
+def mpnn(backbones, cache=None):
+    """backbones found in cache are left out of the mpnn run"""
+    designs, todo = [], {}
+    for bb, n_mpnn in backbones:
+        key = cache and cache.key('mpnn', bb, n_mpnn, files=[bb, *STAGE_SCRIPTS['mpnn']],
+                                  containers=CONTAINERS['mpnn'])
+        if key and (hit := cache.get(key)) is not None: designs += hit
+        else: todo.setdefault(n_mpnn, []).append((bb, key))
+    for n_mpnn, bbs in todo.items():
+        sh(f"./scripts/generate_threaded_designs_from_backbones.sh {n_mpnn} {' '.join(bb for bb, _ in bbs)}")
+        for bb, key in bbs:
+            name = os.path.basename(bb).replace('.pdb', '')
+            threaded = sorted(glob.glob(f'threaded_designs/{name}_mpnn*.pdb'))
+            if key: cache.put(key, threaded)
+            designs += threaded
+    return designs
+
+def threaded_design(line, device):
+    """for methods without generate_backbones.sh, diffusion and mpnn both happen in here"""
+    sh(f'./generate_threaded_design.sh {line}', device)
+    name = os.path.basename(line.split()[0]).replace('.pdb', '')
+    return sorted(glob.glob(f'threaded_designs/{name}_bb*.pdb'))
+
+def af2(designs, device, workers, cache=None, max_residues=50_000):
+    """AF2 on threaded designs on one gpu, in batches of one length each with up to max_residues residues,
+    run by the device's worker in workers (af2_batched.AF2Workers). Designs found in cache are left out. Yields
+    each oracle pdb as soon as its AF2 batch is done"""
+    todo = {}
+    for design in designs:
+        key = cache and cache.key('af2', design, files=[design, *STAGE_SCRIPTS['af2']],
+                                  containers=CONTAINERS['af2'])
+        if key and (hit := cache.get(key)) is not None: yield hit
+        else: todo[design] = key
+    lengths = {design: mlb.run.pdb_length(design) for design in todo}
+    predict = af2_batched.predict_batch('af2_temp/batches', {design: design for design in todo}, workers)
+    for batch in mlb.run.plan_af2_batches(lengths, max_residues):
+        oracles = extract_af2_batch(predict(batch, device))
+        for design in batch.names:
+            tag = os.path.basename(design).replace('.pdb', '')
+            if tag not in oracles: raise RuntimeError(f'AF2 gave no prediction for {design}')
+            if todo[design]: cache.put(todo[design], oracles[tag], files=[oracles[tag], af2_scores(tag)])
+            yield oracles[tag]
+
+def af2_scores(design_tag):
+    return f'oracle_outputs/scores/{design_tag}.sc'
+
+def extract_af2_batch(out_silent):
+    """rename the designs in an AF2 batch's out.silent to <design>_oracle, extract them to oracle_outputs and
+    give each its own score file in oracle_outputs/scores. Returns {design tag: oracle pdb}"""
+    batch_dir, tools = os.path.dirname(out_silent), af2_batched.SILENT_TOOLS
+    sh(f'cd {batch_dir} && {tools}/silentls out.silent | sed s/_af2pred/_oracle/g'
+       f' | {tools}/silentrename out.silent > renamed.silent && {tools}/silentscorefile renamed.silent')
+    os.makedirs('oracle_outputs/scores', exist_ok=True)
+    sh(f'cd oracle_outputs && {tools}/silentextract {os.path.abspath(batch_dir)}/renamed.silent')
+    with open(f'{batch_dir}/renamed.sc') as inp:
+        header, *rows = inp.readlines()
+    column = header.split().index('description')
+    oracles = {}
+    for row in rows:
+        if row == header: continue
+        tag = row.split()[column]
+        design_tag = tag.replace('_oracle', '')
+        with open(af2_scores(design_tag), 'w') as out:
+            out.writelines([header, row])
+        oracles[design_tag] = f'oracle_outputs/{tag}.pdb'
+    return oracles
+
+def score(oracle_pdb):
+    """scores one design in its own directory. this also fills score_cache for the summary"""
+    tag = os.path.basename(oracle_pdb).replace('.pdb', '')
+    design_tag = tag.replace('_oracle', '')
+    rundir = os.getcwd()
+    os.makedirs(f'score_temp/{tag}', exist_ok=True)
+    sh(f'cd score_temp/{tag} && {rundir}/scripts/score.sh --inputs_txt {rundir}/inputs.txt'
+       f' --af2_outputs {rundir}/{oracle_pdb} --af2_scores {rundir}/{af2_scores(design_tag)}'
+       f' --cache_dir {rundir}/score_cache')
+    with open(f'score_temp/{tag}/score_individual.csv') as inp:
+        scores = next(csv.DictReader(inp))
+    print('scored', scores['description'], flush=True)
+    return scores
+
+def merge_af2_scores(scorefiles, fname='oracle_outputs/af2_scores.sc'):
+    header = None
+    with open(fname, 'w') as out:
+        for scorefile in sorted(scorefiles):
+            with open(scorefile) as inp:
+                lines = inp.readlines()
+            if header is None:
+                header = lines[0]
+                out.write(header)
+            out.writelines(line for line in lines[1:] if line != header)
+
+def summary(scores):
+    merge_af2_scores(glob.glob('oracle_outputs/scores/*.sc'))
+    sh('./scripts/score.sh')
+    with open('final_scores.csv') as inp:
+        return next(csv.DictReader(inp))
+
+def cached_stages(cache):
+    """diffusion, threaded_design, mpnn and af2 going through cache"""
+    def diffusion_key(line):
+        return cache.key('diffusion', line, files=[line.split()[0], *STAGE_SCRIPTS['diffusion']],
+                         containers=CONTAINERS['diffusion'])
+
+    def threaded_design_key(line):
+        scripts = sorted(glob.glob('*.sh') + glob.glob('scripts/*.sh'))
+        return cache.key('threaded_design', line, files=[line.split()[0], *scripts])
+
+    return dict(
+        diffusion=cache.cached(diffusion, diffusion_key),
+        threaded_design=cache.cached(threaded_design, threaded_design_key),
+        mpnn=functools.partial(mpnn, cache=cache),
+        af2=functools.partial(af2, cache=cache),
+    )
+
+def ppi_pipeline(resources, mpnn_workers=None, mpnn_batch=8, mpnn_batch_wait=60, af2_batch=64,
+                 af2_batch_wait=60, af2_max_residues=50_000, cache=None, af2_workers=None):
+    """resources['gpu'] is the list of gpu ids to hand out. af2_workers (af2_batched.AF2Workers) runs AF2,
+    the caller closes it"""
+    fns = dict(diffusion=diffusion, threaded_design=threaded_design, mpnn=mpnn, af2=af2)
+    if cache: fns = cached_stages(cache)
+    fns['af2'] = functools.partial(fns['af2'], workers=af2_workers, max_residues=af2_max_residues)
+    if os.path.exists('generate_backbones.sh'):
+        design_stages = [
+            mlb.run.Stage('diffusion', fns['diffusion'], resource='gpu'),
+            mlb.run.Stage('mpnn', fns['mpnn'], after='diffusion', concurrency=mpnn_workers,
+                          batch_size=mpnn_batch, batch_wait=mpnn_batch_wait),
+        ]
+    else:
+        design_stages = [mlb.run.Stage('mpnn', fns['threaded_design'], resource='gpu')]
+    return mlb.run.Pipeline([
+        *design_stages,
+        mlb.run.Stage('af2', fns['af2'], after='mpnn', resource='gpu', batch_size=af2_batch,
+                      batch_wait=af2_batch_wait),
+        mlb.run.Stage('score', score, after='af2'),
+        mlb.run.Stage('summary', summary, after='score', gather=True),
+    ], resources=resources)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--inputs_txt', default='inputs.txt')
+    parser.add_argument('--cpus', type=int, default=os.cpu_count())
+    parser.add_argument('--gpus', type=int, default=None, help='how many of the visible gpus to use')
+    parser.add_argument('--mpnn_workers', type=int, default=None)
+    parser.add_argument('--mpnn_batch', type=int, default=8, help='backbones per mpnn run')
+    parser.add_argument('--mpnn_batch_wait', type=float, default=60,
+                        help='seconds to wait for a full mpnn batch before running a partial one')
+    parser.add_argument('--af2_batch', type=int, default=64, help='threaded designs per af2 task')
+    parser.add_argument('--af2_batch_wait', type=float, default=60,
+                        help='seconds to wait for a full af2 batch before running a partial one')
+    parser.add_argument('--af2_max_residues', type=int, default=50_000, help='residues per AF2 batch')
+    parser.add_argument('--artifact_cache', default='ml_benchmarks/runs/.artifacts',
+                        help='where to cache diffusion, mpnn and af2 outputs. "" to turn the cache off')
+    parser.add_argument('--artifact_cache_gb', type=float, default=500)
+    args = parser.parse_args()
+
+    with open(args.inputs_txt) as inp:
+        lines = [line.strip() for line in inp if line.strip()]
+    cache = None
+    if args.artifact_cache:
+        cache = mlb.run.ArtifactCache(args.artifact_cache, max_bytes=int(args.artifact_cache_gb * 2**30))
+    gpus = mlb.run.visible_gpus()[:args.gpus]
+    af2_workers = af2_batched.AF2Workers()
+    pipeline = ppi_pipeline(dict(cpu=args.cpus, gpu=gpus), args.mpnn_workers, args.mpnn_batch,
+                            args.mpnn_batch_wait, args.af2_batch, args.af2_batch_wait, args.af2_max_residues,
+                            cache, af2_workers)
+
+    try:
+        result = pipeline.run(lines, on_output=lambda stage, item: print('final scores:', item))
+    finally:
+        af2_workers.close()
+    for stage, item, trace in result.errors:
+        print(f'{stage} failed on {item}:\n{trace}', file=sys.stderr)
+    sys.exit(1 if result.errors else 0)
+
+if __name__ == '__main__':
+    main()
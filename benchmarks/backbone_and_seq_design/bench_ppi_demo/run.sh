@@ -1,10 +1,4 @@
 #!/bin/bash
 
-IFS=$'\n'
-for line in $(cat inputs.txt); do
-    echo ./generate_threaded_design.sh $line | bash
-done
-unset IFS
-./scripts/generate_oracle_outputs_from_threaded_designs.sh
-./scripts/score.sh
-
+# diffusion -> mpnn -> af2 -> score as a pipeline. see run.py
+python run.py "$@"
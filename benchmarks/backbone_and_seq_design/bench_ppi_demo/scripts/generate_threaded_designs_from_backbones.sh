@@ -0,0 +1,3 @@
+#!/bin/bash
+
+./ml_benchmarks/benchmarks/backbone_and_seq_design/common_scripts/mpnn_batch_ppi.sh "$@"
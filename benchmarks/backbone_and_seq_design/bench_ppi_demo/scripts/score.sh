@@ -1,4 +1,14 @@
 #!/bin/bash
 
-apptainer exec -B /databases -B /software /software/containers/users/bcov/bcov_base_22-01-11.sif python ./ml_benchmarks/benchmarks/backbone_and_seq_design/common_scripts/ppi_score.py --af2_outputs oracle_outputs/*.pdb
+# Arguments are passed on to ppi_score.py. Without any, everything in oracle_outputs/ is scored
+# Works from any directory so run.py can score single designs in their own directory
+
+ml_benchmarks=$(cd $(dirname $0)/.. && pwd)/ml_benchmarks
+
+args=("$@")
+if [ ${#args[@]} -eq 0 ]; then
+    args=(--af2_outputs oracle_outputs/*.pdb)
+fi
+
+apptainer exec -B /databases -B /software /software/containers/users/bcov/bcov_base_22-01-11.sif python $ml_benchmarks/benchmarks/backbone_and_seq_design/common_scripts/ppi_score.py "${args[@]}"
 
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# AF2 initial guess on a directory of threaded designs, batched by length and spread over all gpus
+#
+# Designs of the same length go in the same batch so AF2 only compiles once per batch. Each gpu gets its
+#  own batches, and steals from the others once it runs out. Every gpu has one long-lived AF2 process
+#  (af2_worker.py) for all of its batches, so a length that gpu has seen before doesn't compile again.
+#  Every batch runs in its own directory and the out.silent files are merged at the end
+#
+#  usage: af2_batched.py threaded_designs/*.pdb
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[3]))
+import mlb.run
+import af2_worker
+
+
+SILENT_TOOLS = "/software/lab/silent_tools"
+APPTAINER = "/software/containers/users/bcov/bcov_af2.sif"
+AF2_SCRIPT = "/software/lab/ppi/bcov_scripts/bcov_nate_af2_early_stop/interfaceAF2predict_bcov.py"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pdbs", nargs="+")
+    parser.add_argument("--work_dir", default="af2_temp/batches")
+    parser.add_argument("--out_silent", default="af2_temp/out.silent")
+    parser.add_argument("--max_residues", type=int, default=50000, help="Residues per AF2 batch")
+    parser.add_argument("--gpus", type=int, default=None, help="Defaults to all visible gpus")
+    return parser.parse_args()
+
+
+def af2_worker_command(jax_cache="af2_temp/jax_cache"):
+    return ["apptainer", "exec", "--nv", APPTAINER, "python", "-u", os.path.abspath(af2_worker.__file__), AF2_SCRIPT,
+            os.path.abspath(jax_cache)]
+
+
+# One af2_worker.py per device, started the first time that device gets a batch and restarted if it dies.
+#  Only one thread at a time may use a device, like run_af2_batches and the mlb.run.Pipeline gpu pool do
+class AF2Workers:
+    def __init__(self, command=None):
+        self.command = command or af2_worker_command()
+        self.procs = {}
+        self.lock = threading.Lock()
+
+    def worker(self, device):
+        with self.lock:
+            proc = self.procs.get(device)
+            if ( proc is None or proc.poll() is not None ):
+                env = dict(os.environ, CUDA_VISIBLE_DEVICES=str(device))
+                proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+                                        text=True, bufsize=1)
+                self.procs[device] = proc
+            return proc
+
+    # Runs AF2 on batch_dir/in.silent on device, and waits for it to be done
+    def __call__(self, batch_dir, device):
+        batch_dir = os.path.abspath(batch_dir)
+        proc = self.worker(device)
+        try:
+            proc.stdin.write(batch_dir + "\n")
+            proc.stdin.flush()
+            for line in proc.stdout:
+                words = line.split(maxsplit=1)
+                if ( len(words) == 2 and words[1].strip() == batch_dir ):
+                    if ( words[0] == af2_worker.DONE ):
+                        return
+                    if ( words[0] == af2_worker.FAILED ):
+                        raise RuntimeError(f"AF2 failed on {batch_dir}, see {batch_dir}/af2.log")
+        except BrokenPipeError:
+            pass
+        raise RuntimeError(f"AF2 worker on gpu {device} died with exit code {proc.wait()} on {batch_dir}")
+
+    def close(self):
+        with self.lock:
+            procs, self.procs = list(self.procs.values()), {}
+        for proc in procs:
+            proc.stdin.close()
+        for proc in procs:
+            proc.wait()
+
+
+def predict_batch(work_dir, pdb_by_name, workers):
+    def predict(batch, device):
+        first = os.path.basename(batch.names[0]).replace(".pdb", "")
+        batch_dir = Path(work_dir) / f"len{batch.length}_{first}"
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        pdbs = [os.path.abspath(pdb_by_name[name]) for name in batch.names]
+        with open(batch_dir / "in.silent", "w") as f:
+            subprocess.run([f"{SILENT_TOOLS}/silentfrompdbs", *pdbs], stdout=f, check=True)
+        workers(batch_dir, device)
+        return batch_dir / "out.silent"
+
+    return predict
+
+
+# The SEQUENCE: line and the SCORE: line that names the columns. A design's own SCORE: line ends with its tag
+def is_silent_header(line):
+    if ( line.startswith("SEQUENCE:") ):
+        return True
+    words = line.split()
+    return line.startswith("SCORE:") and len(words) > 1 and words[-1] == "description"
+
+
+# Keeps the headers of the first silent file only. Files are streamed a line at a time
+def merge_silents(fnames, out_fname):
+    with open(out_fname, "w") as out:
+        for i, fname in enumerate(fnames):
+            with open(fname) as f:
+                for line in f:
+                    if ( i == 0 or not is_silent_header(line) ):
+                        out.write(line)
+
+
+def main():
+    args = parse_args()
+
+    pdb_by_name = {os.path.basename(pdb).replace(".pdb", ""): pdb for pdb in args.pdbs}
+    lengths = {name: mlb.run.pdb_length(pdb) for name, pdb in pdb_by_name.items()}
+    batches = mlb.run.plan_af2_batches(lengths, args.max_residues)
+
+    visible = [g.strip() for g in os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",") if g.strip()]
+    devices = visible or [str(i) for i in range(max(1, mlb.run.available_gpus()))]
+    if ( args.gpus ):
+        devices = devices[:args.gpus]
+    print(f"{len(lengths)} designs in {len(batches)} batches on {len(devices)} gpus")
+
+    workers = AF2Workers()
+    try:
+        results = mlb.run.run_af2_batches(batches, predict_batch(args.work_dir, pdb_by_name, workers), devices)
+    finally:
+        workers.close()
+
+    for r in results:
+        if ( r.error ):
+            print(f"AF2 failed on gpu {r.device} for {r.batch.names}:\n{r.error}", file=sys.stderr)
+
+    merge_silents([r.result for r in results if not r.error], args.out_silent)
+    if ( any(r.error for r in results) ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
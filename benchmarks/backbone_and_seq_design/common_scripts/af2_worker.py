@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# One long-lived AF2 process per gpu. Runs inside the AF2 container and reads batch directories from stdin,
+#  one per line. For each one it runs the AF2 script on in.silent in that directory, just like
+#  "cd batch_dir; python AF2_SCRIPT -silent in.silent" would, and then prints a done or failed line
+#
+# The AF2 script only has a command line, so it is run with runpy in this process. jax, tensorflow and the
+#  gpu only get set up once, and the JAX compilation cache means a length this worker has seen before
+#  doesn't compile again. af2batch.deal_batches gives each gpu whole length bins to make the most of that
+#
+#  usage: af2_worker.py AF2_SCRIPT [jax_cache_dir]
+
+import contextlib
+import os
+import runpy
+import sys
+import traceback
+
+
+DONE = "af2_worker_done"
+FAILED = "af2_worker_failed"
+
+
+# Older jax in the container may not know these options. Then each new length still compiles once per worker
+def enable_compile_cache(cache_dir):
+    try:
+        import jax
+        jax.config.update("jax_compilation_cache_dir", cache_dir)
+        jax.config.update("jax_persistent_cache_min_compile_time_secs", 0)
+    except Exception as e:
+        print(f"af2_worker: no jax compilation cache: {e}", file=sys.stderr)
+
+
+# The script's own output goes to af2.log in the batch dir, so stdout only carries the done/failed lines
+def run_batch(script, batch_dir):
+    cwd, argv = os.getcwd(), sys.argv
+    try:
+        os.chdir(batch_dir)
+        sys.argv = [script, "-silent", "in.silent"]
+        with open("af2.log", "w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                runpy.run_path(script, run_name="__main__")
+            except SystemExit as e:
+                if ( e.code ):
+                    raise
+            except Exception:
+                traceback.print_exc()
+                raise
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+
+
+def main():
+    script = os.path.abspath(sys.argv[1])
+    if ( len(sys.argv) > 2 ):
+        os.makedirs(sys.argv[2], exist_ok=True)
+        enable_compile_cache(sys.argv[2])
+    sys.path.insert(0, os.path.dirname(script))
+
+    for line in sys.stdin:
+        batch_dir = line.strip()
+        if ( not batch_dir ):
+            continue
+        try:
+            run_batch(script, batch_dir)
+            print(DONE, batch_dir, flush=True)
+        except ( Exception, SystemExit ):
+            print(FAILED, batch_dir, flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+#!/bin/bash
+
+# Same as mpnn_single_ppi.sh but for a batch of backbones in one mlfold.sif run, so the container start
+#  and model load only happen once per batch
+#  usage: mpnn_batch_ppi.sh <n_outputs> <pdbs...>
+
+n_outputs=$1
+shift
+
+mpnn_dir=/net/databases/lab/mpnn/github_repo
+
+mkdir -p mpnn_output 2>/dev/null
+mkdir threaded_designs 2>/dev/null
+
+run_dir=$(mktemp -d mpnn_output/batch_XXXXXX)
+mkdir $run_dir/inputs
+cp "$@" $run_dir/inputs/
+
+
+/net/software/containers/mlfold.sif $mpnn_dir/helper_scripts/parse_multiple_chains.py --input_path $run_dir/inputs/ --output_path $run_dir/parsed_pdbs.jsonl
+
+/net/software/containers/mlfold.sif $mpnn_dir/protein_mpnn_run.py --out_folder $run_dir --num_seq_per_target $n_outputs --jsonl_path $run_dir/parsed_pdbs.jsonl --omit_AAs C --pack_side_chains 1 --num_packs 1 --sampling_temp "0.1"
+
+
+for j in $run_dir/packed/*.pdb; do
+    new_name=$(basename $j .pdb | sed -E 's/_seq_([0-9]+)_packed.*/_mpnn\1/g')
+    cp $j threaded_designs/$new_name.pdb
+done
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+# Pure numpy pieces of ppi_score.py. No rosetta in here so that they can be tested and
+#  reused without a pyrosetta install
+
+import numpy as np
+
+
+
+# Batched version of the sliding window motif loop that ppi_score.py used to do one window at a time
+#
+# froms, tos   -- 1 indexed residue pairs of the motif hits (already filtered)
+# im_in_ss     -- size+1 long, the index of the non-loop ss element each residue is in, or -1
+# is_core      -- size long, 0 indexed
+#
+# A window only counts if all of it is inside one ss element. For each window we count the motif hits
+#  that go from inside the window to each other ss element. hits_to_others is the number of those hits
+#  that don't go to the most hit element.
+#
+# returns scores, starts, any_core_in_span
+def window_motif_hits(froms, tos, im_in_ss, is_core, window_size=9):
+    im_in_ss = np.asarray(im_in_ss)
+    froms = np.asarray(froms, int)
+    tos = np.asarray(tos, int)
+    size = len(im_in_ss) - 1
+    n_elems = im_in_ss.max() + 1
+
+    starts = np.arange(1, size - window_size + 2)
+    ends = starts + window_size - 1
+
+    # ss elements are contiguous so matching ends means the whole window is in one element
+    our_iss = im_in_ss[starts]
+    valid = (our_iss > -1) & (our_iss == im_in_ss[ends])
+    starts = starts[valid]
+    ends = ends[valid]
+    our_iss = our_iss[valid]
+
+    # hit_matrix[seqpos, iss] is how many hits go from seqpos to a residue in element iss
+    #  hits that land in loops are dropped. Hits with both ends in a window land in the window's own
+    #  element and get removed below along with the rest of the hits to our own element
+    hit_matrix = np.zeros((size+1, max(n_elems, 1)), int)
+    from_iss = im_in_ss[froms]
+    to_iss = im_in_ss[tos]
+    keep = to_iss > -1
+    np.add.at(hit_matrix, (froms[keep], to_iss[keep]), 1)
+    keep = from_iss > -1
+    np.add.at(hit_matrix, (tos[keep], from_iss[keep]), 1)
+
+    cum_hits = np.zeros((size+2, hit_matrix.shape[1]), int)
+    np.cumsum(hit_matrix, axis=0, out=cum_hits[1:])
+    counts = cum_hits[ends+1] - cum_hits[starts]
+    counts[np.arange(len(starts)), our_iss] = 0
+
+    if ( len(starts) > 0 ):
+        scores = counts.sum(axis=-1) - counts.max(axis=-1)
+    else:
+        scores = np.zeros(0, int)
+
+    is_core = np.asarray(is_core, bool)
+    cum_core = np.zeros(size+1, int)
+    np.cumsum(is_core, out=cum_core[1:])
+    any_core_in_span = ((cum_core[ends] - cum_core[starts-1]) > 0).astype(int)
+
+    return scores, starts, any_core_in_span
+
+
+
+# rosetta/main/source/src/core/select/util/SelectResiduesByLayer.cc
+#
+# Same thing as the original full N x M x 3 version but done in blocks of binder residues so that
+#  memory stays around max_pairs * 3 floats no matter how big the complex is. With cutoff=None the
+#  results match the full version to within float summation order.
+#
+# cutoff    -- skip else_Ca farther than this from a binder Cb. Each one skipped at 20A would have
+#               added less than 1.7e-5 (its dist_term) to that residue's sc_neigh
+# dtype     -- np.float32 halves the memory and is plenty accurate for layer selection
+#
+# Also takes stacks of designs of the same size: binder_Ca, binder_Cb (B, M, 3) and else_Ca (B, N, 3)
+#  give (B, M). The whole stack goes through each block together
+def sidechain_neighbors(binder_Ca, binder_Cb, else_Ca, cutoff=None, dtype=np.float64, max_pairs=1<<22):
+    binder_Ca = np.asarray(binder_Ca, dtype)
+    binder_Cb = np.asarray(binder_Cb, dtype)
+    else_Ca = np.asarray(else_Ca, dtype)
+
+    # a single design is a stack of one
+    single = binder_Cb.ndim == 2
+    if ( single ):
+        binder_Ca, binder_Cb, else_Ca = binder_Ca[None], binder_Cb[None], else_Ca[None]
+
+    conevect = binder_Cb - binder_Ca
+    conevect /= np.sqrt(np.sum(np.square(conevect), axis=-1))[:,:,None]
+
+    n_designs, n_binder = binder_Cb.shape[:2]
+    sc_neigh = np.zeros((n_designs, n_binder), dtype)
+    block_size = max(1, max_pairs // max(1, n_designs * else_Ca.shape[1]))
+    if ( not cutoff is None ):
+        # small blocks keep the bounding boxes below tight
+        block_size = min(block_size, 64)
+
+    for lb in range(0, n_binder, block_size):
+        ub = lb + block_size
+        block_Cb = binder_Cb[:,lb:ub]
+        block_else = else_Ca
+
+        # residues in a block are sequence neighbors so their bounding box is small. Anything
+        #  outside of it plus the cutoff can't contribute. In a stack a residue is kept if it is
+        #  inside the box of any of the designs
+        if ( not cutoff is None ):
+            lower = block_Cb.min(axis=1)[:,None] - cutoff
+            upper = block_Cb.max(axis=1)[:,None] + cutoff
+            near = ((else_Ca >= lower) & (else_Ca <= upper)).all(axis=-1).any(axis=0)
+            block_else = else_Ca[:,near]
+
+        vect = block_else[:,:,None] - block_Cb[:,None,:]
+        vect_lengths = np.sqrt(np.sum(np.square(vect), axis=-1))
+        vect_normalized = vect / vect_lengths[...,None]
+
+        dist_term = 1 / ( 1 + np.exp( vect_lengths - 9  ) )
+        if ( not cutoff is None ):
+            dist_term[vect_lengths > cutoff] = 0
+
+        angle_term = (((conevect[:,None,lb:ub] * vect_normalized).sum(axis=-1) + 0.5) / 1.5).clip(0, None)
+
+        sc_neigh[:,lb:ub] = (dist_term * np.square( angle_term )).sum(axis=1)
+
+    if ( single ):
+        return sc_neigh[0]
+    return sc_neigh
+
+
+
+# Vectorized core::sequence::ABEGOManager::torsion2index_level1() + index2symbol()
+#  takes arrays of phi, psi, omega in degrees and gives an array of A, B, E, G, O
+def abego_from_torsions(phi, psi, omega):
+    phi = np.asarray(phi, float)
+    psi = np.asarray(psi, float)
+    omega = np.asarray(omega, float)
+
+    abego = np.where( phi >= 0,
+                np.where( (psi >= -100) & (psi < 100), "G", "E" ),
+                np.where( (psi >= -125) & (psi < 50), "A", "B" ) )
+    abego[np.abs(omega) < 90] = "O"
+
+    return abego
@@ -3,11 +3,15 @@
 import os
 import sys
 import argparse
-import pandas as pd
 import numpy as np
 import re
 from collections import defaultdict
 import itertools
+import multiprocessing
+import hashlib
+import json
+import time
+import contextlib
 
 from pyrosetta import *
 from pyrosetta.rosetta import *
@@ -21,71 +25,128 @@ import npose_util_pyrosetta as nup
 sys.path.append("/databases/lab/motif_hash/getpy_motif/")
 import motif_stuff2
 
+import ppi_metrics
+from ppi_summary import (COPY_FROM_AF2, load_af2_index, passes_af2_gates, tiered_runs_rosetta, report_af2_problems,
+                         pa, ScoreStreamWriter, InMemoryScoreStream, read_score_stream, partial_stream_fname,
+                         TimingWriter, write_score_outputs)
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--inputs_txt", type=str, default="inputs.txt")
-parser.add_argument("--af2_outputs", type=str, nargs="+")
-parser.add_argument("--af2_scores", type=str, default='oracle_outputs/af2_scores.sc')
 
-args = parser.parse_args(sys.argv[1:])
+# Bump this whenever score_ppi_example() changes what it reports so that old cache entries are ignored
+SCORE_VERSION = 3
+
+# sidechain_neighbors() skips residues farther than this from a Cb. Each one would have added less than
+#  1.7e-5 to that residue's sc_neigh, nowhere near enough to move it across the core or surface thresholds
+SC_NEIGHBOR_CUTOFF = 20
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs_txt", type=str, default="inputs.txt")
+    parser.add_argument("--af2_outputs", type=str, nargs="+")
+    parser.add_argument("--af2_scores", type=str, default='oracle_outputs/af2_scores.sc')
+    parser.add_argument("--workers", type=int, default=1, help="Number of scoring processes. Each one runs its own"
+                                                                +" rosetta init and filter setup")
+    parser.add_argument("--cache_dir", type=str, default="score_cache", help="Per-design score and target hotspot"
+                        +" cache. Re-runs only score new or changed designs. Empty string to disable")
+    parser.add_argument("--stream_file", type=str, default="score_individual.arrow", help="Scores are flushed"
+                                                    +" to this arrow ipc file while scoring runs (needs pyarrow)")
+    parser.add_argument("--flush_every", type=int, default=100, help="Rows per chunk written to --stream_file")
+    parser.add_argument("--summarize_only", action="store_true", help="Don't score anything, just write"
+                                            +" score_individual and final_scores from an existing --stream_file")
+    parser.add_argument("--tiered", action="store_true", help="Only run the rosetta ddg/sasa/contact metrics on"
+                        +" designs that can be almost_orderable. final_scores is the same, score_individual has NaN"
+                        +" for those metrics on the other designs")
+    parser.add_argument("--timing", action="store_true", help="Write score_timings.csv with the time spent on each"
+                                                                +" metric for every design that was scored")
+
+    return parser.parse_args(argv)
 
 
 # Parse inputs.txt into the format we need it
-target_to_info = {}
-all_hotspot_sets = set()
-with open(args.inputs_txt) as f:
-    for line in f:
-        line = line.strip()
-        if len(line) == 0:
-            continue
-        sp = line.split()
-        assert len(sp) == 5, sp
+#  The rosetta hotspot numbering of each target is cached in cache_dir/targets so that warm starts don't
+#  have to load any target pdbs
+def load_target_info(inputs_txt, cache_dir=""):
+    target_cache_dir = os.path.join(cache_dir, "targets") if cache_dir else ""
 
-        pdb, hotspots_diffusion, contig, _, _ = sp
+    target_to_info = {}
+    all_hotspot_sets = set()
+    with open(inputs_txt) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            sp = line.split()
+            assert len(sp) == 5, sp
 
-        d = dict(pdb=pdb, hotspots_diffusion=hotspots_diffusion)
-        target = os.path.basename(pdb).replace('.pdb', '')
+            pdb, hotspots_diffusion, contig, _, _ = sp
 
-        hotspots_ros = []
-        pose = pose_from_file(pdb)
-        for dif_hot in hotspots_diffusion.split(','):
-            chain = dif_hot[0]
-            number = int(dif_hot[1:])
+            d = dict(pdb=pdb, hotspots_diffusion=hotspots_diffusion)
+            target = os.path.basename(pdb).replace('.pdb', '')
+
+            cached = None
+            if ( target_cache_dir ):
+                cache_key = target_cache_key(pdb, hotspots_diffusion)
+                cached = cache_load(target_cache_dir, cache_key)
+
+            if ( cached is None ):
+                d['hotspots_ros'] = resolve_hotspots(pose_from_file(pdb), hotspots_diffusion)
+                if ( target_cache_dir ):
+                    cache_store(target_cache_dir, cache_key, dict(hotspots_ros=d['hotspots_ros']))
+            else:
+                d['hotspots_ros'] = cached['hotspots_ros']
+
+            target_to_info[target] = d
+
+            all_hotspot_sets.add(d['hotspots_ros'])
+
+    # sorted so that every worker process builds the same filters in the same order
+    return target_to_info, sorted(all_hotspot_sets)
+
+
+# B156,B164 -> rosetta numbering like 150,158
+def resolve_hotspots(pose, hotspots_diffusion):
+    pdb_info = pose.pdb_info()
+    pdb_numbering = defaultdict(list)
+    for seqpos in range(1, pose.size()+1):
+        pdb_numbering[(pdb_info.chain(seqpos), pdb_info.number(seqpos))].append(seqpos)
 
-            for seqpos in range(1, pose.size()+1):
-                if pose.pdb_info().chain(seqpos) == chain and pose.pdb_info().number(seqpos) == number:
-                    hotspots_ros.append(seqpos)
+    hotspots_ros = []
+    for dif_hot in hotspots_diffusion.split(','):
+        chain = dif_hot[0]
+        number = int(dif_hot[1:])
 
-        d['hotspots_ros'] = ','.join(str(x) for x in hotspots_ros)
-        target_to_info[target] = d
+        hotspots_ros += pdb_numbering.get((chain, number), [])
 
-        all_hotspot_sets.add(d['hotspots_ros'])
+    return ','.join(str(x) for x in hotspots_ros)
 
 
 
-selectors = []
-filters = []
-names = []
+# Fills in the global filters used by score_ppi_example(). Called once in the main process
+#  or once per worker process
+def setup_filters(all_hotspot_sets):
+    global cp_filters, sasa_filter, cms_filter
 
-all_hotspot_sets = list(all_hotspot_sets)
+    selectors = []
+    filters = []
+    names = []
 
-selectors.append('<Chain name="chainA" chains="A"/>')
-selectors.append('<Chain name="chainB" chains="B"/>')
+    selectors.append('<Chain name="chainA" chains="A"/>')
+    selectors.append('<Chain name="chainB" chains="B"/>')
 
-for i, res_string in enumerate(all_hotspot_sets):
+    for i, res_string in enumerate(all_hotspot_sets):
 
-    name = "contact_patch%i"%i
-    
+        name = "contact_patch%i"%i
 
-    selectors.append(f'<Slice name="{name}" indices="{res_string}" selector="chainB" />')
-    filters.append(f'<ContactMolecularSurface name="{name}" distance_weight="0.5" target_selector="{name}"'
-                                                                    +' binder_selector="chainA" confidence="0" />')
-    names.append(name)
 
+        selectors.append(f'<Slice name="{name}" indices="{res_string}" selector="chainB" />')
+        filters.append(f'<ContactMolecularSurface name="{name}" distance_weight="0.5" target_selector="{name}"'
+                                                                        +' binder_selector="chainA" confidence="0" />')
+        names.append(name)
 
-selectors_string = "\n".join(selectors)
-filters_string = "\n".join(filters)
-xml = f'''
+
+    selectors_string = "\n".join(selectors)
+    filters_string = "\n".join(filters)
+    xml = f'''
 <RESIDUE_SELECTORS>
 {selectors_string}
 </RESIDUE_SELECTORS>
@@ -96,15 +157,15 @@ xml = f'''
 </FILTERS>
 '''
 
-objs = protocols.rosetta_scripts.XmlObjects.create_from_string(xml)
+    objs = protocols.rosetta_scripts.XmlObjects.create_from_string(xml)
 
-cp_filters = {}
-for name, hotspots in zip(names, all_hotspot_sets):
-    cp_filters[hotspots] = objs.get_filter(name)
+    cp_filters = {}
+    for name, hotspots in zip(names, all_hotspot_sets):
+        cp_filters[hotspots] = objs.get_filter(name)
 
 
-sasa_filter = objs.get_filter('interface_buried_sasa')
-cms_filter = objs.get_filter('contact_molecular_surface')
+    sasa_filter = objs.get_filter('interface_buried_sasa')
+    cms_filter = objs.get_filter('contact_molecular_surface')
 
 
 
@@ -112,9 +173,13 @@ cms_filter = objs.get_filter('contact_molecular_surface')
 
 
 
-abego_man = core.sequence.ABEGOManager()
-def get_abego(pose, seqpos):
-    return abego_man.index2symbol(abego_man.torsion2index_level1( pose.phi(seqpos), pose.psi(seqpos), pose.omega(seqpos)))
+# 0 indexed array of abego letters for every residue
+def get_abegos(pose):
+    seqposs = range(1, pose.size()+1)
+    phi = [pose.phi(seqpos) for seqpos in seqposs]
+    psi = [pose.psi(seqpos) for seqpos in seqposs]
+    omega = [pose.omega(seqpos) for seqpos in seqposs]
+    return ppi_metrics.abego_from_torsions(phi, psi, omega)
 
 
 def get_consensus(letters):
@@ -134,9 +199,11 @@ def get_consensus(letters):
 
 # this is 1 indexed with the start and end with loops converted to nearby dssp
 # and HHHHHH turns identified
-def better_dssp3(pose, length=-1, force_consensus=None, consensus_size=6):
+def better_dssp3(pose, length=-1, force_consensus=None, consensus_size=6, abegos=None):
     if ( length < 0 ):
         length = pose.size()
+    if ( abegos is None ):
+        abegos = get_abegos(pose)
 
     dssp = core.scoring.dssp.Dssp(pose)
     dssp.dssp_reduced()
@@ -164,7 +231,7 @@ def better_dssp3(pose, length=-1, force_consensus=None, consensus_size=6):
     my_dssp = "x"
 
     for seqpos in range(1, length+1):
-        abego = get_abego(pose, seqpos)
+        abego = abegos[seqpos-1]
         this_dssp = the_dssp[seqpos]
         if ( the_dssp[seqpos] == "H" and abego != "A" ):
             # print("!!!!!!!!!! Dssp - abego mismatch: %i %s %s !!!!!!!!!!!!!!!"%(seqpos, the_dssp[seqpos], abego))
@@ -200,26 +267,32 @@ def get_ss_elements2(dssp):
 
 
 
+# Secondary structure of a pose. Dssp, abego and the ss elements are computed once here
+#  and every metric reads them from this
+class PoseSecondaryStructure:
+    def __init__(self, pose):
+        self.abegos = get_abegos(pose)
+        self.dssp = better_dssp3(pose, abegos=self.abegos)
+        self.ss_elems = get_ss_elements2(self.dssp)
 
 
 
-# rosetta/main/source/src/core/select/util/SelectResiduesByLayer.cc
-def sidechain_neighbors(binder_Ca, binder_Cb, else_Ca):
-
-    conevect = binder_Cb - binder_Ca
-    conevect /= np.sqrt(np.sum(np.square(conevect), axis=-1))[:,None]
+# Accumulates the wall time of each metric so we can see where the time per design goes
+class MetricTimer:
+    def __init__(self):
+        self.timings = {}
 
-    vect = else_Ca[:,None] - binder_Cb[None,:]
-    vect_lengths = np.sqrt(np.sum(np.square(vect), axis=-1))
-    vect_normalized = vect / vect_lengths[:,:,None]
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + time.perf_counter() - start
 
-    dist_term = 1 / ( 1 + np.exp( vect_lengths - 9  ) )
 
-    angle_term = (((conevect[None,:] * vect_normalized).sum(axis=-1) + 0.5) / 1.5).clip(0, None)
 
-    sc_neigh = (dist_term * np.square( angle_term )).sum(axis=0)
 
-    return sc_neigh
 
 
 def move_chainA_far_away(pose):
@@ -237,12 +310,21 @@ def move_chainA_far_away(pose):
 
 
 scorefxn_beta_soft = core.scoring.ScoreFunctionFactory.create_score_function("beta_nov16_soft")
-def calc_ddg_norepack(pose, scorefxn):
-    pose = pose.clone()
-    
-    close_score = scorefxn(pose)
-    pose = move_chainA_far_away(pose)
-    far_score = scorefxn(pose)
+# The separated state is scored one chain at a time instead of cloning the complex and moving chain A
+#  10 km away. Same answer (test_ppi_score.py checks it against the move away version), but one clone
+#  instead of two and no full rescore of the moved complex. chains can be passed in if the caller already
+#  has pose.split_by_chain(). The complex is scored as a copy so the caller's pose and its energies are untouched
+def calc_ddg_norepack(pose, scorefxn, chains=None):
+    if ( chains is None ):
+        chains = pose.split_by_chain()
+
+    close_score = scorefxn(pose.clone())
+
+    if ( len(chains) == 2 ):
+        far_score = scorefxn(chains[1]) + scorefxn(chains[2])
+    else:
+        # chains B, C... still see each other when only A is moved away
+        far_score = scorefxn(move_chainA_far_away(pose))
 
     return close_score - far_score
 
@@ -272,18 +354,27 @@ def calc_ddg_norepack(pose, scorefxn):
 
 
 
-def score_ppi_example(pose, hotspots_ros):
+# af2_pass is for --tiered. None computes everything. Otherwise it's whether the design passes the af2
+#  part of almost_orderable and the expensive rosetta metrics are NaN for designs that can't be almost_orderable
+def score_ppi_example(pose, hotspots_ros, timer=None, af2_pass=None):
+    if ( timer is None ):
+        timer = MetricTimer()
 
     out_scores = {}
 
-    pose_in = pose.clone()
+    pose_in = pose
 
-    pose = pose.split_by_chain()[1]
+    chains = pose_in.split_by_chain()
+    pose = chains[1]
 
-    npose = nup.npose_from_pose(pose)
+    with timer('npose'):
+        npose = nup.npose_from_pose(pose)
 
-    dssp = better_dssp3(pose)
-    ss_elems = get_ss_elements2(dssp)
+    with timer('dssp'):
+        ss = PoseSecondaryStructure(pose)
+
+    dssp = ss.dssp
+    ss_elems = ss.ss_elems
 
     longest_loop = 0
     total_loop = 0
@@ -296,10 +387,11 @@ def score_ppi_example(pose, hotspots_ros):
 
     out_scores['longest_loop'] = longest_loop
 
-    ca = nu.extract_atoms(npose, [nu.CA])[:,:3]
-    cb = nu.extract_atoms(npose, [nu.CB])[:,:3]
+    with timer('sidechain_neighbors'):
+        ca = nu.extract_atoms(npose, [nu.CA])[:,:3]
+        cb = nu.extract_atoms(npose, [nu.CB])[:,:3]
 
-    sc_neigh = sidechain_neighbors( ca, cb, ca )
+        sc_neigh = ppi_metrics.sidechain_neighbors( ca, cb, ca, cutoff=SC_NEIGHBOR_CUTOFF )
 
     # is_core = sc_neigh > 5.2
     is_core = sc_neigh > 4.9
@@ -311,7 +403,8 @@ def score_ppi_example(pose, hotspots_ros):
 
 
 
-    hits, froms, tos, misses = motif_stuff2.motif_score_npose( npose )
+    with timer('motif_score'):
+        hits, froms, tos, misses = motif_stuff2.motif_score_npose( npose )
 
     froms = np.array(froms)+1
     tos = np.array(tos)+1
@@ -331,80 +424,23 @@ def score_ppi_example(pose, hotspots_ros):
     out_scores['micro_helices'] = micro_helices
 
 
-    ss_elems = list(x for x in ss_elems if x[0] != "L")
-
-
-    im_in_ss = np.zeros(pose.size()+1, int)
-    im_in_ss[:] = -1
-    for iss, (_, start, end) in enumerate(ss_elems):
-        im_in_ss[start:end+1] = iss
-
-    is_ss = im_in_ss > -1
-
-    scores = []
-    scores_sandwich = []
-    starts = []
-    any_core_in_span = []
-    window_size = 9
-    for start in range(1, pose.size()+1):
-        end = start + window_size - 1
-        if ( end > pose.size() ):
-            continue
-
-        if ( not is_ss[start:end+1].all() ):
-            continue
-
-        our_iss = im_in_ss[start]
-        if ( not (our_iss == im_in_ss[start:end+1]).all() ):
-            continue
-
-
-        from_us = (froms >= start) & (froms <= end)
-        to_us = (tos >= start) & (tos <= end)
-
-        interesting = (from_us ^ to_us)
-
-        who = np.zeros(len(from_us), np.int)
-        who[:] = -2
-        who[~from_us] = im_in_ss[froms[~from_us]]
-        who[~to_us] = im_in_ss[tos[~to_us]]
-
-        who = who[interesting]
-        who = who[who != -1]
-        who = who[who != our_iss]
-        assert( not np.any(who == -2) )
-
-        unique_who, unique_counts = np.unique(who, return_counts=True)
-        argsort = np.argsort(unique_counts)[::-1]
-        sorted_who = unique_who[argsort]
-        sorted_counts = unique_counts[argsort]
+    non_loop_elems = list(x for x in ss_elems if x[0] != "L")
 
-        hits_to_others = 0
-        if ( len(sorted_counts) >= 2 ):
-            hits_to_others = sorted_counts[1:].sum()
 
+    with timer('motif_windows'):
+        im_in_ss = np.zeros(pose.size()+1, int)
+        im_in_ss[:] = -1
+        for iss, (_, start, end) in enumerate(non_loop_elems):
+            im_in_ss[start:end+1] = iss
 
-        scores.append(hits_to_others)
-        starts.append(start)
-
-
-        if ( is_core[start-1:end].any() ):
-            any_core_in_span.append(1)
-        else:
-            any_core_in_span.append(0)
-
-    scores = np.array(scores)
-    starts = np.array(starts)
+        scores, starts, any_core_in_span = ppi_metrics.window_motif_hits(froms, tos, im_in_ss, is_core, window_size=9)
 
     out_scores['other_hits_9'] = (scores >= 1).mean()
     out_scores['any_core_9'] = np.mean(any_core_in_span)
 
 
 
-    dssp = better_dssp3(pose)
-    ss_elems = get_ss_elements2(dssp)
-
-    my_str = "".join([h for h, start, end in ss_elems if h != "L"])
+    my_str = "".join([h for h, start, end in non_loop_elems])
 
     out_scores['scaff_dssp'] = my_str
 
@@ -419,36 +455,57 @@ def score_ppi_example(pose, hotspots_ros):
 
 
 
-    pose = pose_in.clone()
+    pose = pose_in
 
-    out_scores['ddg_norepack_soft'] = calc_ddg_norepack(pose, scorefxn_beta_soft)
+    with timer('hotspots'):
+        monomer_size = pose.conformation().chain_end(1)
+        npose = nup.npose_from_pose(pose)
 
+        Cbs = nu.extract_atoms(npose, [nu.CB])[:,:3]
 
-    cp_filter = cp_filters[hotspots_ros]
+        hotspots_idx0 = [int(x) + monomer_size - 1 for x in hotspots_ros.split(',')]
 
-    out_scores['contact_patch'] = cp_filter.report_sm(pose)
+        binder_Cbs = Cbs[:monomer_size]
+        hotspot_Cbs = Cbs[hotspots_idx0]
 
-    monomer_size = pose.conformation().chain_end(1)
-    npose = nup.npose_from_pose(pose)
+        hotspot_dist_binder = np.linalg.norm( hotspot_Cbs[:,None] - binder_Cbs[None,:], axis=-1)
 
-    Cbs = nu.extract_atoms(npose, [nu.CB])[:,:3]
+        hotspot_closest_binder = hotspot_dist_binder.min(axis=-1)
+    assert len(hotspot_closest_binder) == hotspots_ros.count(',') + 1
 
-    hotspots_idx0 = [int(x) + monomer_size - 1 for x in hotspots_ros.split(',')]
+    hotspot_satisfied7 = (hotspot_closest_binder < 7).mean()
+    hotspot_satisfied10 = (hotspot_closest_binder < 10).mean()
 
-    binder_Cbs = Cbs[:monomer_size]
-    hotspot_Cbs = Cbs[hotspots_idx0]
+    run_rosetta = tiered_runs_rosetta(af2_pass, hotspot_satisfied10)
 
-    hotspot_dist_binder = np.linalg.norm( hotspot_Cbs[:,None] - binder_Cbs[None,:], axis=-1)
 
-    hotspot_closest_binder = hotspot_dist_binder.min(axis=-1)
-    assert len(hotspot_closest_binder) == hotspots_ros.count(',') + 1
+    if ( run_rosetta ):
+        with timer('ddg_norepack_soft'):
+            out_scores['ddg_norepack_soft'] = calc_ddg_norepack(pose, scorefxn_beta_soft, chains)
+    else:
+        out_scores['ddg_norepack_soft'] = np.nan
+
+
+    cp_filter = cp_filters[hotspots_ros]
+
+    if ( run_rosetta ):
+        with timer('contact_patch'):
+            out_scores['contact_patch'] = cp_filter.report_sm(pose)
+    else:
+        out_scores['contact_patch'] = np.nan
 
-    out_scores['hotspot_satisfied7'] = (hotspot_closest_binder < 7).mean()
-    out_scores['hotspot_satisfied10'] = (hotspot_closest_binder < 10).mean()
+    out_scores['hotspot_satisfied7'] = hotspot_satisfied7
+    out_scores['hotspot_satisfied10'] = hotspot_satisfied10
 
 
-    out_scores['delta_sasa'] = sasa_filter.report_sm(pose)
-    out_scores['contact_molecular_surface'] = cms_filter.report_sm(pose)
+    if ( run_rosetta ):
+        with timer('delta_sasa'):
+            out_scores['delta_sasa'] = sasa_filter.report_sm(pose)
+        with timer('contact_molecular_surface'):
+            out_scores['contact_molecular_surface'] = cms_filter.report_sm(pose)
+    else:
+        out_scores['delta_sasa'] = np.nan
+        out_scores['contact_molecular_surface'] = np.nan
 
 
 
@@ -466,133 +523,224 @@ def score_ppi_example(pose, hotspots_ros):
 
 
 
-####################### main ##############################
+####################### cache ##############################
 
 
+# Key on the exact pdb contents, the hotspots it was scored against and the scoring code version
+#  --tiered entries depend on the af2 gate too since they may be missing the rosetta metrics
+def design_cache_key(pdb, hotspots_ros, af2_pass=None):
+    h = hashlib.sha1()
+    with open(pdb, 'rb') as f:
+        h.update(f.read())
+    h.update(f"{hotspots_ros} {SCORE_VERSION}".encode())
+    if ( not af2_pass is None ):
+        h.update(f" tiered {af2_pass}".encode())
+    return h.hexdigest()
 
-af2_df = pd.read_csv(args.af2_scores, sep='\s+')
-af2_df = af2_df.drop_duplicates('description')
 
+def target_cache_key(pdb, hotspots_diffusion):
+    h = hashlib.sha1()
+    with open(pdb, 'rb') as f:
+        h.update(f.read())
+    h.update(f"target {hotspots_diffusion}".encode())
+    return h.hexdigest()
 
-results = []
 
-for pdb in args.af2_outputs:
-    print("Attempting:", pdb)
-    tag = os.path.basename(pdb).replace('.pdb', '')
+def cache_fname(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], key + ".json")
 
-    target = re.sub('_bb.*', '', tag)
-    bb = re.sub('_mpnn.*', '', tag)
-    mpnn = re.sub('_oracle', '', tag)
 
-    target_info = target_to_info[target]
+def cache_load(cache_dir, key):
+    fname = cache_fname(cache_dir, key)
+    if ( not os.path.exists(fname) ):
+        return None
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except ValueError:
+        # half written by a job that died, just rescore it
+        return None
 
-    pose = pose_from_file(pdb)
 
-    # reset the numbering to make everything easier
-    pose.pdb_info(core.pose.PDBInfo(pose))
+# Write then rename so that a crash never leaves a truncated entry behind
+def cache_store(cache_dir, key, out_scores):
+    fname = cache_fname(cache_dir, key)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
 
+    out_scores = {k: (v.item() if isinstance(v, np.generic) else v) for k, v in out_scores.items()}
 
-    af2_rows = af2_df[af2_df['description'] == tag]
-    assert len(af2_rows) == 1, tag
+    tmp_fname = f"{fname}.{os.getpid()}.tmp"
+    with open(tmp_fname, "w") as f:
+        json.dump(out_scores, f)
+    os.replace(tmp_fname, fname)
 
-    af2_row = af2_rows.iloc[0]
 
 
-    out_scores = score_ppi_example(pose, target_info['hotspots_ros'])
+####################### main ##############################
 
 
-    copy_from_af2 = ['plddt_binder', 'pae_interaction', 'binder_rmsd', 'interface_rmsd', 'description']
-    for key in copy_from_af2:
-        out_scores[key] = af2_row[key]
+# Everything score_ppi_example() times, in the order the columns of score_timings.csv come in
+TIMED_METRICS = ['load_pose', 'npose', 'dssp', 'sidechain_neighbors', 'motif_score', 'motif_windows', 'hotspots',
+                'ddg_norepack_soft', 'contact_patch', 'delta_sasa', 'contact_molecular_surface']
 
 
-    out_scores['target'] = target
-    out_scores['bb'] = bb
-    out_scores['mpnn'] = mpnn
-    out_scores['description'] = tag
+# Runs in the worker processes (or inline for --workers 1)
+def score_pdb(job):
+    pdb, hotspots_ros, af2_pass = job
+    print("Attempting:", pdb)
 
-    # print(out_scores)
+    timer = MetricTimer()
 
-    results.append(out_scores)
+    with timer('load_pose'):
+        pose = pose_from_file(pdb)
 
+        # reset the numbering to make everything easier
+        pose.pdb_info(core.pose.PDBInfo(pose))
 
-df = pd.DataFrame(results)
+    out_scores = score_ppi_example(pose, hotspots_ros, timer, af2_pass)
 
+    return out_scores, timer.timings
 
 
-# df = pd.read_csv('score_individual.csv')
-df['pass_longxing_monomer'] = (df['other_hits_9'] > 0.85) & (df['any_core_9'] > 0.85) & (df['longest_loop'] < 8)
-df['pass_plddt85'] = df['plddt_binder'] > 85
-df['pass_plddt90'] = df['plddt_binder'] > 90
-df['pass_hotspots'] = df['hotspot_satisfied10'] >= 0.75
-df['pass_rmsd'] = df['interface_rmsd'] < 4
-df['pass_pae15'] = (df['pae_interaction'] < 15) & df['pass_rmsd'] & df['pass_hotspots']
-df['pass_pae10'] = (df['pae_interaction'] < 10) & df['pass_rmsd'] & df['pass_hotspots']
-df['pass_pae5'] = (df['pae_interaction'] < 5) & df['pass_rmsd'] & df['pass_hotspots']
+# imap() keeps the input order so the output files are identical no matter how many workers there are
+def score_all(jobs, all_hotspot_sets, workers):
+    if ( workers <= 1 ):
+        setup_filters(all_hotspot_sets)
+        for job in jobs:
+            yield score_pdb(job)
+        return
 
+    # spawn so that every worker does its own rosetta init instead of inheriting a forked one
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(workers, initializer=setup_filters, initargs=(all_hotspot_sets,)) as pool:
+        yield from pool.imap(score_pdb, jobs)
 
-df['excellent'] = df['pass_pae5'] & df['pass_plddt90']
-df['orderable'] = df['pass_pae10'] & df['pass_plddt90']
-df['almost_orderable'] = df['pass_pae15'] & df['pass_plddt85']
 
-df['excellent_sane'] = df['excellent'] & df['pass_longxing_monomer']
-df['orderable_sane'] = df['orderable'] & df['pass_longxing_monomer']
-df['almost_orderable_sane'] = df['almost_orderable'] & df['pass_longxing_monomer']
+def main(argv):
+    args = parse_args(argv)
 
-df.to_csv('score_individual.sc', sep=' ', index=None, na_rep='NaN')
-df.to_csv('score_individual.csv', index=None, na_rep='NaN')
+    if ( args.summarize_only ):
+        if ( pa is None ):
+            sys.exit("--summarize_only reads %s and needs pyarrow, pip install pyarrow"%args.stream_file)
+        stream_file = args.stream_file
+        if ( not os.path.exists(stream_file) and os.path.exists(partial_stream_fname(stream_file)) ):
+            stream_file = partial_stream_fname(stream_file)
+            print("Warning: %s doesn't exist, summarizing %s from a run that didn't finish"%(
+                                                                            args.stream_file, stream_file))
+        write_score_outputs(read_score_stream(stream_file))
+        return
 
+    target_to_info, all_hotspot_sets = load_target_info(args.inputs_txt, args.cache_dir)
 
-mean_scores = ['excellent', 'orderable', 'almost_orderable', 'excellent_sane', 'orderable_sane', 'almost_orderable_sane',
-                'hotspot_satisfied7', 'hotspot_satisfied10', 'frac_H', 'frac_E', 'frac_L', ]
+    af2_index, af2_duplicates = load_af2_index(args.af2_scores)
 
-mean_only_of_almost_orderable = ['ddg_norepack_soft', 'contact_patch', 'delta_sasa', 'contact_molecular_surface']
 
+    jobs = []
+    af2_rows = []
+    af2_missing = []
+    unknown_targets = {}
+    for pdb in args.af2_outputs:
+        tag = os.path.basename(pdb).replace('.pdb', '')
 
-summary_results = {}
+        target = re.sub('_bb.*', '', tag)
 
-for term in mean_scores:
-    summary_results[term] = df[term].mean()
+        target_info = target_to_info.get(target)
 
+        if ( target_info is None ):
+            unknown_targets[tag] = target
+            continue
 
-for term in mean_only_of_almost_orderable:
-    each_target = []
-    for target, subdf in df.groupby('target'):
-        subdf = subdf[subdf['almost_orderable']]
-        if len(subdf) == 0:
-            each_target.append(np.nan)
-        else:
-            each_target.append(subdf[term].mean())
+        if ( tag not in af2_index ):
+            af2_missing.append(tag)
+            continue
 
-    summary_results[term] = np.mean(each_target)
+        af2_row = af2_index[tag]
+        af2_pass = passes_af2_gates(af2_row) if args.tiered else None
 
+        af2_rows.append(af2_row)
+        jobs.append((pdb, target_info['hotspots_ros'], af2_pass))
 
-print(summary_results)
+    if ( len(jobs) == 0 ):
+        report_af2_problems(args.af2_scores, len(args.af2_outputs), af2_duplicates, af2_missing,
+                                                                                unknown_targets)
+        sys.exit(1)
 
-summary_df = pd.DataFrame([summary_results])
-summary_df.to_csv('final_scores.csv', index=None, na_rep='NaN')
-summary_df.to_csv('final_scores.sc', index=None, sep=' ', na_rep='NaN')
 
+    # Only whether each design is in the cache is decided up front. The entries themselves are loaded one at
+    #  a time in the loop below so memory doesn't grow with the number of designs
+    cache_keys = [None] * len(jobs)
+    in_cache = [False] * len(jobs)
+    if ( args.cache_dir ):
+        cache_keys = [design_cache_key(*job) for job in jobs]
+        in_cache = [os.path.exists(cache_fname(args.cache_dir, key)) for key in cache_keys]
 
+    todo = [job for job, found in zip(jobs, in_cache) if not found]
+    print("Found %i of %i designs in the score cache"%(len(jobs) - len(todo), len(jobs)))
 
+    new_scores = score_all(todo, all_hotspot_sets, args.workers)
 
 
+    if ( pa is None ):
+        print("pyarrow is not installed, keeping all scores in memory instead of streaming to", args.stream_file)
+        score_stream = InMemoryScoreStream()
+    else:
+        score_stream = ScoreStreamWriter(args.stream_file, args.flush_every)
 
+    timing_writer = TimingWriter('score_timings.csv', TIMED_METRICS) if args.timing else None
+    filters_ready = False
 
+    for job, af2_row, cache_key, found in zip(jobs, af2_rows, cache_keys, in_cache):
+        pdb = job[0]
+        out_scores = cache_load(args.cache_dir, cache_key) if found else None
 
+        if ( out_scores is None ):
+            if ( found ):
+                # the entry was there but half written by a job that died, score it here
+                if ( not filters_ready ):
+                    setup_filters(all_hotspot_sets)
+                    filters_ready = True
+                out_scores, timings = score_pdb(job)
+            else:
+                out_scores, timings = next(new_scores)
+            if ( timing_writer ):
+                timing_writer.append(os.path.basename(pdb).replace('.pdb', ''), timings)
+            if ( args.cache_dir ):
+                cache_store(args.cache_dir, cache_key, out_scores)
 
+        tag = os.path.basename(pdb).replace('.pdb', '')
 
+        target = re.sub('_bb.*', '', tag)
+        bb = re.sub('_mpnn.*', '', tag)
+        mpnn = re.sub('_oracle', '', tag)
 
 
+        for key in COPY_FROM_AF2:
+            out_scores[key] = af2_row[key]
 
 
+        out_scores['target'] = target
+        out_scores['bb'] = bb
+        out_scores['mpnn'] = mpnn
+        out_scores['description'] = tag
 
+        # print(out_scores)
 
+        score_stream.append(out_scores)
 
+    score_stream.close()
 
 
+    if ( timing_writer ):
+        timing_writer.close()
 
 
+    write_score_outputs(score_stream.read_chunks())
 
 
+    # Report these all at once at the end instead of dying on the first one
+    if ( not report_af2_problems(args.af2_scores, len(args.af2_outputs), af2_duplicates, af2_missing,
+                                                                                unknown_targets) ):
+        sys.exit(1)
 
+if __name__ == '__main__':
+    main(sys.argv[1:])
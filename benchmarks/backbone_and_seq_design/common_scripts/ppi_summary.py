@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# Pandas pieces of ppi_score.py: the af2 score table, the score stream and the summary. No rosetta in here
+#  so that they can be tested without a pyrosetta install
+
+import os
+import csv
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401, pa.ipc needs the submodule imported
+except ImportError:
+    pa = None
+
+
+
+####################### af2 scores ##############################
+
+
+COPY_FROM_AF2 = ['plddt_binder', 'pae_interaction', 'binder_rmsd', 'interface_rmsd', 'description']
+
+
+# Streams the af2 score file in chunks, only keeping the columns we copy, into a dict keyed by description
+#  The first row of each description wins like drop_duplicates() did. Returns index, duplicated descriptions
+def load_af2_index(af2_scores, chunksize=100000):
+    af2_index = {}
+    duplicates = set()
+
+    for chunk in pd.read_csv(af2_scores, sep=r'\s+', usecols=COPY_FROM_AF2, chunksize=chunksize):
+        for row in chunk[COPY_FROM_AF2].itertuples(index=False):
+            row = dict(zip(COPY_FROM_AF2, row))
+            tag = row['description']
+            if ( tag in af2_index ):
+                duplicates.add(tag)
+                continue
+            af2_index[tag] = row
+
+    return af2_index, duplicates
+
+
+# The af2 half of almost_orderable from add_pass_columns(). The hotspot half needs the pose
+def passes_af2_gates(af2_row):
+    pass_plddt85 = af2_row['plddt_binder'] > 85
+    pass_rmsd = af2_row['interface_rmsd'] < 4
+    return bool( pass_plddt85 and pass_rmsd and af2_row['pae_interaction'] < 15 )
+
+
+# --tiered only runs the rosetta metrics when this is True. They only go into the summary for almost_orderable
+#  designs, and a design that fails this can't be almost_orderable. af2_pass None means not tiered
+def tiered_runs_rosetta(af2_pass, hotspot_satisfied10):
+    return af2_pass is None or bool( af2_pass and hotspot_satisfied10 >= 0.75 )
+
+
+# Returns False if any designs couldn't be scored. unknown_targets maps designs to the target we guessed from
+#  their name that isn't in inputs.txt
+def report_af2_problems(af2_scores, n_designs, duplicates, missing, unknown_targets={}):
+    if ( len(duplicates) > 0 ):
+        print("Warning: %i descriptions appear more than once in %s, used the first row of each:"%(
+                                                                    len(duplicates), af2_scores))
+        print("  " + " ".join(sorted(duplicates)))
+
+    if ( len(missing) > 0 ):
+        print("Error: %i of %i designs have no row in %s and were not scored:"%(len(missing), n_designs, af2_scores))
+        print("  " + " ".join(missing))
+
+    if ( len(unknown_targets) > 0 ):
+        print("Error: %i of %i designs are for targets that aren't in inputs.txt and were not scored:"%(
+                                                                    len(unknown_targets), n_designs))
+        print("  " + " ".join("%s (%s)"%(tag, target) for tag, target in unknown_targets.items()))
+
+    return len(missing) == 0 and len(unknown_targets) == 0
+
+
+
+####################### output ##############################
+
+
+# Rows are written to an append-only arrow ipc stream in chunks of flush_every while scoring runs
+#  so memory doesn't grow with the number of designs and a crash keeps everything flushed so far
+#  The stream is fname.partial until close() renames it, so the last complete run's stream is never truncated
+class ScoreStreamWriter:
+    def __init__(self, fname, flush_every=100):
+        self.fname = fname
+        self.partial_fname = partial_stream_fname(fname)
+        self.flush_every = flush_every
+        self.pending = []
+        self.sink = None
+        self.writer = None
+        self.schema = None
+
+    def append(self, out_scores):
+        self.pending.append(out_scores)
+        if ( len(self.pending) >= self.flush_every ):
+            self.flush()
+
+    def flush(self):
+        if ( len(self.pending) == 0 ):
+            return
+        table = pa.Table.from_pandas(pd.DataFrame(self.pending), preserve_index=False)
+        if ( self.writer is None ):
+            self.schema = table.schema
+            self.sink = pa.OSFile(self.partial_fname, 'wb')
+            self.writer = pa.ipc.new_stream(self.sink, self.schema)
+        # a chunk where a column happened to be all NaN/None can come out as a different type
+        self.writer.write_table(table.cast(self.schema))
+        self.sink.flush()
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        if ( not self.writer is None ):
+            self.writer.close()
+            self.sink.close()
+            os.replace(self.partial_fname, self.fname)
+
+    def read_chunks(self):
+        return read_score_stream(self.fname)
+
+
+# Stand in for ScoreStreamWriter when pyarrow isn't around
+class InMemoryScoreStream:
+    def __init__(self):
+        self.results = []
+
+    def append(self, out_scores):
+        self.results.append(out_scores)
+
+    def close(self):
+        pass
+
+    def read_chunks(self):
+        yield pd.DataFrame(self.results)
+
+
+def partial_stream_fname(fname):
+    return fname + ".partial"
+
+
+# Yields a DataFrame per flushed chunk. Stops quietly at a chunk that was cut off by a crash
+def read_score_stream(fname):
+    if ( pa is None ):
+        raise ImportError("reading the score stream %s needs pyarrow, pip install pyarrow"%fname)
+    with pa.OSFile(fname, 'rb') as source:
+        reader = pa.ipc.open_stream(source)
+        while True:
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                return
+            except (pa.ArrowInvalid, OSError) as e:
+                print("Warning: %s ends in a partial chunk, ignoring it: %s"%(fname, e))
+                return
+            yield batch.to_pandas()
+
+
+# Appends the per-metric times of each scored design to score_timings.csv as they come in and keeps
+#  only the running sums for the mean it prints at the end
+class TimingWriter:
+    def __init__(self, fname, columns):
+        self.fname = fname
+        self.columns = ['description'] + list(columns)
+        self.f = None
+        self.writer = None
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def append(self, description, timings):
+        if ( self.writer is None ):
+            self.f = open(self.fname, 'w', newline='')
+            self.writer = csv.DictWriter(self.f, self.columns, restval='NaN')
+            self.writer.writeheader()
+        self.writer.writerow(dict(timings, description=description))
+        for name, seconds in timings.items():
+            self.sums[name] += seconds
+            self.counts[name] += 1
+
+    def close(self):
+        if ( self.f is None ):
+            return
+        self.f.close()
+        print("Mean seconds per design:")
+        means = pd.Series({name: self.sums[name] / self.counts[name] for name in self.sums})
+        print(means.sort_values(ascending=False).to_string())
+
+
+def add_pass_columns(df):
+    df['pass_longxing_monomer'] = (df['other_hits_9'] > 0.85) & (df['any_core_9'] > 0.85) & (df['longest_loop'] < 8)
+    df['pass_plddt85'] = df['plddt_binder'] > 85
+    df['pass_plddt90'] = df['plddt_binder'] > 90
+    df['pass_hotspots'] = df['hotspot_satisfied10'] >= 0.75
+    df['pass_rmsd'] = df['interface_rmsd'] < 4
+    df['pass_pae15'] = (df['pae_interaction'] < 15) & df['pass_rmsd'] & df['pass_hotspots']
+    df['pass_pae10'] = (df['pae_interaction'] < 10) & df['pass_rmsd'] & df['pass_hotspots']
+    df['pass_pae5'] = (df['pae_interaction'] < 5) & df['pass_rmsd'] & df['pass_hotspots']
+
+
+    df['excellent'] = df['pass_pae5'] & df['pass_plddt90']
+    df['orderable'] = df['pass_pae10'] & df['pass_plddt90']
+    df['almost_orderable'] = df['pass_pae15'] & df['pass_plddt85']
+
+    df['excellent_sane'] = df['excellent'] & df['pass_longxing_monomer']
+    df['orderable_sane'] = df['orderable'] & df['pass_longxing_monomer']
+    df['almost_orderable_sane'] = df['almost_orderable'] & df['pass_longxing_monomer']
+
+    return df
+
+
+MEAN_SCORES = ['excellent', 'orderable', 'almost_orderable', 'excellent_sane', 'orderable_sane', 'almost_orderable_sane',
+                'hotspot_satisfied7', 'hotspot_satisfied10', 'frac_H', 'frac_E', 'frac_L', ]
+
+MEAN_ONLY_OF_ALMOST_ORDERABLE = ['ddg_norepack_soft', 'contact_patch', 'delta_sasa', 'contact_molecular_surface']
+
+
+# The summary as running sums, so it can be built a chunk at a time. NaNs are skipped like DataFrame.mean()
+#  The almost_orderable terms are averaged per target first and then over targets
+class ScoreSummary:
+    def __init__(self):
+        self.sums = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.target_sums = defaultdict(float)
+        self.target_counts = defaultdict(int)
+        self.targets = set()
+
+    def add(self, df):
+        for term in MEAN_SCORES:
+            values = df[term].astype(float)
+            self.sums[term] += values.sum()
+            self.counts[term] += int(values.notna().sum())
+
+        self.targets.update(df['target'])
+        ao = df[df['almost_orderable'].astype(bool)]
+        for term in MEAN_ONLY_OF_ALMOST_ORDERABLE:
+            grouped = ao.groupby('target')[term]
+            for target, value in grouped.sum().items():
+                self.target_sums[(term, target)] += value
+            for target, count in grouped.count().items():
+                self.target_counts[(term, target)] += count
+
+    def results(self):
+        summary_results = {}
+
+        for term in MEAN_SCORES:
+            summary_results[term] = self.sums[term] / self.counts[term] if self.counts[term] else np.nan
+
+        for term in MEAN_ONLY_OF_ALMOST_ORDERABLE:
+            each_target = []
+            for target in sorted(self.targets):
+                count = self.target_counts[(term, target)]
+                each_target.append(self.target_sums[(term, target)] / count if count else np.nan)
+
+            summary_results[term] = np.mean(each_target)
+
+        return summary_results
+
+
+# Writes score_individual.sc/.csv a chunk at a time and then final_scores.sc/.csv
+#  Only the running sums of the summary are kept between chunks, so memory doesn't grow with the designs
+def write_score_outputs(chunks):
+    summary = ScoreSummary()
+
+    first = True
+    for df in chunks:
+        df = add_pass_columns(df)
+
+        mode = 'w' if first else 'a'
+        df.to_csv('score_individual.sc', sep=' ', index=None, na_rep='NaN', mode=mode, header=first)
+        df.to_csv('score_individual.csv', index=None, na_rep='NaN', mode=mode, header=first)
+        first = False
+
+        summary.add(df)
+
+    summary_results = summary.results()
+
+    print(summary_results)
+
+    summary_df = pd.DataFrame([summary_results])
+    summary_df.to_csv('final_scores.csv', index=None, na_rep='NaN')
+    summary_df.to_csv('final_scores.sc', index=None, sep=' ', na_rep='NaN')
+
+    return summary_results
@@ -1,9 +1,27 @@
 import os
 
-from mlb.specifications import *
-from mlb import *
-from mlb.backend import *
-from mlb.frontend import *
+try:
+    import ipd
+except ImportError as e:
+    # benchmark hosts only need mlb.run, which doesn't use ipd or the server stack. Anything broken inside
+    # ipd itself should still fail here, not later as a missing mlb attribute
+    if e.name != 'ipd': raise
+    ipd = None
+
+if ipd:
+    from mlb.specifications import *
+    from mlb import *
+    from mlb.backend import *
+    from mlb.frontend import *
+else:
+
+    def __getattr__(name):
+        msg = f"module 'mlb' has no attribute {name!r}"
+        if not name.startswith('__'): msg += ', ipd is not installed so only mlb.run is available'
+        raise AttributeError(msg)
+
+# after the star imports, or mlb.run would be the backend's run() instead of the package
+import mlb.run
 
 projdir = os.path.realpath(os.path.dirname(__file__))
 profiler = lambda f: f
@@ -1,2 +1,10 @@
+from mlb.backend.asyncdb import *
 from mlb.backend.backend import *
+from mlb.backend.dbops import *
+from mlb.backend.dbprofile import *
 from mlb.backend.gitea import *
+from mlb.backend import asyncdb, backend, dbops, dbprofile, gitea
+from mlb.backend.backend import run
+
+# without run, star importing mlb.backend would put it in place of the mlb.run package
+__all__ = asyncdb.__all__ + backend.__all__ + dbops.__all__ + dbprofile.__all__ + gitea.__all__
@@ -0,0 +1,20 @@
+"""async engines for MLBBackend, so a slow query waits on the event loop instead of holding a worker thread"""
+import sqlalchemy
+
+__all__ = ['ASYNC_DRIVERS', 'async_url', 'async_engine']
+
+ASYNC_DRIVERS = dict(sqlite='sqlite+aiosqlite', postgresql='postgresql+asyncpg')
+
+def async_url(url):
+    """the async driver version of a sync database url, like sqlite:///x.db to sqlite+aiosqlite:///x.db"""
+    url = sqlalchemy.engine.make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    assert driver, f'no async driver for {url.get_backend_name()} databases'
+    return url.set(drivername=driver)
+
+def async_engine(url, **kw):
+    """create_async_engine for a sync or async url. Needs aiosqlite or asyncpg installed"""
+    from sqlalchemy.ext.asyncio import create_async_engine
+    url = sqlalchemy.engine.make_url(url)
+    if '+aiosqlite' not in url.drivername and '+asyncpg' not in url.drivername: url = async_url(url)
+    return create_async_engine(url, **kw)
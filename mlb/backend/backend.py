@@ -1,10 +1,452 @@
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+
+import pydantic
+import sqlalchemy
+import sqlmodel
+import uvicorn
+from fastapi import Body, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
 import ipd
 import mlb
+from mlb.backend.asyncdb import async_engine
+from mlb.backend.dbops import count_changes, new_rows, read_changes, touuid, upsert_rows
+from mlb.backend.dbprofile import set_sqlite_pragmas, sqlite_engine
+
+__all__ = ['MLBBackend', 'spec_fields', 'eager_options', 'graph_dict', 'index_columns', 'create_indexes']
+
+# the column each list filter needs
+LIST_FILTER_COLUMNS = dict(prefix='name', user='userid', kind_is='kind', since='datecreated',
+                           until='datecreated')
 
 class MLBBackend(ipd.crud.BackendBase, models=mlb.specs):
-    def __init__(self, dbengine, datadir):
+    async_engine = None
+    change_kinds = None
+
+    def __init__(self, dbengine, datadir, sqlite_profile=False, async_db=False, count_changes=False):
+        """sqlite_profile opens a sqlite file dbengine again with sqlite_engine, async_db calls enable_async,
+        count_changes enable_change_counts. Every request commits on its own, with the profile's WAL and
+        synchronous=NORMAL that is no fsync"""
+        if sqlite_profile and dbengine.dialect.name == 'sqlite' and dbengine.url.database:
+            dbengine = sqlite_engine(dbengine.url)
         super().__init__(dbengine)
         self.datadir = datadir
+        self.dbengine = dbengine
+        self.sqlite_profile = sqlite_profile
+        self.indexes = create_indexes(dbengine, self.dbtables())
+        self.bulk_session = sqlalchemy.orm.sessionmaker(dbengine, class_=sqlmodel.Session,
+                                                        expire_on_commit=False)
+        self.spec_of_kind = {Spec.modelkind(): Spec for Spec in mlb.specs}
+        self.mlb_routes = []
+        if async_db: self.enable_async()
+        if count_changes: self.enable_change_counts()
+        self.add_route('/api/upsert_many', self.upsert_many_route, 'POST')
+        self.add_route('/api/newmany/{kind}', self.newmany_route, 'POST')
+        self.add_route('/api/changes', self.changes_route)
+        self.add_route('/api/features', self.features_route)
+        self.add_route('/api/row/{kind}/{key}', self.row_route)
+        self.add_route('/api/graph/{kind}', self.graph_route)
+        self.add_route('/api/page/{kind}', self.page_route)
+        self.add_route('/api/stream/{kind}', self.stream_route)
+
+    def add_route(self, path, func, method='GET'):
+        """add_api_route, but ahead of the routes ipd.crud added, so that one like /api/{kind}/{x} can't take
+        /api/page/user"""
+        self.app.add_api_route(path, func, methods=[method])
+        routes = self.app.router.routes
+        routes.insert(len(self.mlb_routes), routes.pop())
+        self.mlb_routes.append(routes[len(self.mlb_routes)])
+
+    def dbmodel(self, kind):
+        return self.__backend_models__[kind]
+
+    def dbtables(self):
+        """the tables of the spec models and the link tables between them"""
+        tables = {}
+        for Model in self.__backend_models__.values():
+            tables[Model.__table__.name] = Model.__table__
+            for rel in sqlalchemy.inspect(Model).relationships:
+                if rel.secondary is not None: tables[rel.secondary.name] = rel.secondary
+        return list(tables.values())
+
+    def enable_change_counts(self):
+        """count the writes to each kind in the changes table, for /api/changes. Off by default, as each
+        write transaction on this backend's engines then also updates the count row of each kind it wrote"""
+        if self.change_kinds is not None: return
+        self.change_kinds = {Model: kind for kind, Model in self.__backend_models__.items()}
+        count_changes(self.dbengine, self.change_kinds)
+        if self.async_engine: count_changes(self.async_engine.sync_engine, self.change_kinds, create=False)
+
+    def changes_route(self) -> dict[str, int]:
+        """how many writes each kind has had, from the changes table, so client caches can tell what is stale
+        without refetching it. Empty unless enable_change_counts was called"""
+        if self.change_kinds is None: return {}
+        with self.dbengine.connect() as conn:
+            return read_changes(conn)
+
+    def features_route(self) -> dict[str, bool]:
+        """what optional parts this server has, async_db for the /api/async routes and change_counts for
+        /api/changes"""
+        return dict(async_db=self.async_engine is not None, change_counts=self.change_kinds is not None)
+
+    def row(self, kind, key):
+        """the row of kind with name or id key, as a dict"""
+        Model = self.model_or_404(kind)
+        match = Model.id == id if (id := touuid(key)) else Model.name == key
+        with sqlmodel.Session(self.dbengine) as session:
+            row = session.exec(sqlmodel.select(Model).where(match)).first()
+            if row is None: raise HTTPException(404, f'no {kind} {key}')
+            return graph_dict(row, 0)
+
+    def row_route(self, kind: str, key: str) -> dict:
+        return self.row(kind, key)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """a session of its own for one bulk write, committed at the end or rolled back if anything fails.
+        The session the other requests share is never touched"""
+        with self.bulk_session() as session, session.begin():
+            yield session
+
+    def ref_defaults(self, kind):
+        """defaults of the spec's ref fields, like user=getuser(), that the db model can't fill in itself"""
+        Spec, columns = self.spec_of_kind[kind], self.dbmodel(kind).__table__.columns
+        defaults = {}
+        for name, field in Spec.model_fields.items():
+            if name in columns or f'{name}id' not in columns or field.is_required(): continue
+            defaults[name] = field.get_default(call_default_factory=True)
+        return defaults
+
+    def newmany(self, kind, specs):
+        """a kind row for each of specs in one transaction. Returns the ids"""
+        with self.transaction() as session:
+            items = [spec_fields(spec) for spec in specs]
+            return [row.id for row in new_rows(session, self.dbmodel(kind), items, self.ref_defaults(kind))]
+
+    def upsert_many(self, specs):
+        """specs of any kinds, as Spec objects or (kind, fields) pairs, in one transaction. Specs whose name is
+        already in the db update that row's columns, the rest are created. Kinds are done in the order
+        they first appear, so put users before the groups that refer to them. Returns the ids"""
+        bykind = specs_bykind(specs)
+        with self.transaction() as session:
+            return self.upsert_bykind(session, bykind, len(specs))
+
+    def upsert_bykind(self, session, bykind, nspecs):
+        ids = [None] * nspecs
+        for kind, items in bykind.items():
+            fields = [fields for _, fields in items]
+            rows = upsert_rows(session, self.dbmodel(kind), fields, self.ref_defaults(kind))
+            for (i, _), row in zip(items, rows):
+                ids[i] = row.id
+        return ids
+
+    def graph(self, kind, names=None, depth=2, include=None):
+        """rows of kind (all, or those with the given names or ids) as nested dicts, following relationships
+        depth levels down, or only those named in include. Each level is one selectin query for the whole
+        level, so a protocol with its methods, their params/results and those vars is a handful of queries
+        however many methods it has"""
+        query, include = self.graph_query(kind, names, depth, include)
+        with sqlmodel.Session(self.dbengine) as session:
+            return [graph_dict(row, depth, include) for row in session.exec(query)]
+
+    def graph_query(self, kind, names, depth, include):
+        Model = self.dbmodel(kind)
+        include = set(include.split() if isinstance(include, str) else include) if include else None
+        query = sqlmodel.select(Model).options(*eager_options(Model, depth, include))
+        if names is not None:
+            ids = [id for id in map(touuid, names) if id]
+            match = [Model.id.in_(ids)]
+            if hasattr(Model, 'name'): match.append(Model.name.in_([str(n) for n in names]))
+            query = query.where(sqlalchemy.or_(*match))
+        return query, include
+
+    def graph_route(self, kind: str, names: list[str] | None = Query(None), depth: int = 2,
+                    include: str = '') -> list[dict]:
+        return self.graph(kind, names, depth, include)
+
+    def list_query(self, kind, after=None, prefix=None, user=None, kind_is=None, since=None, until=None):
+        """select rows of kind in id order, starting after the id after. Filters are a name prefix, the
+        creating user's name or id, the row's own kind field and a datecreated range. A filter on a column
+        kind doesn't have is a 400, an after that isn't an id a 422"""
+        Model = self.model_or_404(kind)
+        given = dict(prefix=prefix, user=user, kind_is=kind_is, since=since, until=until)
+        for name, column in LIST_FILTER_COLUMNS.items():
+            if given[name] and not hasattr(Model, column):
+                raise HTTPException(400, f'{kind} has no {column}, it can\'t be filtered by {name}')
+        query = sqlmodel.select(Model).order_by(Model.id)
+        if after:
+            if (after_id := touuid(after)) is None:
+                raise HTTPException(422, f'after must be an id, not {after!r}')
+            query = query.where(Model.id > after_id)
+        if prefix: query = query.where(Model.name.startswith(prefix, autoescape=True))
+        if user:
+            User = self.dbmodel('user')
+            userid = touuid(user) or sqlmodel.select(User.id).where(User.name == user).scalar_subquery()
+            query = query.where(Model.userid == userid)
+        if kind_is: query = query.where(Model.kind == kind_is)
+        if since: query = query.where(Model.datecreated >= since)
+        if until: query = query.where(Model.datecreated < until)
+        return query
+
+    def page(self, kind, after=None, limit=1000, **filters):
+        """up to limit rows of kind after the id after, as dicts, and the id to pass as after for the next
+        page, None at the end. Keyset paging, so every page is an index range scan however deep it is"""
+        with sqlmodel.Session(self.dbengine) as session:
+            rows = session.exec(self.list_query(kind, after, **filters).limit(limit)).all()
+            items = [graph_dict(row, 0) for row in rows]
+        return dict(items=items, next=str(rows[-1].id) if len(rows) == limit else None)
+
+    def iterate(self, kind, page_size=1000, session=None, **filters):
+        """every row of kind matching filters as dicts, reading page_size rows at a time"""
+        if session is None:
+            with sqlmodel.Session(self.dbengine) as session:
+                yield from self.iterate(kind, page_size, session, **filters)
+            return
+        after = None
+        while True:
+            rows = session.exec(self.list_query(kind, after, **filters).limit(page_size)).all()
+            yield from (graph_dict(row, 0) for row in rows)
+            if len(rows) < page_size: return
+            after = rows[-1].id
+            session.expunge_all()
+
+    def page_route(self, kind: str, after: str = '', limit: int = Query(1000, gt=0, le=10_000),
+                   prefix: str = '', user: str = '', kind_is: str = '', since: datetime.datetime | None = None,
+                   until: datetime.datetime | None = None) -> dict:
+        filters = dict(prefix=prefix, user=user, kind_is=kind_is, since=since, until=until)
+        return self.page(kind, after, limit, **filters)
+
+    def stream_route(self, kind: str, prefix: str = '', user: str = '', kind_is: str = '',
+                     since: datetime.datetime | None = None, until: datetime.datetime | None = None):
+        """every matching row as newline delimited json, without holding the table in memory"""
+        filters = dict(prefix=prefix, user=user, kind_is=kind_is, since=since, until=until)
+        self.list_query(kind, **filters)  # bad filters are an error status, not a cut off stream
+
+        def lines():
+            for item in self.iterate(kind, **filters):
+                yield json.dumps(jsonable_encoder(item)) + '\n'
+
+        return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+    def enable_async(self, url=None, **kw):
+        """serve every spec kind from an async engine on url (default the sync engine's database) under
+        /api/async: reads at {kind}/{name or id}, {kind} with the page filters, count/{kind} and graph/{kind},
+        and writes at POST newmany/{kind} and upsert_many. The handlers await the database, so one worker
+        keeps serving while queries are slow. The crud routes ipd.crud generates from the specs stay sync:
+        fastapi runs them in its threadpool, so a slow one holds a thread and a sync pool connection, not
+        the event loop these routes run on"""
+        if self.async_engine is not None: return
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        url = url or self.dbengine.url
+        self.async_engine = async_engine(url, **kw)
+        if self.async_engine.dialect.name == 'sqlite' and self.sqlite_profile:
+            set_sqlite_pragmas(self.async_engine)
+        self.async_session = async_sessionmaker(self.async_engine, expire_on_commit=False)
+        if self.change_kinds: count_changes(self.async_engine.sync_engine, self.change_kinds, create=False)
+        add = lambda path, func, method='GET': self.add_route(f'/api/async/{path}', func, method)
+        add('newmany/{kind}', self.anewmany_route, 'POST')
+        add('upsert_many', self.aupsert_many_route, 'POST')
+        add('count/{kind}', self.acount_route)
+        add('graph/{kind}', self.agraph_route)
+        add('{kind}/{key}', self.aget_route)
+        add('{kind}', self.apage_route)
+
+    def model_or_404(self, kind):
+        if kind not in self.__backend_models__: raise HTTPException(404, f'no spec kind {kind}')
+        return self.dbmodel(kind)
+
+    async def aget(self, kind, key):
+        """row, through the async engine"""
+        Model = self.model_or_404(kind)
+        match = Model.id == id if (id := touuid(key)) else Model.name == key
+        async with self.async_session() as session:
+            row = (await session.execute(sqlmodel.select(Model).where(match))).scalars().first()
+            if row is None: raise HTTPException(404, f'no {kind} {key}')
+            return graph_dict(row, 0)
+
+    async def acount(self, kind):
+        Model = self.model_or_404(kind)
+        query = sqlmodel.select(sqlalchemy.func.count()).select_from(Model)
+        async with self.async_session() as session:
+            return (await session.execute(query)).scalar()
+
+    async def apage(self, kind, after=None, limit=1000, **filters):
+        """page, through the async engine"""
+        self.model_or_404(kind)
+        async with self.async_session() as session:
+            query = self.list_query(kind, after, **filters).limit(limit)
+            rows = (await session.execute(query)).scalars().all()
+            items = [graph_dict(row, 0) for row in rows]
+        return dict(items=items, next=str(rows[-1].id) if len(rows) == limit else None)
+
+    async def agraph(self, kind, names=None, depth=2, include=None):
+        """graph, through the async engine. Everything graph_dict touches is loaded eagerly first"""
+        self.model_or_404(kind)
+        query, include = self.graph_query(kind, names, depth, include)
+        async with self.async_session() as session:
+            rows = (await session.execute(query)).scalars().all()
+            return [graph_dict(row, depth, include) for row in rows]
+
+    async def anewmany(self, kind, specs):
+        """newmany, through the async engine"""
+        Model, defaults = self.model_or_404(kind), self.ref_defaults(kind)
+        items = [spec_fields(spec) for spec in specs]
+        async with self.async_session() as session, session.begin():
+            return [row.id for row in await session.run_sync(new_rows, Model, items, defaults)]
+
+    async def aupsert_many(self, specs):
+        """upsert_many, through the async engine"""
+        bykind = specs_bykind(specs)
+        for kind in bykind:
+            self.model_or_404(kind)
+        async with self.async_session() as session, session.begin():
+            return await session.run_sync(self.upsert_bykind, bykind, len(specs))
+
+    async def aget_route(self, kind: str, key: str) -> dict:
+        return await self.aget(kind, key)
+
+    async def acount_route(self, kind: str) -> int:
+        return await self.acount(kind)
+
+    async def apage_route(self, kind: str, after: str = '', limit: int = Query(1000, gt=0, le=10_000),
+                          prefix: str = '', user: str = '', kind_is: str = '',
+                          since: datetime.datetime | None = None,
+                          until: datetime.datetime | None = None) -> dict:
+        filters = dict(prefix=prefix, user=user, kind_is=kind_is, since=since, until=until)
+        return await self.apage(kind, after, limit, **filters)
+
+    async def agraph_route(self, kind: str, names: list[str] | None = Query(None), depth: int = 2,
+                           include: str = '') -> list[dict]:
+        return await self.agraph(kind, names, depth, include)
+
+    async def anewmany_route(self, kind: str, specs: list[dict] = Body(...)) -> list[str]:
+        with bad_fields_are_422():
+            return [str(id) for id in await self.anewmany(kind, specs)]
+
+    async def aupsert_many_route(self, specs: list[tuple[str, dict]] = Body(...)) -> list[str]:
+        with bad_fields_are_422():
+            return [str(id) for id in await self.aupsert_many(specs)]
+
+    def upsert_many_route(self, specs: list[tuple[str, dict]] = Body(...)) -> list[str]:
+        with bad_fields_are_422():
+            return [str(id) for id in self.upsert_many(specs)]
+
+    def newmany_route(self, kind: str, specs: list[dict] = Body(...)) -> list[str]:
+        with bad_fields_are_422():
+            return [str(id) for id in self.newmany(kind, specs)]
+
+def specs_bykind(specs):
+    """{kind: [(index in specs, fields)]} for Spec objects or (kind, fields) pairs"""
+    bykind = {}
+    for i, spec in enumerate(specs):
+        kind, fields = (spec.modelkind(), spec) if isinstance(spec, pydantic.BaseModel) else spec
+        bykind.setdefault(kind, []).append((i, spec_fields(fields)))
+    return bykind
+
+@contextlib.contextmanager
+def bad_fields_are_422():
+    try:
+        yield
+    except ValueError as e:
+        raise HTTPException(422, str(e)) from e
+
+def spec_fields(spec):
+    """the fields of a Spec or dict, as given"""
+    if isinstance(spec, pydantic.BaseModel): return spec.model_dump(exclude_unset=True)
+    return dict(spec)
+
+def eager_options(Model, depth, include=None):
+    """selectinload options for the relationships of Model, depth levels down"""
+    if depth <= 0: return []
+    options = []
+    for name, rel in sqlalchemy.inspect(Model).relationships.items():
+        if include is not None and name not in include: continue
+        load = sqlalchemy.orm.selectinload(getattr(Model, name))
+        options.append(load.options(*eager_options(rel.mapper.class_, depth - 1, include)))
+    return options
+
+def graph_dict(row, depth, include=None):
+    """the columns of row, plus its relationships as nested dicts down to depth"""
+    out = {name: getattr(row, name) for name in row.__table__.columns.keys()}
+    if depth <= 0: return out
+    for name in sqlalchemy.inspect(type(row)).relationships.keys():
+        if include is not None and name not in include: continue
+        val = getattr(row, name)
+        if isinstance(val, list): out[name] = [graph_dict(v, depth - 1, include) for v in val]
+        else: out[name] = val and graph_dict(val, depth - 1, include)
+    return out
+
+def index_columns(tables):
+    """(table, column) pairs that lookups and joins go through: unique names and every foreign key"""
+    for table in tables:
+        for column in table.columns:
+            if column.name == 'name' or column.foreign_keys: yield table, column
+
+def create_indexes(engine, tables):
+    """index each of index_columns that doesn't already lead an index, unique constraint or primary key.
+    Returns the names of the indexes created"""
+    inspector = sqlalchemy.inspect(engine)
+    created = []
+    for table, column in index_columns(tables):
+        if not inspector.has_table(table.name): continue
+        covered = [inspector.get_pk_constraint(table.name)['constrained_columns']]
+        covered += [index['column_names'] for index in inspector.get_indexes(table.name)]
+        covered += [unique['column_names'] for unique in inspector.get_unique_constraints(table.name)]
+        if any(columns and columns[0] == column.name for columns in covered): continue
+        name = f'ix_{table.name}_{column.name}'
+        index = next((ix for ix in table.indexes if ix.name == name), None) or sqlalchemy.Index(name, column)
+        index.create(engine, checkfirst=True)
+        created.append(name)
+    return created
+
+def _add_newmany_methods():
+    for Spec in mlb.specs:
+        kind = Spec.modelkind()
+
+        def newmany(self, specs, kind=kind):
+            return self.newmany(kind, specs)
+
+        newmany.__doc__ = f'create many {kind}s in one transaction'
+        setattr(MLBBackend, f'new{kind}s', newmany)
+
+_add_newmany_methods()
+
+class Server(uvicorn.Server):
+    """a uvicorn server in a thread of this process"""
+    def install_signal_handlers(self):
+        pass
+
+    def start(self, timeout=30):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.started:
+            if not self.thread.is_alive(): raise RuntimeError(f'server on port {self.config.port} failed')
+            if time.monotonic() > deadline: raise TimeoutError(f'server on port {self.config.port} not up')
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.should_exit = True
+        self.thread.join()
 
-def run(**kw):
-    return ipd.crud.run[mlb.MLBBackend, mlb.MLBClient](**kw)
+def run(port, dburl=None, datadir=None, loglevel='info', local=False, workers=1, sqlite_profile=False,
+        async_db=False, count_changes=False):
+    """start an MLBBackend server on port in a thread and return (server, backend, client). The engine and
+    backend are made here, not by ipd.crud.run, so sqlite_profile, async_db and count_changes are sure to
+    reach MLBBackend. dburl defaults to a sqlite file in datadir"""
+    assert workers == 1, 'the server runs in a thread of this process, so it has one worker'
+    datadir = datadir or os.path.expanduser('~/.local/share/mlb')
+    os.makedirs(datadir, exist_ok=True)
+    dburl = dburl or f'sqlite:///{datadir}/mlb.db'
+    backend = MLBBackend(sqlmodel.create_engine(dburl), datadir, sqlite_profile=sqlite_profile,
+                         async_db=async_db, count_changes=count_changes)
+    host = '127.0.0.1' if local else '0.0.0.0'
+    server = Server(uvicorn.Config(backend.app, host=host, port=port, log_level=loglevel)).start()
+    return server, backend, mlb.MLBClient(f'127.0.0.1:{port}')
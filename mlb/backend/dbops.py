@@ -0,0 +1,152 @@
+"""database work for MLBBackend that only needs sqlalchemy: spec fields to rows, bulk writes, each in a
+session and transaction of its own, and the per-kind change counts client caches check against"""
+import collections
+import functools
+import uuid
+import weakref
+
+import pydantic
+import sqlalchemy
+
+__all__ = [
+    'new_rows', 'upsert_rows', 'new_row', 'set_fields', 'changes_table', 'count_changes', 'read_changes'
+]
+
+def new_rows(session, Model, items, defaults=None):
+    """a new Model row for each fields dict in items, added to session and flushed. Returns the rows"""
+    rows = [new_row(session, Model, fields, defaults) for fields in items]
+    session.flush()
+    return rows
+
+def upsert_rows(session, Model, items, defaults=None):
+    """new_rows, except items whose name is already in the table set their fields on that row. defaults are
+    only used for new rows. Returns the rows"""
+    names = [fields['name'] for fields in items if fields.get('name')]
+    existing = {}
+    if names and hasattr(Model, 'name'):
+        query = sqlalchemy.select(Model).where(Model.name.in_(names))
+        existing = {row.name: row for row in session.execute(query).scalars()}
+    rows = []
+    for fields in items:
+        if (row := existing.get(fields.get('name'))) is None:
+            row = new_row(session, Model, fields, defaults)
+            if fields.get('name'): existing[fields['name']] = row
+        else:
+            set_fields(session, row, {k: v for k, v in fields.items() if k != 'id'})
+        rows.append(row)
+    session.flush()
+    return rows
+
+def new_row(session, Model, fields, defaults=None):
+    """a Model row with fields, and the defaults whose field or <field>id isn't in fields, added to session"""
+    defaults = {k: v for k, v in (defaults or {}).items() if k not in fields and f'{k}id' not in fields}
+    row = Model()
+    # fields first, a ref lookup can autoflush and row isn't complete until then
+    set_fields(session, row, defaults | fields)
+    session.add(row)
+    return row
+
+def set_fields(session, row, fields):
+    """set spec fields on row. A ref like user=<name, id, row or dict> goes in the userid column, and list
+    fields take names, ids, rows or dicts of the rows to link. Raises ValueError for unknown fields or rows"""
+    Model = type(row)
+    columns, rels = Model.__table__.columns, sqlalchemy.inspect(Model).relationships
+    for key, val in fields.items():
+        if key in rels and rels[key].uselist:
+            Target = rels[key].mapper.class_
+            setattr(row, key, [find_row(session, Target, v) for v in val or []])
+        elif key in columns:
+            setattr(row, key, column_value(Model, key, val))
+        elif f'{key}id' in columns:
+            setattr(row, f'{key}id', ref_id(session, columns[f'{key}id'], val))
+        else:
+            raise ValueError(f'{Model.__name__} has no field {key}')
+
+def column_value(Model, key, val):
+    """val as the column's python type, like a uuid from a json string. The table models don't validate"""
+    if val is None or key not in getattr(Model, 'model_fields', {}): return val
+    return _adapter(Model, key).validate_python(val)
+
+@functools.cache
+def _adapter(Model, key):
+    return pydantic.TypeAdapter(Model.model_fields[key].annotation)
+
+def ref_id(session, column, val):
+    """the id for ref column column from an id, a row or dict with an id or name, or a name"""
+    if val is None: return None
+    if hasattr(val, '__table__'): return val.id
+    if isinstance(val, dict): val = val.get('id') or val.get('name')
+    if id := touuid(val): return id
+    if not column.foreign_keys: raise ValueError(f'{column} is not a ref, {val!r} is not an id')
+    target = next(iter(column.foreign_keys)).column
+    if 'name' not in target.table.c: raise ValueError(f'{target.table.name} has no name, {val!r} is not an id')
+    id = session.execute(sqlalchemy.select(target).where(target.table.c.name == val)).scalar()
+    if id is None: raise ValueError(f'no {target.table.name} named {val!r}')
+    return id
+
+def find_row(session, Model, val):
+    """the Model row with id or name val, val itself if it is a row"""
+    if isinstance(val, Model): return val
+    if isinstance(val, dict): val = val.get('id') or val.get('name')
+    if id := touuid(val): row = session.get(Model, id)
+    elif hasattr(Model, 'name'):
+        row = session.execute(sqlalchemy.select(Model).where(Model.name == val)).scalars().first()
+    else: row = None
+    if row is None: raise ValueError(f'no {Model.__table__.name} {val!r}')
+    return row
+
+def touuid(val):
+    try:
+        return uuid.UUID(str(val))
+    except ValueError:
+        return None
+
+changes_table = sqlalchemy.Table(
+    'changes',
+    sqlalchemy.MetaData(),
+    sqlalchemy.Column('kind', sqlalchemy.String, primary_key=True),
+    sqlalchemy.Column('count', sqlalchemy.Integer, nullable=False),
+)
+
+_change_kinds = weakref.WeakKeyDictionary()
+
+def count_changes(engine, kinds, create=True):
+    """count the writes to each Model of kinds, a dict of Model to kind, in the changes table of engine.
+    Only sessions bound to engine count, each transaction bumps the counts of the kinds it wrote as it
+    commits, all at once and in kind order, so writers lock the count rows briefly and always in the same
+    order. A rolled back write never moves them. create=False for another engine on the same database"""
+    if create:
+        changes_table.create(engine, checkfirst=True)
+        with engine.begin() as conn:
+            have = set(conn.execute(sqlalchemy.select(changes_table.c.kind)).scalars())
+            missing = sorted(set(kinds.values()) - have)
+            if missing: conn.execute(changes_table.insert(), [dict(kind=kind, count=0) for kind in missing])
+    _change_kinds[engine] = dict(kinds)
+    if not sqlalchemy.event.contains(sqlalchemy.orm.Session, 'after_flush', _tally_changes):
+        sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_flush', _tally_changes)
+        sqlalchemy.event.listen(sqlalchemy.orm.Session, 'before_commit', _bump_changes)
+        sqlalchemy.event.listen(sqlalchemy.orm.Session, 'after_transaction_end', _drop_changes)
+
+def read_changes(conn):
+    """the count of writes to each kind so far"""
+    return dict(conn.execute(sqlalchemy.select(changes_table.c.kind, changes_table.c.count)).all())
+
+def _session_kinds(session):
+    bind = session.bind
+    return bind is not None and _change_kinds.get(getattr(bind, 'engine', bind))
+
+def _tally_changes(session, flush_context):
+    if not (kinds := _session_kinds(session)): return
+    counts = session.info.setdefault('mlb_changes', collections.Counter())
+    for thing in (*session.new, *session.dirty, *session.deleted):
+        if kind := kinds.get(type(thing)): counts[kind] += 1
+
+def _bump_changes(session):
+    if not _session_kinds(session): return
+    session.flush()
+    for kind, n in sorted(session.info.pop('mlb_changes', {}).items()):
+        bump = changes_table.update().where(changes_table.c.kind == kind)
+        session.connection().execute(bump.values(count=changes_table.c.count + n))
+
+def _drop_changes(session, transaction):
+    if transaction.parent is None: session.info.pop('mlb_changes', None)
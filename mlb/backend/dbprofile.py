@@ -0,0 +1,44 @@
+"""a sqlite profile for production: WAL, tuned pragmas and a pooled engine threads and workers can share"""
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+__all__ = ['SQLITE_PRAGMAS', 'sqlite_engine', 'set_sqlite_pragmas', 'sqlite_pragmas']
+
+SQLITE_PRAGMAS = dict(
+    # readers don't block the writer, and commits append to the wal instead of rewriting pages
+    journal_mode='WAL',
+    # in WAL mode only checkpoints fsync. A power cut can lose the last commits, but not corrupt the db
+    synchronous='NORMAL',
+    cache_size=-64 * 1024,  # in KiB
+    mmap_size=256 * 2**20,
+    temp_store='MEMORY',
+    busy_timeout=30_000,  # ms a writer waits on another worker's write lock before 'database is locked'
+)
+
+def sqlite_engine(url, pool_size=8, max_overflow=16, **pragmas):
+    """an engine for a sqlite file url with SQLITE_PRAGMAS (updated by pragmas) set on every connection. Each
+    process (uvicorn worker) opens its own pool, and WAL plus busy_timeout lets them write to the same file"""
+    pragmas = SQLITE_PRAGMAS | pragmas
+    engine = sqlalchemy.create_engine(url, poolclass=QueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                                      pool_pre_ping=True,
+                                      connect_args=dict(check_same_thread=False,
+                                                        timeout=pragmas['busy_timeout'] / 1000))
+    set_sqlite_pragmas(engine, **pragmas)
+    return engine
+
+def set_sqlite_pragmas(engine, **pragmas):
+    """set SQLITE_PRAGMAS (updated by pragmas) on each new connection of engine, sync or async"""
+    pragmas = SQLITE_PRAGMAS | pragmas
+
+    def set_pragmas(conn, _):
+        cursor = conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    sqlalchemy.event.listen(getattr(engine, 'sync_engine', engine), 'connect', set_pragmas)
+
+def sqlite_pragmas(engine):
+    """the current value of each of SQLITE_PRAGMAS on a connection from engine"""
+    with engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in SQLITE_PRAGMAS}
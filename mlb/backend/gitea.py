@@ -2,6 +2,8 @@ import mlb
 import subprocess
 import threading
 
+__all__ = ['run_gitea_subprocess', 'run_gitea']
+
 def run_gitea_subprocess():
     # Environment=USER=gitea HOME=/mlb/repos GITEA_WORK_DIR=/mlb/server/gitea/workdir
     subprocess.Popen(f'/usr/bin/gitea web -c {mlb.projdir}/config/gitea.ini'.split())
@@ -0,0 +1,124 @@
+import collections
+import copy
+import re
+import threading
+import time
+
+class ClientCache:
+    """identity map of the rows a client has read, keyed by (kind, id), with an index of (kind, name) to id,
+    and the json responses of the other gets it made, keyed by url and params. Entries expire after ttl
+    seconds, the least recently used go past maxsize, and a write to a kind drops that kind's entries"""
+    def __init__(self, kinds, maxsize=10_000, ttl=300.0):
+        self.kinds = sorted(kinds, key=len, reverse=True)
+        self.maxsize, self.ttl = maxsize, ttl
+        self.rows = collections.OrderedDict()
+        self.ids = {}
+        self.responses = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, kind, key):
+        """a copy of the row of kind with id or name key, or None"""
+        with self.lock:
+            id = self.ids.get((kind, str(key)), str(key))
+            entry = self.rows.get((kind, id))
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                if entry is not None: self._drop((kind, id))
+                return None
+            self.rows.move_to_end((kind, id))
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, kind, row):
+        """remember row, a dict of columns with an id, as the row of kind with that id"""
+        if not isinstance(row, dict) or row.get('id') is None: return
+        key = (kind, str(row['id']))
+        with self.lock:
+            if key in self.rows: self._drop(key)
+            self.rows[key] = (time.monotonic(), dict(row))
+            if row.get('name') is not None: self.ids[(kind, str(row['name']))] = key[1]
+            while len(self.rows) > self.maxsize:
+                self._drop(next(iter(self.rows)))
+
+    def put_graph(self, kind, rows):
+        """put rows of kind, as returned by graph or page. Nested rows under a field named for a kind, like
+        user, users or methods, are put as that kind, and left out of the row they are under"""
+        for row in rows if isinstance(rows, list) else [rows]:
+            if not isinstance(row, dict): continue
+            columns = {}
+            for field, val in row.items():
+                nested = val if isinstance(val, list) else [val]
+                if (nested and all(map(_is_row, nested))) or (val == [] and self.field_kind(field)):
+                    if sub := self.field_kind(field): self.put_graph(sub, nested)
+                else:
+                    columns[field] = val
+            self.put(kind, columns)
+
+    def get_response(self, url, params):
+        """a copy of the response to a get of url with params, or MISSING"""
+        key = response_key(url, params)
+        with self.lock:
+            entry = self.responses.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                self.responses.pop(key, None)
+                return MISSING
+            self.responses.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[2])
+
+    def put_response(self, url, params, kinds, response):
+        """remember the response to a get of url with params, dropped with any of kinds. Only plain json
+        is kept, anything else could hold on to the client or change under the cache"""
+        if not kinds or not _is_json(response): return
+        with self.lock:
+            self.responses[response_key(url, params)] = (time.monotonic(), frozenset(kinds),
+                                                         copy.deepcopy(response))
+            while len(self.responses) > self.maxsize:
+                self.responses.popitem(last=False)
+
+    def invalidate(self, kinds=None):
+        """drop the rows and responses of any of kinds, or everything"""
+        with self.lock:
+            if kinds is None:
+                self.rows.clear()
+                self.responses.clear()
+                return self.ids.clear()
+            kinds = set(kinds)
+            for key in [key for key in self.rows if key[0] in kinds]:
+                self._drop(key)
+            for key in [key for key, entry in self.responses.items() if entry[1] & kinds]:
+                del self.responses[key]
+
+    def _drop(self, key):
+        _, row = self.rows.pop(key)
+        if self.ids.get((key[0], str(row.get('name')))) == key[1]: del self.ids[(key[0], str(row['name']))]
+
+    def field_kind(self, field):
+        """the spec kind a field like user, users, userid or groupids refers to, or None"""
+        base = re.sub(r'(ids?|s)$', '', field)
+        return base if base in self.kinds else None
+
+    def url_kinds(self, url):
+        """spec kinds named in a url, like user in /users?name=alice or /nusers"""
+        return {kind for kind in self.kinds if re.search(rf'(\b|\bnew|\bn){kind}(s|ids?)?\b', url)}
+
+    def value_kinds(self, value):
+        """spec kinds a request or response refers to through fields like user, users, userid or groupids"""
+        if isinstance(value, list): return set().union(*map(self.value_kinds, value[:100]))
+        if not isinstance(value, dict): return set()
+        return {kind for field in value if (kind := self.field_kind(field))}
+
+MISSING = object()
+
+def response_key(url, params):
+    return url, tuple(sorted((name, repr(val)) for name, val in params.items()))
+
+def _is_row(val):
+    return isinstance(val, dict) and 'id' in val
+
+def _is_json(val):
+    if isinstance(val, dict): return all(isinstance(k, str) and _is_json(v) for k, v in val.items())
+    if isinstance(val, list): return all(map(_is_json, val))
+    return val is None or isinstance(val, (str, int, float, bool))
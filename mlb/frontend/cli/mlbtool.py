@@ -1,10 +1,16 @@
 import ipd
+import mlb.run
 from mlb.frontend import MLBClient
 
 class MLBTool(ipd.dev.cli.CliBase):
     def hello(self, whom: str):
         print(f'hello from {self.__class__.__name__} {whom}')
 
+    def rundir(self, bench_type: str, bench_which: str, method: str, mode: str = 'auto', verify: bool = False):
+        """lay out runs/<bench_type>/<bench_which>/<method> from links into runs/.store"""
+        status = mlb.run.rundir_command(bench_type, bench_which, method, mode, verify)
+        if status: raise SystemExit(status)
+
 class APITool(MLBTool, ipd.crud.CrudCli, Client=MLBClient):
     def hello(self, whom: str):
         print(f'hello from {self.__class__.__name__} {whom}')
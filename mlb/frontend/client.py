@@ -1,5 +1,130 @@
+import time
+
+import pydantic
+
 import ipd
 import mlb
+from mlb.frontend.cache import MISSING, ClientCache
 
 class MLBClient(ipd.crud.ClientBase, Backend=mlb.backend.MLBBackend):
-    pass
+    cache = None
+    async_db = None
+
+    def enable_cache(self, maxsize=10_000, ttl=300.0, revalidate=1.0):
+        """keep what this client reads in a ClientCache, so a row it has seen, by id or name, or a get it has
+        made before, is answered locally. That is row() and every lookup the generated methods and models
+        make, like getornewvar(name=...) or m.param.invars. Entries are dropped after ttl seconds, when this
+        client writes to their kind, or when the server's change count for their kind moves. The counts are
+        checked at most every revalidate seconds, None to skip them. Servers that don't count changes
+        (MLBBackend.enable_change_counts) are never asked"""
+        self.cache = ClientCache([Spec.modelkind() for Spec in mlb.specs], maxsize, ttl)
+        self.cache_revalidate = revalidate
+        self._cache_checked = time.monotonic()
+        self._cache_changes = self.get('/changes') if revalidate is not None else None
+        if not self._cache_changes: self.cache_revalidate = None
+
+    def disable_cache(self):
+        self.cache = None
+
+    def get(self, url, *args, **kw):
+        """ClientBase.get, answered from the cache if it is on and url names a spec kind. The lookups of the
+        generated client methods and models, by id, by name or through a ref, all come through here"""
+        if self.cache is None or args: return super().get(url, *args, **kw)
+        if not (kinds := self.cache.url_kinds(url)): return super().get(url, **kw)
+        self._revalidate_cache()
+        if (response := self.cache.get_response(url, kw)) is not MISSING: return response
+        response = super().get(url, **kw)
+        self.cache.put_response(url, kw, kinds, response)
+        return response
+
+    def api(self, path, async_path):
+        """async_path if the server serves the /api/async routes (MLBBackend.enable_async), else path. The
+        server is asked once, set async_db to True or False to skip that"""
+        if self.async_db is None: self.async_db = bool(self.get('/features').get('async_db'))
+        return async_path if self.async_db else path
+
+    def row(self, kind, key):
+        """MLBBackend.row: the row of kind with name or id key, as a dict"""
+        if self.cache is not None:
+            self._revalidate_cache()
+            if (row := self.cache.get(kind, key)) is not None: return row
+        row = self.get(self.api(f'/row/{kind}/{key}', f'/async/{kind}/{key}'))
+        if self.cache is not None: self.cache.put(kind, row)
+        return row
+
+    def _revalidate_cache(self):
+        if self.cache_revalidate is None: return
+        if time.monotonic() - self._cache_checked < self.cache_revalidate: return
+        changes = self.get('/changes')
+        self._cache_checked = time.monotonic()
+        old, self._cache_changes = self._cache_changes, changes
+        self.cache.invalidate({kind for kind in set(old) | set(changes) if old.get(kind) != changes.get(kind)})
+
+    def _invalidate_after_write(self, url, args):
+        if self.cache is None: return
+        kinds = self.cache.url_kinds(url).union(*map(self.cache.value_kinds, args))
+        self.cache.invalidate(kinds or None)
+
+    def upsert_many(self, specs):
+        """MLBBackend.upsert_many in one request. specs are Spec objects or (kind, fields) pairs"""
+        body = [(spec.modelkind(), spec_json(spec)) if isinstance(spec, pydantic.BaseModel) else
+                (spec[0], spec_json(spec[1])) for spec in specs]
+        return self.post(self.api('/upsert_many', '/async/upsert_many'), body)
+
+    def newmany(self, kind, specs):
+        """MLBBackend.newmany in one request"""
+        url = self.api(f'/newmany/{kind}', f'/async/newmany/{kind}')
+        return self.post(url, [spec_json(spec) for spec in specs])
+
+    def graph(self, kind, names=None, depth=2, include=None):
+        """MLBBackend.graph in one request. names can be names or ids, include the relationships to follow"""
+        kw = dict(depth=depth)
+        if names is not None: kw['names'] = [str(n) for n in names]
+        if include: kw['include'] = include if isinstance(include, str) else ' '.join(include)
+        rows = self.get(self.api(f'/graph/{kind}', f'/async/graph/{kind}'), **kw)
+        if self.cache is not None: self.cache.put_graph(kind, rows)
+        return rows
+
+    def page(self, kind, after='', limit=1000, **filters):
+        """MLBBackend.page: dict(items=[...], next=<after for the next page or None>)"""
+        page = self.get(self.api(f'/page/{kind}', f'/async/{kind}'), after=after, limit=limit, **filters)
+        if self.cache is not None: self.cache.put_graph(kind, page['items'])
+        return page
+
+    def iterate(self, kind, page_size=1000, **filters):
+        """lazily yield every row of kind matching filters, fetching a page when the last one runs out"""
+        after = ''
+        while True:
+            page = self.page(kind, after, page_size, **filters)
+            yield from page['items']
+            if not (after := page['next']): return
+
+def spec_json(spec):
+    if isinstance(spec, pydantic.BaseModel): return spec.model_dump(mode='json', exclude_unset=True)
+    return dict(spec)
+
+def _add_cache_invalidation():
+    for name in ['post', 'put', 'patch', 'delete', 'remove']:
+        if not hasattr(ipd.crud.ClientBase, name): continue
+
+        def write(self, url, *args, _name=name, **kw):
+            try:
+                return getattr(super(MLBClient, self), _name)(url, *args, **kw)
+            finally:
+                self._invalidate_after_write(url, args)
+
+        setattr(MLBClient, name, write)
+
+_add_cache_invalidation()
+
+def _add_newmany_methods():
+    for Spec in mlb.specs:
+        kind = Spec.modelkind()
+
+        def newmany(self, specs, kind=kind):
+            return self.newmany(kind, specs)
+
+        newmany.__doc__ = f'create many {kind}s in one request'
+        setattr(MLBClient, f'new{kind}s', newmany)
+
+_add_newmany_methods()
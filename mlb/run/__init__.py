@@ -1 +1,7 @@
 from mlb.run.shell import *
+from mlb.run.pipeline import *
+from mlb.run.af2batch import *
+from mlb.run.rundir import *
+from mlb.run.artifacts import *
+from mlb.run.executor import *
+from mlb.run.protocol import *
@@ -0,0 +1,24 @@
+"""mlb.run commands for benchmark hosts, which may not have ipd for the full mlb cli
+
+    python -m mlb.run rundir <bench_type> <bench_which> <method> [--mode auto] [--verify]
+"""
+import argparse
+
+import mlb.run
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m mlb.run', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    rundir = commands.add_parser('rundir', help='lay out runs/<bench_type>/<bench_which>/<method>')
+    rundir.add_argument('bench_type')
+    rundir.add_argument('bench_which')
+    rundir.add_argument('method')
+    rundir.add_argument('--mode', default='auto', choices=mlb.run.LINK_MODES)
+    rundir.add_argument('--verify', action='store_true')
+    args = vars(parser.parse_args())
+    del args['command']
+    raise SystemExit(mlb.run.rundir_command(**args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""group designs into AF2 batches by length and run them on several devices at once"""
+import collections
+import dataclasses
+import threading
+import traceback
+from typing import Any, Callable
+
+@dataclasses.dataclass
+class AF2Batch:
+    length: int
+    names: list[str]
+
+    @property
+    def residues(self):
+        return self.length * len(self.names)
+
+def pdb_length(fname):
+    """number of residues in a pdb, counted by CA atoms"""
+    with open(fname) as inp:
+        return sum(1 for line in inp if line.startswith('ATOM') and line[12:16] == ' CA ')
+
+def plan_af2_batches(lengths: dict[str, int], max_residues: int = 50_000) -> list[AF2Batch]:
+    """bin designs by exact length, so each batch compiles AF2 for one length, and fill each batch with up
+    to max_residues residues. Biggest batches come first"""
+    bins = collections.defaultdict(list)
+    for name, length in sorted(lengths.items()):
+        bins[length].append(name)
+    batches = []
+    for length, names in bins.items():
+        per_batch = max(1, max_residues // length)
+        for i in range(0, len(names), per_batch):
+            batches.append(AF2Batch(length, names[i:i + per_batch]))
+    return sorted(batches, key=lambda b: (-b.residues, -b.length))
+
+def deal_batches(batches: list[AF2Batch], ndevices: int) -> list[collections.deque]:
+    """give whole length bins to the least loaded device, so devices rarely see a new length"""
+    bins = collections.defaultdict(list)
+    for batch in batches:
+        bins[batch.length].append(batch)
+    queues = [collections.deque() for _ in range(ndevices)]
+    load = [0] * ndevices
+    for length, group in sorted(bins.items(), key=lambda kv: -sum(b.residues for b in kv[1])):
+        idev = load.index(min(load))
+        queues[idev].extend(group)
+        load[idev] += sum(b.residues for b in group)
+    return queues
+
+@dataclasses.dataclass
+class AF2BatchResult:
+    batch: AF2Batch
+    device: Any
+    result: Any = None
+    error: str | None = None
+
+def run_af2_batches(batches: list[AF2Batch], predict: Callable[[AF2Batch, Any], Any],
+                    devices: list) -> list[AF2BatchResult]:
+    """run predict(batch, device) for every batch with one thread per device. Each device works through its
+    own queue and steals from the back of the longest other queue once it runs out"""
+    assert devices, 'no devices to run AF2 on'
+    queues = deal_batches(batches, len(devices))
+    lock = threading.Lock()
+    results = []
+
+    def next_batch(idev):
+        with lock:
+            if queues[idev]: return queues[idev].popleft()
+            victim = max(queues, key=len)
+            return victim.pop() if victim else None
+
+    def worker(idev):
+        while (batch := next_batch(idev)) is not None:
+            try:
+                out = AF2BatchResult(batch, devices[idev], result=predict(batch, devices[idev]))
+            except Exception:
+                out = AF2BatchResult(batch, devices[idev], error=traceback.format_exc())
+            with lock:
+                results.append(out)
+
+    threads = [threading.Thread(target=worker, args=(i, )) for i in range(len(devices))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
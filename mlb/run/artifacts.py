@@ -0,0 +1,108 @@
+"""cache of stage outputs keyed by everything that went into them, so unchanged stages are not rerun"""
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+from mlb.run.rundir import HashIndex, clone_file
+
+class ArtifactCache:
+    """stage results and the files they name, stored under root/<key>. Keys come from key(), which hashes
+    the contents of files, scripts and container images along with any other parameters. Least recently
+    used entries are evicted once the cache holds more than max_bytes"""
+    def __init__(self, root, max_bytes: int = 500 * 2**30):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hashes = HashIndex(self.root / 'hashes.json')
+        self.lock = threading.Lock()
+
+    def key(self, *params, files=(), containers=()):
+        """params must be json-able. files and containers are hashed by content, missing ones by name"""
+        with self.lock:
+            digests = [
+                self.hashes.digest(f) if os.path.exists(f) else f'missing:{f}' for f in (*files, *containers)
+            ]
+            self.hashes.save()
+        blob = json.dumps([params, digests], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode()).hexdigest()
+
+    def get(self, key):
+        """the cached result for key with its files put back in place, or None. Results come back as json, so
+        tuples are lists"""
+        entry = self.root / key
+        try:
+            meta = json.loads((entry / 'meta.json').read_text())
+            for i, fname in enumerate(meta['files']):
+                Path(fname).parent.mkdir(parents=True, exist_ok=True)
+                if os.path.lexists(fname): os.unlink(fname)
+                clone_file(entry / str(i), fname)
+            os.utime(entry)
+        except FileNotFoundError:
+            return None  # not cached, or evicted while we were reading it
+        return meta['result']
+
+    def put(self, key, result, files=None):
+        """store result, and the files it names unless files is given. Paths are kept as given, so relative
+        paths are restored relative to wherever get is called"""
+        if files is None: files = result_files(result)
+        entry = self.root / key
+        tmp = self.root / f'{key}.tmp{os.getpid()}.{threading.get_ident()}'
+        tmp.mkdir()
+        size = 0
+        for i, fname in enumerate(files):
+            clone_file(fname, tmp / str(i))
+            size += os.path.getsize(fname)
+        meta = dict(result=result, files=[str(f) for f in files], size=size, created=time.time())
+        (tmp / 'meta.json').write_text(json.dumps(meta))
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp)  # somebody else stored the same key first
+        self.evict()
+        return result
+
+    def entries(self):
+        for entry in self.root.iterdir():
+            if (entry / 'meta.json').exists():
+                yield entry, json.loads((entry / 'meta.json').read_text())['size'], entry.stat().st_mtime
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self.entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            for entry, size, _ in entries:
+                if total <= self.max_bytes: break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+    def cached(self, fn, key, files=None):
+        """wrap a Stage fn so it is only run when key(item) is not in the cache. Generators still stream
+        their items on a miss, and the result is stored once they finish. Other args, like the gpu of a gpu
+        stage, are passed on to fn but are not part of the key"""
+        def wrapped(item, *args):
+            k = key(item)
+            if (result := self.get(k)) is not None: return result
+            result = fn(item, *args)
+            if not inspect.isgenerator(result): return self.put(k, result, files(result) if files else None)
+            return self._put_when_done(k, result, files)
+
+        return wrapped
+
+    def _put_when_done(self, key, gen, files):
+        items = []
+        for item in gen:
+            items.append(item)
+            yield item
+        self.put(key, items, files(items) if files else None)
+
+def result_files(result):
+    """every str in a (nested) result that names an existing file"""
+    if isinstance(result, str): return [result] if os.path.isfile(result) else []
+    if isinstance(result, dict): result = list(result.values())
+    if isinstance(result, (list, tuple)): return [f for r in result for f in result_files(r)]
+    return []
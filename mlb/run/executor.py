@@ -0,0 +1,168 @@
+"""turn a method and its inputs into jobs, and run them as local processes or through submitit"""
+import collections
+import concurrent.futures
+import dataclasses
+import os
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from mlb.run.pipeline import visible_gpus
+
+@dataclasses.dataclass(frozen=True)
+class Resources:
+    cpus: int = 1
+    gpus: int = 0
+    gpu_type: str = ''
+    mem_gb: float | None = None
+    timeout_min: int | None = None
+
+@dataclasses.dataclass
+class Job:
+    name: str
+    cmd: list[str]
+    workdir: str
+    resources: Resources = Resources()
+    env: dict[str, str] = dataclasses.field(default_factory=dict)
+
+@dataclasses.dataclass
+class JobResult:
+    name: str
+    returncode: int
+    wall_time: float
+    workdir: str
+
+def parse_gpus(gpus: str) -> tuple[int, str]:
+    """MethodSpec.gpus as (count, type). '' is no gpu, '2' two of any type, 'a4000' one a4000, 'a4000:2' two"""
+    gpus = (gpus or '').strip()
+    if not gpus: return 0, ''
+    if gpus.isdigit(): return int(gpus), ''
+    kind, _, count = gpus.partition(':')
+    return int(count or 1), kind
+
+def exe_command(method) -> list[str]:
+    path = str(method.exe.path)
+    if getattr(method.exe, 'apptainer', None) or path.endswith('.sif'):
+        return ['apptainer', 'run', *(['--nv'] if parse_gpus(method.gpus)[0] else []), path]
+    return [path]
+
+def method_jobs(method, inputs, outdir, resources=None, args=None) -> list[Job]:
+    """one Job per dict of input vars in inputs, run in outdir/<method>/<index> as exe --var=value ...
+    args(invars) can give the command line args instead. By default each job gets one cpu and the gpus
+    the method asks for"""
+    count, kind = parse_gpus(method.gpus)
+    resources = resources or Resources(gpus=count, gpu_type=kind)
+    args = args or (lambda invars: [f'--{k}={v}' for k, v in invars.items()])
+    cmd = exe_command(method)
+    jobs = []
+    for i, invars in enumerate(inputs):
+        workdir = Path(outdir) / method.name / f'{i:06}'
+        jobs.append(Job(f'{method.name}.{i:06}', [*cmd, *args(invars)], str(workdir), resources))
+    return jobs
+
+def run_job(job: Job, devices=None) -> JobResult:
+    """run job in its workdir with output to stdout.log and stderr.log there. devices, if given, become
+    CUDA_VISIBLE_DEVICES"""
+    os.makedirs(job.workdir, exist_ok=True)
+    env = dict(os.environ, **job.env)
+    if devices is not None: env['CUDA_VISIBLE_DEVICES'] = ','.join(devices)
+    timeout = job.resources.timeout_min and job.resources.timeout_min * 60
+    start = time.perf_counter()
+    with open(f'{job.workdir}/stdout.log', 'w') as out, open(f'{job.workdir}/stderr.log', 'w') as err:
+        try:
+            returncode = subprocess.run(job.cmd, cwd=job.workdir, env=env, stdout=out, stderr=err,
+                                        timeout=timeout).returncode
+        except subprocess.TimeoutExpired:
+            returncode = -9
+    return JobResult(job.name, returncode, time.perf_counter() - start, job.workdir)
+
+class LocalExecutor:
+    """runs each job as a local process, max_workers at a time. A job waits until it can have as many of gpus
+    (default all visible) as it asks for, and only sees those. submit blocks while max_in_flight jobs are
+    queued or running"""
+    def __init__(self, max_workers=None, gpus=None, max_in_flight=None):
+        max_workers = max_workers or os.cpu_count()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers)
+        if gpus is None: gpus = visible_gpus()
+        self.free_gpus = [str(g) for g in gpus]
+        self.ngpus = len(self.free_gpus)
+        self.gpu_freed = threading.Condition()
+        self.in_flight = threading.Semaphore(max_in_flight or 4 * max_workers)
+
+    def _run(self, job):
+        try:
+            with self.gpu_freed:
+                self.gpu_freed.wait_for(lambda: len(self.free_gpus) >= job.resources.gpus)
+                devices = [self.free_gpus.pop(0) for _ in range(job.resources.gpus)]
+            try:
+                return run_job(job, devices)
+            finally:
+                with self.gpu_freed:
+                    self.free_gpus.extend(devices)
+                    self.gpu_freed.notify_all()
+        finally:
+            self.in_flight.release()
+
+    def submit(self, job: Job) -> concurrent.futures.Future:
+        if job.resources.gpus > self.ngpus:
+            raise ValueError(f'job {job.name} needs {job.resources.gpus} gpus, only {self.ngpus} here')
+        self.in_flight.acquire()
+        return self.pool.submit(self._run, job)
+
+    def submit_array(self, jobs: list[Job]) -> list[concurrent.futures.Future]:
+        return [self.submit(job) for job in jobs]
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.shutdown()
+
+class SubmititExecutor:
+    """submits jobs through submitit as job arrays of up to array_size jobs that need the same resources.
+    cluster is passed to submitit.AutoExecutor, so 'local' runs them on this machine and None means slurm if
+    there is one. At most max_in_flight jobs are out at once; later arrays wait for earlier jobs to finish"""
+    def __init__(self, folder, cluster=None, array_size=1000, max_in_flight=5000, array_parallelism=256,
+                 poll=10.0, **params):
+        import submitit
+        self.executor = submitit.AutoExecutor(folder=folder, cluster=cluster)
+        self.array_size, self.max_in_flight, self.poll = array_size, max_in_flight, poll
+        self.params = dict(slurm_array_parallelism=array_parallelism, **params)
+        self.active = []
+
+    def parameters(self, resources: Resources):
+        params = dict(cpus_per_task=resources.cpus)
+        if resources.gpu_type: params['slurm_gres'] = f'gpu:{resources.gpu_type}:{resources.gpus}'
+        else: params['gpus_per_node'] = resources.gpus
+        if resources.mem_gb: params['mem_gb'] = resources.mem_gb
+        if resources.timeout_min: params['timeout_min'] = resources.timeout_min
+        return params | self.params
+
+    def _wait_for_room(self, n):
+        while True:
+            self.active = [job for job in self.active if not job.done()]
+            if not self.active or len(self.active) + n <= self.max_in_flight: return
+            time.sleep(self.poll)
+
+    def submit_array(self, jobs: list[Job]) -> list:
+        """submitit jobs in the same order as jobs. job.result() is a JobResult"""
+        by_resources = collections.defaultdict(list)
+        for i, job in enumerate(jobs):
+            by_resources[job.resources].append(i)
+        submitted = [None] * len(jobs)
+        for resources, indices in by_resources.items():
+            self.executor.update_parameters(**self.parameters(resources))
+            for lb in range(0, len(indices), self.array_size):
+                chunk = indices[lb:lb + self.array_size]
+                self._wait_for_room(len(chunk))
+                for i, sjob in zip(chunk, self.executor.map_array(run_job, [jobs[i] for i in chunk])):
+                    submitted[i] = sjob
+                    self.active.append(sjob)
+        return submitted
+
+    def submit(self, job: Job):
+        return self.submit_array([job])[0]
@@ -0,0 +1,195 @@
+"""run benchmark stages as a dependency graph so each item moves to the next stage as soon as it exists"""
+import collections
+import dataclasses
+import glob
+import inspect
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+from typing import Any, Callable
+
+@dataclasses.dataclass
+class Stage:
+    """one step of a Pipeline. fn(item) returns an item, a list of items or yields items, which are passed
+    on to the downstream stages. None means no output. gather stages run once, on the list of everything
+    upstream produced, after upstream is finished. With batch_size, fn gets a list of up to batch_size items,
+    started once batch_size items are waiting, the oldest has waited batch_wait seconds or upstream is done.
+    A stage whose resource is a list of ids, like gpu=['0', '1'], takes one of them for each task and is
+    called fn(item, id). The id goes back in the pool when the task is done"""
+    name: str
+    fn: Callable
+    after: str | list[str] | None = None
+    resource: str = 'cpu'
+    concurrency: int | None = None
+    gather: bool = False
+    batch_size: int | None = None
+    batch_wait: float | None = None
+
+    def __post_init__(self):
+        if self.after is None: self.after = []
+        elif isinstance(self.after, str): self.after = [self.after]
+
+@dataclasses.dataclass
+class PipelineResult:
+    outputs: dict[str, list[Any]]
+    errors: list[tuple[str, Any, str]]
+
+def watch_files(pattern, until, ready=None, poll=1.0):
+    """yield each new file matching glob pattern as it shows up, until until() is true. ready(path) can hold
+    back files that are still being written. Everything left is yielded after until() is true"""
+    seen = set()
+    while True:
+        done = until()
+        for path in sorted(glob.glob(pattern)):
+            if path in seen or not (done or ready is None or ready(path)): continue
+            seen.add(path)
+            yield path
+        if done: return
+        time.sleep(poll)
+
+def visible_gpus():
+    """ids of the gpus this process may use, from CUDA_VISIBLE_DEVICES or else nvidia-smi"""
+    if 'CUDA_VISIBLE_DEVICES' in os.environ:
+        return [g.strip() for g in os.environ['CUDA_VISIBLE_DEVICES'].split(',') if g.strip()]
+    if not shutil.which('nvidia-smi'): return []
+    result = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True)
+    return [str(i) for i in range(result.stdout.count('GPU '))] if result.returncode == 0 else []
+
+def available_gpus():
+    return len(visible_gpus())
+
+class Pipeline:
+    """Stages form a DAG through Stage.after. Work is started downstream-first, so the first items
+    make it all the way through while upstream stages are still running. Each stage runs at most
+    Stage.concurrency tasks at once, and all stages tagged with a resource share its limit. A resource is a
+    count, None for no limit, or a list of ids that tasks are handed one each, like the default visible
+    gpus"""
+    def __init__(self, stages: list[Stage], resources: dict[str, int | list | None] | None = None):
+        self.stages = {s.name: s for s in stages}
+        assert len(self.stages) == len(stages), 'duplicate stage names'
+        self.resources = resources or dict(cpu=os.cpu_count(), gpu=visible_gpus())
+        self.limits = {k: len(v) if isinstance(v, (list, tuple)) else v for k, v in self.resources.items()}
+        self.downstream = collections.defaultdict(list)
+        for stage in stages:
+            assert stage.resource in self.resources, f'stage {stage.name}: unknown resource {stage.resource}'
+            assert self.limits[stage.resource] != 0, f'no {stage.resource} available for stage {stage.name}'
+            for up in stage.after:
+                assert up in self.stages, f'stage {stage.name} is after unknown stage {up}'
+                self.downstream[up].append(stage.name)
+        self.order = self._toposort()
+
+    def _toposort(self):
+        indegree = {name: len(stage.after) for name, stage in self.stages.items()}
+        ready = [name for name, n in indegree.items() if n == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for down in self.downstream[name]:
+                indegree[down] -= 1
+                if indegree[down] == 0: ready.append(down)
+        cycle = [name for name, n in indegree.items() if n]
+        assert not cycle, f'pipeline stages form a cycle: {cycle}'
+        return order
+
+    def run(self, items, on_output: Callable[[str, Any], None] | None = None) -> PipelineResult:
+        """feed items to every stage with no upstream and run until everything is done. on_output(stage,
+        item) is called from this thread for each item a final stage produces, as soon as it is produced"""
+        items = list(items)
+        pending = {name: collections.deque() for name in self.stages}
+        gathered = {name: [] for name in self.stages}
+        waiting_since = {name: time.perf_counter() for name in self.stages}
+        running = collections.Counter()
+        inuse = collections.Counter()
+        started_gather = set()
+        outputs = {name: [] for name in self.stages if not self.downstream[name]}
+        errors = []
+        events = queue.Queue()
+        free = {k: collections.deque(v) for k, v in self.resources.items() if isinstance(v, (list, tuple))}
+        for name in self.order:
+            if self.stages[name].after: continue
+            if self.stages[name].gather: gathered[name].extend(items)
+            else: pending[name].extend(items)
+
+        def work(stage, item, device):
+            try:
+                result = stage.fn(item) if device is None else stage.fn(item, device)
+                if result is not None:
+                    for out in result if isinstance(result, list) or inspect.isgenerator(result) else [result]:
+                        events.put(('emit', stage.name, out))
+            except Exception:
+                events.put(('error', stage.name, (item, traceback.format_exc())))
+            events.put(('done', stage.name, device))
+
+        def finished(name):
+            stage = self.stages[name]
+            if pending[name] or running[name]: return False
+            if stage.gather and name not in started_gather: return False
+            return all(finished(up) for up in stage.after)
+
+        def can_start(stage):
+            limit = self.limits[stage.resource]
+            if limit is not None and inuse[stage.resource] >= limit: return False
+            return stage.concurrency is None or running[stage.name] < stage.concurrency
+
+        def take_batch(stage):
+            if not stage.batch_size: return pending[stage.name].popleft()
+            n = min(stage.batch_size, len(pending[stage.name]))
+            return [pending[stage.name].popleft() for _ in range(n)]
+
+        def batch_ready(stage):
+            if not stage.batch_size or len(pending[stage.name]) >= stage.batch_size: return True
+            if all(finished(up) for up in stage.after): return True
+            waited = time.perf_counter() - waiting_since[stage.name]
+            return stage.batch_wait is not None and waited >= stage.batch_wait
+
+        def next_deadline():
+            deadlines = [
+                waiting_since[name] + stage.batch_wait for name, stage in self.stages.items()
+                if pending[name] and stage.batch_size and stage.batch_wait is not None
+            ]
+            return max(0, min(deadlines) - time.perf_counter()) if deadlines else None
+
+        def start(stage, item):
+            running[stage.name] += 1
+            inuse[stage.resource] += 1
+            device = free[stage.resource].popleft() if stage.resource in free else None
+            threading.Thread(target=work, args=(stage, item, device), daemon=True).start()
+
+        while True:
+            for name in reversed(self.order):
+                stage = self.stages[name]
+                if stage.gather:
+                    ready = name not in started_gather and all(finished(up) for up in stage.after)
+                    if ready and can_start(stage):
+                        started_gather.add(name)
+                        start(stage, gathered[name])
+                    continue
+                while pending[name] and batch_ready(stage) and can_start(stage):
+                    start(stage, take_batch(stage))
+                    waiting_since[name] = time.perf_counter()
+            if not any(running.values()): break
+            try:
+                kind, name, payload = events.get(timeout=next_deadline())
+            except queue.Empty:
+                continue
+            if kind == 'emit':
+                if name in outputs:
+                    outputs[name].append(payload)
+                    if on_output: on_output(name, payload)
+                for down in self.downstream[name]:
+                    if self.stages[down].gather: gathered[down].append(payload)
+                    else:
+                        if not pending[down]: waiting_since[down] = time.perf_counter()
+                        pending[down].append(payload)
+            elif kind == 'error':
+                errors.append((name, *payload))
+            elif kind == 'done':
+                running[name] -= 1
+                inuse[self.stages[name].resource] -= 1
+                if payload is not None: free[self.stages[name].resource].append(payload)
+        return PipelineResult(outputs, errors)
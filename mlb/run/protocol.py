@@ -0,0 +1,130 @@
+"""run the methods of a protocol as a DAG, with dependencies from the vars they require and guarantee"""
+import collections
+import concurrent.futures
+import dataclasses
+import heapq
+import threading
+import traceback
+from typing import Any, Callable
+
+def _names(spec, attr):
+    return list(getattr(spec, attr, None) or []) if spec is not None else []
+
+def protocol_graph(methods, available=()) -> dict[str, set[str]]:
+    """for each method name, the methods that guarantee the vars its param requires. Vars in available
+    (usually the protocol's own inputs) need no producer. Asserts if any required var has no producer"""
+    producers = collections.defaultdict(set)
+    for method in methods:
+        for var in _names(method.result, 'guaranteed'):
+            producers[var].add(method.name)
+    graph, missing = {}, []
+    for method in methods:
+        graph[method.name] = set()
+        for var in _names(method.param, 'required'):
+            if var in available: continue
+            if not producers[var] - {method.name}: missing.append(f'{method.name} requires {var}')
+            graph[method.name] |= producers[var] - {method.name}
+    assert not missing, f'no method guarantees the vars: {", ".join(missing)}'
+    assert_acyclic(graph)
+    return graph
+
+def assert_acyclic(graph):
+    """Kahn's algorithm. Asserts with the methods on or after a cycle"""
+    indegree = {name: len(up) for name, up in graph.items()}
+    downstream = collections.defaultdict(list)
+    for name, up in graph.items():
+        for u in up:
+            downstream[u].append(name)
+    ready = [name for name, n in indegree.items() if n == 0]
+    while ready:
+        for down in downstream[ready.pop()]:
+            indegree[down] -= 1
+            if indegree[down] == 0: ready.append(down)
+    cycle = sorted(name for name, n in indegree.items() if n)
+    assert not cycle, f'protocol methods form a cycle: {cycle}'
+
+def critical_path(graph, durations=None):
+    """priority of each method, the longest chain of durations from it to the end of the protocol, and that
+    longest chain for the whole protocol. durations default to 1"""
+    durations = durations or {}
+    downstream = collections.defaultdict(list)
+    for name, up in graph.items():
+        for u in up:
+            downstream[u].append(name)
+    priority, after = {}, {}
+
+    def visit(name):
+        if name not in priority:
+            best = max(downstream[name], key=visit, default=None)
+            after[name] = best
+            priority[name] = durations.get(name, 1) + (priority[best] if best else 0)
+        return priority[name]
+
+    for name in graph:
+        visit(name)
+    path, name = [], max(graph, key=priority.get, default=None)
+    while name:
+        path.append(name)
+        name = after[name]
+    return priority, path
+
+@dataclasses.dataclass
+class ProtocolResult:
+    results: dict[str, Any]
+    errors: dict[str, str]
+    skipped: list[str]
+    started: list[str]
+
+def run_protocol(methods, run: Callable, available=(), max_parallel=None, durations=None) -> ProtocolResult:
+    """run(method) for every method once all its producers have finished, up to max_parallel at once, and
+    longest remaining chain first. The graph is checked before anything runs. Methods downstream of a
+    failure are skipped. run could, for example, submit method_jobs to an executor and wait for them"""
+    methods = {m.name: m for m in methods}
+    graph = protocol_graph(methods.values(), available)
+    priority, _ = critical_path(graph, durations)
+    waiting = {name: set(up) for name, up in graph.items()}
+    downstream = collections.defaultdict(list)
+    for name, up in graph.items():
+        for u in up:
+            downstream[u].append(name)
+    result = ProtocolResult({}, {}, [], [])
+    ready = [(-priority[name], name) for name, up in waiting.items() if not up]
+    heapq.heapify(ready)
+    done = collections.deque()
+    finished = threading.Condition()
+
+    def work(name):
+        try:
+            result.results[name] = run(methods[name])
+        except Exception:
+            result.errors[name] = traceback.format_exc()
+        with finished:
+            done.append(name)
+            finished.notify()
+
+    def skip(name):
+        for down in downstream[name]:
+            if down not in result.skipped:
+                result.skipped.append(down)
+                skip(down)
+
+    running = 0
+    with concurrent.futures.ThreadPoolExecutor(max_parallel or len(methods) or 1) as pool:
+        while ready or running:
+            while ready and (max_parallel is None or running < max_parallel):
+                _, name = heapq.heappop(ready)
+                result.started.append(name)
+                pool.submit(work, name)
+                running += 1
+            with finished:
+                finished.wait_for(lambda: done)
+                name = done.popleft()
+            running -= 1
+            if name in result.errors:
+                skip(name)
+                continue
+            for down in downstream[name]:
+                waiting[down].discard(name)
+                if not waiting[down] and down not in result.skipped:
+                    heapq.heappush(ready, (-priority[down], down))
+    return result
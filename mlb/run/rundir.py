@@ -0,0 +1,181 @@
+"""lay out run directories from method and benchmark dirs without copying them"""
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+MANIFEST = '.mlb_rundir.json'
+FICLONE = 0x40049409
+LINK_MODES = ('auto', 'reflink', 'hardlink', 'symlink', 'copy')
+
+def hash_file(path, chunksize=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as inp:
+        while chunk := inp.read(chunksize):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def reflink(src, dst):
+    with open(src, 'rb') as inp, open(dst, 'wb') as out:
+        try:
+            fcntl.ioctl(out.fileno(), FICLONE, inp.fileno())
+        except OSError:
+            os.unlink(dst)
+            raise
+
+def clone_file(src, dst):
+    """reflink if the filesystem can, else copy"""
+    try:
+        reflink(src, dst)
+        shutil.copymode(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+class HashIndex:
+    """sha256 of files, remembered by (size, mtime) in a json file so unchanged files are not hashed again"""
+    def __init__(self, fname):
+        self.fname = Path(fname)
+        self.index = json.loads(self.fname.read_text()) if self.fname.exists() else {}
+
+    def digest(self, path):
+        path = Path(path).resolve()
+        stat = path.stat()
+        key, sig = str(path), [stat.st_size, stat.st_mtime_ns]
+        if key in self.index and self.index[key][:2] == sig: return self.index[key][2]
+        digest = hash_file(path)
+        self.index[key] = [*sig, digest]
+        return digest
+
+    def save(self):
+        tmp = self.fname.with_suffix(f'.tmp{os.getpid()}')
+        tmp.write_text(json.dumps(self.index))
+        os.replace(tmp, self.fname)
+
+class ContentStore:
+    """files stored once under root by sha256, read-only so that a run can't change them in place"""
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hashes = HashIndex(self.root / 'index.json')
+
+    def path(self, digest):
+        return self.root / digest[:2] / digest[2:]
+
+    def digest(self, src):
+        return self.hashes.digest(src)
+
+    def put(self, src):
+        digest = self.digest(src)
+        dst = self.path(digest)
+        if not dst.exists():
+            dst.parent.mkdir(exist_ok=True)
+            tmp = dst.with_suffix(f'.tmp{os.getpid()}')
+            shutil.copy2(src, tmp)
+            os.chmod(tmp, os.stat(tmp).st_mode & ~0o222)
+            os.replace(tmp, dst)
+        return digest
+
+    def materialize(self, digest, dst, mode='auto'):
+        """put the stored file at dst. auto means reflink, else hardlink, else copy"""
+        assert mode in LINK_MODES, f'unknown link mode {mode}'
+        src = self.path(digest)
+        if mode == 'symlink': return os.symlink(src.resolve(), dst)
+        if mode in ('auto', 'reflink'):
+            try:
+                reflink(src, dst)
+                return os.chmod(dst, os.stat(src).st_mode | 0o200)
+            except OSError:
+                if mode == 'reflink': raise
+        if mode in ('auto', 'hardlink'):
+            try:
+                return os.link(src, dst)
+            except OSError as e:
+                if mode == 'hardlink' or e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK): raise
+        shutil.copy2(src, dst)
+        os.chmod(dst, os.stat(src).st_mode | 0o200)
+
+    def save_index(self):
+        self.hashes.save()
+
+def build_rundir(run_dir, sources, store, mode='auto', links=None, skip=('__pycache__', )):
+    """fill run_dir with the files from each of sources, later sources winning like cp -r one after the other.
+    Symlinks are kept as symlinks, links maps names to replace with a symlink to somewhere else. The hash of
+    every file goes into run_dir/.mlb_rundir.json for verify_rundir"""
+    run_dir = Path(run_dir)
+    store = store if isinstance(store, ContentStore) else ContentStore(store)
+    links = links or {}
+    files, symlinks, dirs = {}, {}, set()
+    for source in sources:
+        source = Path(source)
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames[:] = [d for d in dirnames if d not in skip]
+            for name in filenames + dirnames:
+                path = Path(dirpath) / name
+                rel = str(path.relative_to(source))
+                if rel in links: continue
+                if path.is_symlink():
+                    symlinks[rel] = os.readlink(path)
+                    files.pop(rel, None)
+                elif path.is_file():
+                    files[rel] = store.put(path)
+                    symlinks.pop(rel, None)
+                else:
+                    dirs.add(rel)
+    store.save_index()
+
+    run_dir.mkdir(parents=True, exist_ok=True)
+    for rel in sorted(dirs - set(symlinks) - set(links)):
+        (run_dir / rel).mkdir(parents=True, exist_ok=True)
+    for rel, digest in sorted(files.items()):
+        dst = run_dir / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists() or dst.is_symlink(): dst.unlink()
+        store.materialize(digest, dst, mode)
+    for rel, target in sorted({**symlinks, **links}.items()):
+        dst = run_dir / rel
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists() or dst.is_symlink(): dst.unlink()
+        os.symlink(target, dst)
+    manifest = dict(store=str(store.root.resolve()), mode=mode, files=files)
+    (run_dir / MANIFEST).write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+def verify_rundir(run_dir):
+    """names of files in run_dir that are missing or differ from the hash they were laid out with"""
+    run_dir = Path(run_dir)
+    manifest = json.loads((run_dir / MANIFEST).read_text())
+    bad = []
+    for rel, digest in manifest['files'].items():
+        path = run_dir / rel
+        if not path.exists() or hash_file(path) != digest: bad.append(rel)
+    return bad
+
+def bench_rundir(bench_type, bench_which, method, root='.', mode='auto', store=None):
+    """the run dir temp_do_run.sh used to make with cp -r: method dir, then benchmark dir on top, with
+    ml_benchmarks pointing at root"""
+    root = Path(root).resolve()
+    method_dir = root / 'methods' / bench_type / bench_which / method
+    bench_dir = root / 'benchmarks' / bench_type / bench_which
+    return build_rundir(
+        root / 'runs' / bench_type / bench_which / method,
+        sources=[method_dir, bench_dir],
+        store=store or root / 'runs' / '.store',
+        mode=mode,
+        links=dict(ml_benchmarks=str(root)),
+    )
+
+def rundir_command(bench_type, bench_which, method, mode='auto', verify=False):
+    """`mlb rundir` and `python -m mlb.run rundir`: lay out runs/<bench_type>/<bench_which>/<method>, or with
+    verify list the files changed in it. Returns the exit code"""
+    run_dir = f'runs/{bench_type}/{bench_which}/{method}'
+    if verify:
+        bad = verify_rundir(run_dir)
+        for fname in bad:
+            print('changed:', fname)
+        return 1 if bad else 0
+    manifest = bench_rundir(bench_type, bench_which, method, mode=mode)
+    print(f'{run_dir}: {len(manifest["files"])} files')
+    return 0
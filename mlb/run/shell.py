@@ -1,5 +1,125 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import signal
 import subprocess
+import sys
+import time
 
 def bash(cmd):
     result = subprocess.run(cmd, shell=True, capture_output=True)
     return result.stdout.decode(), result.stderr.decode(), result.returncode
+
+class ShellResult(tuple):
+    """(stdout, stderr, returncode) like bash, plus wall_time in seconds, max_rss_kb of the command and
+    everything it ran, and whether it was killed for running past its timeout"""
+    def __new__(cls, stdout, stderr, returncode, wall_time=0.0, max_rss_kb=0, timed_out=False):
+        self = super().__new__(cls, (stdout, stderr, returncode))
+        self.wall_time, self.max_rss_kb, self.timed_out = wall_time, max_rss_kb, timed_out
+        return self
+
+    stdout = property(lambda self: self[0])
+    stderr = property(lambda self: self[1])
+    returncode = property(lambda self: self[2])
+
+# runs the command and reports its exit code and peak rss. asyncio reaps children itself so it can't tell us
+_RUSAGE_WRAPPER = '''
+import json, os, sys
+fd = int(sys.argv[1])
+os.set_inheritable(fd, False)
+pid = os.posix_spawn('/bin/sh', ['/bin/sh', '-c', sys.argv[2]], os.environ)
+_, status, usage = os.wait4(pid, 0)
+os.write(fd, json.dumps([os.waitstatus_to_exitcode(status), usage.ru_maxrss]).encode())
+'''
+
+class RotatingLog:
+    """a line callback for abash that writes to fname, keeping at most backups old files of max_bytes.
+    close() it, or use it as a context manager, to close the file"""
+    def __init__(self, fname, max_bytes=100 * 2**20, backups=3):
+        self.handler = logging.handlers.RotatingFileHandler(fname, maxBytes=max_bytes, backupCount=backups)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        self.logger = logging.Logger(f'mlb.run.shell.{fname}')
+        self.logger.addHandler(self.handler)
+
+    def __call__(self, line):
+        self.logger.info(line.rstrip('\n'))
+
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+rotating_log = RotatingLog
+
+# longest line abash passes on; a longer one fails the call with ValueError
+_STREAM_LIMIT = 2**24
+
+async def _pump(stream, callback, captured):
+    while line := await stream.readline():
+        line = line.decode(errors='replace')
+        if callback: callback(line)
+        if captured is not None: captured.append(line)
+
+async def abash(cmd, timeout=None, on_stdout=None, on_stderr=None, capture=True, semaphore=None):
+    """bash without blocking the event loop. Output is passed to on_stdout/on_stderr a line at a time as it
+    comes, and only kept in the result if capture. Past timeout seconds or on cancellation the command and
+    everything it started are killed. With a semaphore, waits for it before starting"""
+    if semaphore is not None:
+        async with semaphore:
+            return await abash(cmd, timeout, on_stdout, on_stderr, capture)
+    rfd, wfd = os.pipe()
+    start = time.perf_counter()
+    with os.fdopen(rfd, 'rb') as report_pipe:
+        try:
+            proc = await asyncio.create_subprocess_exec(sys.executable, '-c', _RUSAGE_WRAPPER, str(wfd), cmd,
+                                                        stdout=asyncio.subprocess.PIPE,
+                                                        stderr=asyncio.subprocess.PIPE, pass_fds=(wfd, ),
+                                                        start_new_session=True, limit=_STREAM_LIMIT)
+        finally:
+            os.close(wfd)
+        stdout, stderr = ([], []) if capture else (None, None)
+        timed_out = finished = False
+        tasks = [asyncio.ensure_future(_pump(proc.stdout, on_stdout, stdout)),
+                 asyncio.ensure_future(_pump(proc.stderr, on_stderr, stderr))]
+        pumps = asyncio.gather(*tasks)
+        try:
+            await asyncio.wait_for(asyncio.shield(pumps), timeout)
+            await proc.wait()
+            finished = True
+        except asyncio.TimeoutError:
+            timed_out = True
+        finally:
+            # past the timeout, on cancellation, or when a pump fails, e.g. on a line longer than _STREAM_LIMIT
+            if not finished:
+                _kill_group(proc)
+                await proc.wait()
+                # anything the command left running in the background was killed too, so the pipes close soon
+                await asyncio.wait(tasks, timeout=5)
+                for task in tasks:
+                    task.cancel()
+        report = report_pipe.read()
+    returncode, max_rss_kb = json.loads(report) if report else (proc.returncode, 0)
+    out = ''.join(stdout) if capture else ''
+    err = ''.join(stderr) if capture else ''
+    return ShellResult(out, err, returncode, time.perf_counter() - start, max_rss_kb, timed_out)
+
+def _kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def abash_many(cmds, max_parallel=None, **kw):
+    """abash each of cmds, at most max_parallel at once. Results are in the same order as cmds"""
+    semaphore = asyncio.Semaphore(max_parallel or os.cpu_count())
+    return await asyncio.gather(*(abash(cmd, semaphore=semaphore, **kw) for cmd in cmds))
+
+def bash_many(cmds, max_parallel=None, **kw):
+    return asyncio.run(abash_many(cmds, max_parallel, **kw))
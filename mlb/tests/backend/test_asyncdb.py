@@ -0,0 +1,97 @@
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+import pytest
+
+import ipd
+import mlb
+
+def main():
+    ipd.tests.maintest(mlb.tests.conftest.mlb_test_stuff, globals())
+
+def test_async_url():
+    assert str(mlb.backend.async_url('sqlite:////tmp/a.db')) == 'sqlite+aiosqlite:////tmp/a.db'
+    assert str(mlb.backend.async_url('postgresql://u@host/db')) == 'postgresql+asyncpg://u@host/db'
+    with pytest.raises(AssertionError):
+        mlb.backend.async_url('mysql://u@host/db')
+
+def test_async_routes(backend, testclient):
+    pytest.importorskip('aiosqlite')
+    backend.enable_async()
+    alice = backend.newuser(name='alice')
+    backend.newusers([dict(name=f'user{i}') for i in range(10)])
+    assert testclient.get('/api/async/user/alice').json()['id'] == str(alice.id)
+    assert testclient.get(f'/api/async/user/{alice.id}').json()['name'] == 'alice'
+    assert testclient.get('/api/async/user/nobody').status_code == 404
+    assert testclient.get('/api/async/nokind/alice').status_code == 404
+    assert testclient.get('/api/async/count/user').json() == 11
+    page = testclient.get('/api/async/user', params=dict(limit=5, prefix='user')).json()
+    assert len(page['items']) == 5 and page['next']
+    graph = testclient.get('/api/async/graph/user', params=dict(names=['alice'], depth=1)).json()
+    assert graph[0]['name'] == 'alice' and graph[0]['groups'] == []
+
+def test_async_writes(backend, testclient):
+    pytest.importorskip('aiosqlite')
+    backend.enable_async()
+    ids = testclient.post('/api/async/newmany/user', json=[dict(name='alice'), dict(name='bob')]).json()
+    assert len(ids) == 2 and backend.nusers() == 2
+    specs = [('user', dict(name='alice', fullname='Alice')), ('group', dict(name='good', users=['bob']))]
+    alice, good = testclient.post('/api/async/upsert_many', json=specs).json()
+    assert alice == ids[0] and backend.row('user', 'alice')['fullname'] == 'Alice'
+    assert backend.graph('group', [good], depth=1)[0]['users'][0]['name'] == 'bob'
+    response = testclient.post('/api/async/newmany/var', json=[dict(name='v', user='nobody')])
+    assert response.status_code == 422
+    assert testclient.post('/api/async/newmany/nokind', json=[]).status_code == 404
+    assert testclient.get('/api/features').json()['async_db']
+
+def test_client_async_routes(backend, client):
+    pytest.importorskip('aiosqlite')
+    backend.enable_async()
+    client.async_db = None
+    alice, _ = client.newusers([dict(name='alice'), dict(name='bob')])
+    assert client.async_db is True
+    client.upsert_many([('user', dict(name='alice', fullname='Alice'))])
+    assert client.row('user', alice)['fullname'] == 'Alice'
+    assert sorted(u['name'] for u in client.page('user')['items']) == ['alice', 'bob']
+    assert client.graph('user', ['bob'], depth=1)[0]['groups'] == []
+
+async def load(url, nclients, nrequests):
+    latencies = []
+    limits = httpx.Limits(max_connections=nclients, max_keepalive_connections=nclients)
+    async with httpx.AsyncClient(limits=limits, timeout=600) as http:
+
+        async def worker():
+            for _ in range(nrequests):
+                start = time.perf_counter()
+                response = await http.get(url)
+                latencies.append(1000 * (time.perf_counter() - start))
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(nclients)))
+    return latencies, time.perf_counter() - start
+
+def bench_asyncdb(nrequests=20, nusers=1000, port=54340):
+    """latency percentiles of listing a page of users through the sync and async routes, with 10, 100 and
+    1000 concurrent clients on one worker"""
+    dburl = f'sqlite:////{tempfile.mkdtemp()}/bench.db'
+    server, backend, client = mlb.backend.run(port=port, dburl=dburl, workers=1, loglevel='warning',
+                                              sqlite_profile=True, async_db=True)
+    try:
+        backend.newusers([dict(name=f'user{i}') for i in range(nusers)])
+        for label, path in [('sync', '/api/page/user'), ('async', '/api/async/user')]:
+            for nclients in [10, 100, 1000]:
+                url = f'http://localhost:{port}{path}?limit=100'
+                latencies, elapsed = asyncio.run(load(url, nclients, nrequests))
+                q = statistics.quantiles(latencies, n=100)
+                print(f'{label:5} {nclients:5} clients  p50 {q[49]:8.1f}ms  p90 {q[89]:8.1f}ms  '
+                      f'p99 {q[98]:8.1f}ms  {len(latencies) / elapsed:8.1f} req/s')
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    bench_asyncdb(*map(int, sys.argv[1:]))
@@ -0,0 +1,72 @@
+import sys
+import time
+
+import pytest
+
+import mlb
+
+def test_newmany_backend(backend):
+    ids = backend.newusers([dict(name=f'user{i}') for i in range(1000)])
+    assert len(set(ids)) == 1000
+    assert backend.nusers() == 1000
+
+def test_newmany_is_one_transaction(backend):
+    backend.newuser(name='alice')
+    with pytest.raises(Exception):
+        backend.newusers([dict(name='bob'), dict(name='alice'), dict(name='craig')])
+    assert backend.nusers() == 1
+
+def test_newmany_refs_and_links(backend, testclient):
+    backend.newusers([dict(name='alice'), dict(name='bob')])
+    backend.newgroups([dict(name='good', users=['alice', 'bob'])])
+    assert sorted(u.name for u in backend.groups(['good'])[0].users) == ['alice', 'bob']
+    response = testclient.post('/api/newmany/result', json=[dict(name='a', user='nobody')])
+    assert response.status_code == 422
+    assert backend.nresults() == 0
+
+def test_upsert_many_backend(backend):
+    backend.newuser(name='alice', fullname='Alice')
+    ids = backend.upsert_many([
+        mlb.UserSpec(name='alice', fullname='Alice Liddell'),
+        mlb.UserSpec(name='bob'),
+        ('group', dict(name='good')),
+    ])
+    assert len(ids) == 3
+    assert backend.nusers() == 2
+    assert backend.ngroups() == 1
+    assert backend.users(['alice'])[0].fullname == 'Alice Liddell'
+    assert backend.upsert_many([mlb.UserSpec(name='alice')]) == ids[:1]
+
+def test_newmany_client(client):
+    ids = client.newusers([dict(name=f'user{i}') for i in range(1000)])
+    assert len(ids) == 1000
+    assert client.nusers() == 1000
+
+def test_upsert_many_client(client):
+    client.newuser(name='alice')
+    ids = client.upsert_many([mlb.UserSpec(name='alice', fullname='Alice'), mlb.UserSpec(name='bob')])
+    assert len(ids) == 2
+    assert client.nusers() == 2
+    assert client.users(['alice'])[0].fullname == 'Alice'
+
+def bench_bulk(n=5000):
+    """specs per second over http, one newuser call at a time vs one newusers call"""
+    with mlb.tests.conftest.mlb_test_stuff() as stuff:
+        client, backend = stuff.client, stuff.backend
+        nsingle = n // 50
+        start = time.perf_counter()
+        for i in range(nsingle):
+            client.newuser(name=f'single{i}')
+        single = nsingle / (time.perf_counter() - start)
+        start = time.perf_counter()
+        client.newusers([dict(name=f'bulk{i}') for i in range(n)])
+        bulk = n / (time.perf_counter() - start)
+        start = time.perf_counter()
+        client.upsert_many([mlb.UserSpec(name=f'bulk{i}', fullname='updated') for i in range(n)])
+        upsert = n / (time.perf_counter() - start)
+        print(f'newuser    {single:9.1f} specs/s ({nsingle} specs)')
+        print(f'newusers   {bulk:9.1f} specs/s ({n} specs)')
+        print(f'upsert_many{upsert:9.1f} specs/s ({n} specs, all updates)')
+
+if __name__ == '__main__':
+    bench_bulk(*map(int, sys.argv[1:]))
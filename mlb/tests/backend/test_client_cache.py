@@ -0,0 +1,183 @@
+import time
+
+from assertpy import assert_that as ASSERT
+
+from mlb.frontend.cache import MISSING, ClientCache
+
+def test_cache_lru():
+    cache = ClientCache(['user', 'group'], maxsize=2)
+    cache.put('user', dict(id='1', name='alice'))
+    cache.put('user', dict(id='2', name='bob'))
+    ASSERT(cache.get('user', '1')).is_equal_to(dict(id='1', name='alice'))
+    cache.put('user', dict(id='3', name='craig'))
+    ASSERT(cache.get('user', 'bob')).is_none()
+    ASSERT(cache.get('user', 'alice')['id']).is_equal_to('1')
+    ASSERT(cache.get('user', '3')['name']).is_equal_to('craig')
+    ASSERT((cache.hits, cache.misses)).is_equal_to((3, 1))
+    ASSERT(cache.ids).is_equal_to({('user', 'alice'): '1', ('user', 'craig'): '3'})
+
+def test_cache_keys():
+    cache = ClientCache(['user', 'group'])
+    cache.put('user', dict(id='1', name='good'))
+    cache.put('group', dict(id='2', name='good'))
+    ASSERT(cache.get('group', 'good')['id']).is_equal_to('2')
+    ASSERT(cache.get('user', 'good')['id']).is_equal_to('1')
+    ASSERT(cache.get('group', '1')).is_none()
+    cache.put('user', dict(id='1', name='better'))
+    ASSERT(cache.get('user', 'good')).is_none()
+    ASSERT(cache.get('user', 'better')['id']).is_equal_to('1')
+    cache.put('user', dict(name='noid'))
+    ASSERT(cache.get('user', 'noid')).is_none()
+
+def test_cache_ttl():
+    cache = ClientCache(['user'], ttl=0.05)
+    cache.put('user', dict(id='1'))
+    ASSERT(cache.get('user', '1')).is_equal_to(dict(id='1'))
+    time.sleep(0.1)
+    ASSERT(cache.get('user', '1')).is_none()
+    ASSERT(cache.rows).is_empty()
+
+def test_cache_returns_copies():
+    cache = ClientCache(['user'])
+    cache.put('user', dict(id='1', name='alice'))
+    cache.get('user', '1')['name'] = 'bob'
+    ASSERT(cache.get('user', '1')).is_equal_to(dict(id='1', name='alice'))
+
+def test_cache_invalidate_by_kind():
+    cache = ClientCache(['user', 'group', 'method'])
+    cache.put('user', dict(id='1', name='u'))
+    cache.put('group', dict(id='2', name='g'))
+    cache.put('method', dict(id='3', name='m'))
+    cache.invalidate(['group'])
+    cached = lambda kind, key: cache.get(kind, key) is not None
+    ASSERT([cached('user', 'u'), cached('group', 'g'), cached('method', '3')]).is_equal_to([True, False, True])
+    cache.invalidate()
+    ASSERT(cache.get('method', 'm')).is_none()
+    ASSERT(cache.ids).is_empty()
+
+def test_cache_put_graph():
+    cache = ClientCache(['protocol', 'method', 'user', 'exe'])
+    exe = dict(id='e', name='bash', path='/bin/bash')
+    invars = [dict(id='v', name='in')]
+    methods = [dict(id=f'm{i}', name=f'method{i}', exe=exe, invars=invars) for i in range(2)]
+    proto = dict(id='p', name='proto', config=None, methods=methods, users=[], queries=dict(a=['b']))
+    cache.put_graph('protocol', [proto])
+    ASSERT(cache.get('protocol', 'proto')).is_equal_to(dict(id='p', name='proto', config=None,
+                                                            queries=dict(a=['b'])))
+    ASSERT(cache.get('method', 'method1')).is_equal_to(dict(id='m1', name='method1'))
+    ASSERT(cache.get('exe', 'e')).is_equal_to(exe)
+
+def test_cache_kinds():
+    cache = ClientCache(['user', 'group', 'method', 'methodresult'])
+    ASSERT(cache.url_kinds('/users?name=alice')).is_equal_to({'user'})
+    ASSERT(cache.url_kinds('/methodresult/123')).is_equal_to({'methodresult'})
+    ASSERT(cache.url_kinds('/nusers')).is_equal_to({'user'})
+    ASSERT(cache.url_kinds('/changes')).is_empty()
+    value = [dict(name='a', userid='1', groupids=['2']), dict(method='m')]
+    ASSERT(cache.value_kinds(value)).is_equal_to({'user', 'group', 'method'})
+
+def test_client_cache_hits(client):
+    client.enable_cache()
+    alice = client.newuser(name='alice')
+    ASSERT(client.row('user', 'alice')['id']).is_equal_to(str(alice.id))
+    ASSERT(client.row('user', alice.id)['name']).is_equal_to('alice')
+    ASSERT(client.cache.hits).is_equal_to(1)
+    client.page('user')
+    ASSERT(client.cache.get('user', 'alice')['id']).is_equal_to(str(alice.id))
+
+def test_client_cache_own_writes(client):
+    client.enable_cache()
+    client.newuser(name='alice')
+    client.row('user', 'alice')
+    client.upsert_many([('user', dict(name='alice', fullname='Alice'))])
+    ASSERT(client.row('user', 'alice')['fullname']).is_equal_to('Alice')
+
+def test_client_cache_other_writes(client, backend):
+    backend.enable_change_counts()
+    client.enable_cache(revalidate=0)
+    backend.newuser(name='alice')
+    ASSERT(client.row('user', 'alice')['fullname']).is_equal_to('')
+    backend.newgroup(name='good')
+    client.row('group', 'good')
+    backend.upsert_many([('user', dict(name='alice', fullname='Alice'))])
+    ASSERT(client.row('user', 'alice')['fullname']).is_equal_to('Alice')
+    ASSERT(client.cache.get('group', 'good')).is_not_none()
+
+def test_changes_route(backend, testclient):
+    backend.enable_change_counts()
+    before = testclient.get('/api/changes').json()
+    backend.newusers([dict(name='alice'), dict(name='bob')])
+    after = testclient.get('/api/changes').json()
+    ASSERT(after['user'] - before['user']).is_equal_to(2)
+    ASSERT(after['group']).is_equal_to(before['group'])
+
+def make_protocol(client, nmethods):
+    bash = client.getornewexe(name='bash', path='/bin/bash')
+    param = lambda name: client.newparam(name=name, invars=[client.getornewvar(name='in', kind='str')])
+    result = lambda name: client.newresult(name=name, outvars=[client.getornewvar(name='out', kind='str')])
+    methods = [
+        client.newmethod(name=f'method{i}', exe=bash, param=param(f'param{i}'), result=result(f'result{i}'))
+        for i in range(nmethods)
+    ]
+    return client.newprotocol(name='walk', param=param('proto_param'), result=result('proto_result'),
+                              methods=methods)
+
+def walk(proto):
+    methods = [(m.exe.name, [v.name for v in m.param.invars], [v.name for v in m.result.outvars])
+               for m in proto.methods]
+    return [v.name for v in proto.param.invars], [v.name for v in proto.result.outvars], methods
+
+def test_client_cache_protocol_walk(client, monkeypatch):
+    import ipd
+    proto = make_protocol(client, nmethods=20)
+    requests, uncached_get = [], ipd.crud.ClientBase.get
+
+    def get(self, url, *args, **kw):
+        requests.append(url)
+        return uncached_get(self, url, *args, **kw)
+
+    monkeypatch.setattr(ipd.crud.ClientBase, 'get', get)
+    expected = walk(proto)
+    without_cache = len(requests)
+    try:
+        client.enable_cache(revalidate=None)
+        requests.clear()
+        ASSERT(walk(proto)).is_equal_to(expected)
+        first_walk = len(requests)
+        requests.clear()
+        ASSERT(walk(proto)).is_equal_to(expected)
+        ASSERT(requests).is_empty()
+        ASSERT(first_walk).is_less_than(without_cache)
+    finally:
+        client.disable_cache()
+
+def test_cache_responses():
+    cache = ClientCache(['user', 'group'], maxsize=2)
+    cache.put_response('/user', dict(name='alice'), {'user'}, dict(id='1', name='alice'))
+    ASSERT(cache.get_response('/user', dict(name='alice'))).is_equal_to(dict(id='1', name='alice'))
+    ASSERT(cache.get_response('/user', dict(name='bob'))).is_same_as(MISSING)
+    cache.get_response('/user', dict(name='alice'))['name'] = 'bob'
+    ASSERT(cache.get_response('/user', dict(name='alice'))['name']).is_equal_to('alice')
+    cache.put_response('/group/2', {}, {'group'}, None)
+    ASSERT(cache.get_response('/group/2', {})).is_none()
+    cache.put_response('/group/3', {}, {'group'}, object())
+    ASSERT(cache.get_response('/group/3', {})).is_same_as(MISSING)
+    cache.invalidate(['group'])
+    ASSERT(cache.get_response('/group/2', {})).is_same_as(MISSING)
+    ASSERT(cache.get_response('/user', dict(name='alice'))).is_not_same_as(MISSING)
+    for i in range(3):
+        cache.put_response(f'/user/{i}', {}, {'user'}, i)
+    ASSERT(list(cache.responses)).is_length(2)
+
+def main():
+    test_cache_lru()
+    test_cache_keys()
+    test_cache_ttl()
+    test_cache_returns_copies()
+    test_cache_invalidate_by_kind()
+    test_cache_put_graph()
+    test_cache_kinds()
+    test_cache_responses()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import tempfile
+import uuid
+
+import pytest
+import sqlalchemy
+import sqlmodel
+from sqlmodel import Field, Relationship, SQLModel
+
+from mlb.backend import dbops
+from mlb.backend.dbops import count_changes, new_rows, read_changes, upsert_rows
+
+def main():
+    test_new_rows_refs_and_links()
+    test_upsert_rows()
+    test_bulk_rollback_leaves_other_sessions_alone()
+    test_unknown_ref_rolls_back()
+    test_changes_counted_in_transaction()
+
+class DbopsUserGroup(SQLModel, table=True):
+    userid: uuid.UUID = Field(foreign_key='dbopsuser.id', primary_key=True)
+    groupid: uuid.UUID = Field(foreign_key='dbopsgroup.id', primary_key=True)
+
+class DbopsUser(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    name: str = Field(unique=True)
+    fullname: str = ''
+    groups: list['DbopsGroup'] = Relationship(back_populates='users', link_model=DbopsUserGroup)
+
+class DbopsGroup(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    name: str = Field(unique=True)
+    users: list[DbopsUser] = Relationship(back_populates='groups', link_model=DbopsUserGroup)
+
+class DbopsVar(SQLModel, table=True):
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    name: str = Field(unique=True)
+    kind: str = 'str'
+    userid: uuid.UUID | None = Field(default=None, foreign_key='dbopsuser.id')
+    user: DbopsUser | None = Relationship()
+
+TABLES = [Model.__table__ for Model in (DbopsUserGroup, DbopsUser, DbopsGroup, DbopsVar)]
+
+def make_engine():
+    engine = sqlalchemy.create_engine(f'sqlite:///{tempfile.mkdtemp()}/dbops.db')
+    SQLModel.metadata.create_all(engine, tables=TABLES)
+    return engine
+
+def count(engine, Model):
+    with sqlmodel.Session(engine) as session:
+        return session.exec(sqlmodel.select(sqlalchemy.func.count()).select_from(Model)).one()
+
+def test_new_rows_refs_and_links():
+    engine = make_engine()
+    with sqlmodel.Session(engine) as session, session.begin():
+        alice, bob = new_rows(session, DbopsUser, [dict(name='alice'), dict(name='bob', fullname='Bob')])
+        new_rows(session, DbopsVar, [dict(name='a', user='alice'), dict(name='b', user=str(bob.id)),
+                                     dict(name='c', kind='int')], defaults=dict(user='bob'))
+        new_rows(session, DbopsGroup, [dict(name='good', users=['alice', dict(name='bob')])])
+    with sqlmodel.Session(engine) as session:
+        users = {v.name: v.user.name for v in session.exec(sqlmodel.select(DbopsVar))}
+        assert users == dict(a='alice', b='bob', c='bob')
+        good = session.exec(sqlmodel.select(DbopsGroup)).one()
+        assert sorted(u.name for u in good.users) == ['alice', 'bob']
+
+def test_upsert_rows():
+    engine = make_engine()
+    with sqlmodel.Session(engine) as session, session.begin():
+        new_rows(session, DbopsUser, [dict(name='alice', fullname='Alice'), dict(name='bob')])
+        new_rows(session, DbopsVar, [dict(name='a', user='alice')])
+    with sqlmodel.Session(engine) as session, session.begin():
+        rows = upsert_rows(session, DbopsVar, [dict(name='a', kind='int'), dict(name='b')], dict(user='bob'))
+        ids = [row.id for row in rows]
+    with sqlmodel.Session(engine) as session:
+        a, b = [session.get(DbopsVar, id) for id in ids]
+        assert (a.name, a.kind, a.user.name) == ('a', 'int', 'alice')
+        assert (b.name, b.kind, b.user.name) == ('b', 'str', 'bob')
+
+def test_bulk_rollback_leaves_other_sessions_alone():
+    engine = make_engine()
+    with sqlmodel.Session(engine) as session, session.begin():
+        new_rows(session, DbopsUser, [dict(name='alice')])
+    shared = sqlmodel.Session(engine)
+    shared.add(DbopsUser(name='craig'))
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        with sqlmodel.Session(engine) as session, session.begin():
+            new_rows(session, DbopsUser, [dict(name='bob'), dict(name='alice')])
+    assert count(engine, DbopsUser) == 1
+    assert [u.name for u in shared.new] == ['craig']
+    shared.commit()
+    assert count(engine, DbopsUser) == 2
+
+def test_unknown_ref_rolls_back():
+    engine = make_engine()
+    with pytest.raises(ValueError, match='nobody'):
+        with sqlmodel.Session(engine) as session, session.begin():
+            new_rows(session, DbopsUser, [dict(name='alice')])
+            new_rows(session, DbopsVar, [dict(name='a', user='nobody')])
+    assert count(engine, DbopsUser) == 0
+    with pytest.raises(ValueError, match='no field'):
+        with sqlmodel.Session(engine) as session, session.begin():
+            new_rows(session, DbopsUser, [dict(name='alice', shoesize=9)])
+
+def test_changes_counted_in_transaction():
+    engine, other = make_engine(), make_engine()
+    kinds = {DbopsUser: 'dbopsuser', DbopsGroup: 'dbopsgroup'}
+    count_changes(engine, kinds)
+    count_changes(engine, kinds)
+
+    def changes():
+        with engine.connect() as conn:
+            return read_changes(conn)
+
+    statements = []
+    sqlalchemy.event.listen(engine, 'before_cursor_execute', lambda *a: statements.append((a[2], a[3])))
+    assert changes() == dict(dbopsuser=0, dbopsgroup=0)
+    with sqlmodel.Session(engine) as session, session.begin():
+        new_rows(session, DbopsUser, [dict(name='alice')])
+        new_rows(session, DbopsGroup, [dict(name='bad')])
+        new_rows(session, DbopsUser, [dict(name='bob')])
+        new_rows(session, DbopsVar, [dict(name='a')])
+        assert not [s for s, _ in statements if s.startswith('UPDATE changes')]
+    # one bump per kind, at commit, in kind order
+    bumps = [params for s, params in statements if s.startswith('UPDATE changes')]
+    assert [params[-1] for params in bumps] == ['dbopsgroup', 'dbopsuser']
+    assert changes() == dict(dbopsuser=2, dbopsgroup=1)
+    with pytest.raises(sqlalchemy.exc.IntegrityError):
+        with sqlmodel.Session(engine) as session, session.begin():
+            new_rows(session, DbopsGroup, [dict(name='good', users=['alice'])])
+            new_rows(session, DbopsUser, [dict(name='bob')])
+    assert changes() == dict(dbopsuser=2, dbopsgroup=1)
+    with sqlmodel.Session(engine) as session:
+        session.add(DbopsGroup(name='good'))
+        session.commit()
+    assert changes() == dict(dbopsuser=2, dbopsgroup=2)
+    # other has no changes table, so a bump there would fail
+    with sqlmodel.Session(other) as session, session.begin():
+        new_rows(session, DbopsUser, [dict(name='alice')])
+    assert count(other, DbopsUser) == 1
+
+if __name__ == '__main__':
+    main()
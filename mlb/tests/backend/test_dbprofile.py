@@ -0,0 +1,66 @@
+import concurrent.futures
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+
+import ipd
+import mlb
+
+def main():
+    ipd.tests.maintest(mlb.tests.conftest.mlb_test_stuff, globals())
+
+def test_sqlite_engine_pragmas():
+    engine = mlb.backend.sqlite_engine(f'sqlite:///{tempfile.mkdtemp()}/test.db', cache_size=-1024)
+    pragmas = mlb.backend.sqlite_pragmas(engine)
+    assert pragmas['journal_mode'] == 'wal'
+    assert pragmas['synchronous'] == 1
+    assert pragmas['cache_size'] == -1024
+    assert pragmas['busy_timeout'] == 30_000
+
+def test_backend_sqlite_profile():
+    engine = sqlalchemy.create_engine(f'sqlite:///{tempfile.mkdtemp()}/test.db')
+    assert mlb.MLBBackend(engine, tempfile.mkdtemp()).dbengine is engine
+    backend = mlb.MLBBackend(engine, tempfile.mkdtemp(), sqlite_profile=True)
+    assert backend.dbengine is not engine
+    assert mlb.backend.sqlite_pragmas(backend.dbengine)['journal_mode'] == 'wal'
+
+def test_run_sqlite_profile():
+    dbfile = f'{tempfile.mkdtemp()}/test.db'
+    server, backend, client = mlb.backend.run(port=54329, dburl=f'sqlite:///{dbfile}', loglevel='warning',
+                                              sqlite_profile=True)
+    try:
+        assert backend.sqlite_profile
+        assert mlb.backend.sqlite_pragmas(backend.dbengine)['journal_mode'] == 'wal'
+        client.newuser(name='waluser')
+        assert os.path.exists(f'{dbfile}-wal')
+        assert client.row('user', 'waluser')['name'] == 'waluser'
+    finally:
+        server.stop()
+
+def bench_dbprofile(nclients=16, nspecs=100):
+    """specs per second with nclients threads each writing nspecs users, on the default sqlite setup and the
+    sqlite profile"""
+    setups = dict(default={}, profile=dict(sqlite_profile=True))
+    for port, (label, kw) in enumerate(setups.items(), 54330):
+        server, backend, client = mlb.backend.run(port=port, dburl=f'sqlite:////{tempfile.mkdtemp()}/bench.db',
+                                                  loglevel='warning', **kw)
+        try:
+
+            def write(iclient):
+                for i in range(nspecs):
+                    client.newuser(name=f'user{iclient}_{i}')
+
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(nclients) as pool:
+                list(pool.map(write, range(nclients)))
+            elapsed = time.perf_counter() - start
+            rate = nclients * nspecs / elapsed
+            print(f'{label:13} {rate:8.1f} specs/s ({nclients} clients)')
+        finally:
+            server.stop()
+
+if __name__ == '__main__':
+    bench_dbprofile(*map(int, sys.argv[1:]))
@@ -0,0 +1,66 @@
+import sqlalchemy
+
+import ipd
+import mlb
+
+def main():
+    ipd.tests.maintest(mlb.tests.conftest.mlb_test_stuff, globals())
+
+def make_protocol(tool, nmethods):
+    tool.newuser()
+    exe = tool.getornewexe(name='bash', path='/bin/bash')
+    invar, outvar = tool.getornewvar(name='in', kind='str'), tool.getornewvar(name='out', kind='str')
+    methods = [
+        tool.newmethod(name=f'method{i}', exe=exe, param=tool.newparam(name=f'param{i}', invars=[invar]),
+                       result=tool.newresult(name=f'result{i}', outvars=[outvar])) for i in range(nmethods)
+    ]
+    return tool.newprotocol(name='proto', param=tool.newparam(name='proto_param', invars=[invar]),
+                            result=tool.newresult(name='proto_result', outvars=[outvar]), methods=methods)
+
+def count_queries(backend, func):
+    count = [0]
+
+    def counter(*_):
+        count[0] += 1
+
+    sqlalchemy.event.listen(backend.dbengine, 'before_cursor_execute', counter)
+    try:
+        return func(), count[0]
+    finally:
+        sqlalchemy.event.remove(backend.dbengine, 'before_cursor_execute', counter)
+
+def test_graph_backend(backend):
+    make_protocol(backend, 3)
+    proto, = backend.graph('protocol', ['proto'], depth=3)
+    assert [m['name'] for m in proto['methods']] == ['method0', 'method1', 'method2']
+    assert proto['methods'][0]['exe']['name'] == 'bash'
+    assert proto['methods'][0]['param']['invars'][0]['name'] == 'in'
+    assert proto['methods'][2]['result']['outvars'][0]['name'] == 'out'
+
+def test_graph_depth_and_include(backend):
+    make_protocol(backend, 2)
+    proto, = backend.graph('protocol', ['proto'], depth=1)
+    assert 'exe' not in proto['methods'][0]
+    proto, = backend.graph('protocol', ['proto'], depth=3, include='methods exe')
+    assert proto['methods'][0]['exe']['name'] == 'bash'
+    assert 'param' not in proto['methods'][0]
+    assert 'result' not in proto
+
+def test_graph_query_count_is_fixed(backend):
+    make_protocol(backend, 2)
+    _, small = count_queries(backend, lambda: backend.graph('protocol', ['proto'], depth=3))
+    backend._clear_all_data_for_testing_only()
+    make_protocol(backend, 20)
+    proto, big = count_queries(backend, lambda: backend.graph('protocol', ['proto'], depth=3))
+    assert len(proto[0]['methods']) == 20
+    assert big == small
+
+def test_graph_client(client):
+    proto = make_protocol(client, 3)
+    graph, = client.graph('protocol', [proto.id], depth=3)
+    assert graph['name'] == 'proto'
+    assert len(graph['methods']) == 3
+    assert graph['methods'][1]['param']['invars'][0]['kind'] == 'str'
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import sqlmodel
+
+import ipd
+import mlb
+from mlb.backend.backend import create_indexes, index_columns
+
+def main():
+    ipd.tests.maintest(mlb.tests.conftest.mlb_test_stuff, globals())
+
+def query_plan(backend, table, column):
+    with backend.dbengine.connect() as conn:
+        sql = f'EXPLAIN QUERY PLAN SELECT * FROM "{table}" WHERE "{column}" = ?'
+        return ' '.join(str(row[-1]) for row in conn.exec_driver_sql(sql, ('x', )))
+
+def test_indexes_declared(backend):
+    tables = {table.name for table in backend.dbtables()}
+    assert {'user', 'group', 'var', 'method'} <= tables
+    assert create_indexes(backend.dbengine, backend.dbtables()) == []
+
+def test_query_plans_use_indexes(backend):
+    assert backend.dbengine.dialect.name == 'sqlite'
+    for table, column in index_columns(backend.dbtables()):
+        plan = query_plan(backend, table.name, column.name)
+        assert 'USING' in plan and ('INDEX' in plan or 'PRIMARY KEY' in plan), f'{table}.{column}: {plan}'
+
+def latency_ms(func, args):
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        times.append(1000 * (time.perf_counter() - start))
+    q = statistics.quantiles(times, n=100)
+    return f'p50 {q[49]:7.3f}ms p99 {q[98]:7.3f}ms'
+
+def bench_indexes(n=100_000, dburl=None, nqueries=2000):
+    """name lookup and user/group join latency with n vars, with and without the declared indexes. dburl
+    can point at a postgres database to compare with sqlite"""
+    tmpdir = tempfile.mkdtemp()
+    server, backend, client = mlb.backend.run(port=54322, dburl=dburl or f'sqlite:////{tmpdir}/bench.db',
+                                              workers=1, loglevel='warning')
+    try:
+        start = time.perf_counter()
+        for lb in range(0, n, 10_000):
+            backend.newvars([dict(name=f'var{i}') for i in range(lb, min(n, lb + 10_000))])
+        ngroups = max(1, n // 1000)
+        backend.newusers([dict(name=f'user{i}') for i in range(n // 100)])
+        backend.newgroups([dict(name=f'group{g}', users=[f'user{i}' for i in range(g, n // 100, ngroups)])
+                           for g in range(ngroups)])
+        print(f'{backend.dbengine.dialect.name} loaded {n} vars in {time.perf_counter() - start:.1f}s')
+        Var, User, Group = backend.dbmodel('var'), backend.dbmodel('user'), backend.dbmodel('group')
+        session = sqlmodel.Session(backend.dbengine)
+        lookup = lambda name: session.exec(sqlmodel.select(Var).where(Var.name == name)).one()
+        join = lambda name: session.exec(
+            sqlmodel.select(User).join(User.groups).where(Group.name == name)).all()
+        names = [f'var{random.randrange(n)}' for _ in range(nqueries)]
+        group_names = [f'group{random.randrange(ngroups)}' for _ in range(nqueries)]
+        print(f'indexed     lookup {latency_ms(lookup, names)}   join {latency_ms(join, group_names)}')
+        for name in backend.indexes:
+            with backend.dbengine.begin() as conn:
+                conn.exec_driver_sql(f'DROP INDEX "{name}"')
+        print(f'unindexed   lookup {latency_ms(lookup, names)}   join {latency_ms(join, group_names)}')
+        print(f'(dropped {", ".join(backend.indexes)}, unique constraints still index names)')
+    finally:
+        server.stop()
+
+if __name__ == '__main__':
+    bench_indexes(*[int(a) if a.isdigit() else a for a in sys.argv[1:]])
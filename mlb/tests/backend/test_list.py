@@ -0,0 +1,81 @@
+import json
+
+from fastapi.routing import APIRoute
+
+import ipd
+import mlb
+
+def main():
+    ipd.tests.maintest(mlb.tests.conftest.mlb_test_stuff, globals())
+
+def add_vars(tool, n):
+    tool.newvars([dict(name=f'var{i:04}', kind='int' if i % 2 else 'str') for i in range(n)])
+
+def test_page_backend(backend):
+    add_vars(backend, 25)
+    names, after = [], ''
+    while True:
+        page = backend.page('var', after, limit=10)
+        assert len(page['items']) <= 10
+        names += [item['name'] for item in page['items']]
+        if not (after := page['next']): break
+    assert sorted(names) == [f'var{i:04}' for i in range(25)]
+    assert len(set(names)) == 25
+
+def test_page_filters(backend):
+    add_vars(backend, 30)
+    assert len(backend.page('var', prefix='var001')['items']) == 10
+    assert len(backend.page('var', kind_is='int')['items']) == 15
+    assert len(backend.page('var', prefix='var00', kind_is='str')['items']) == 5
+
+def test_page_user_filter(backend):
+    alice, bob = backend.newuser(name='alice'), backend.newuser(name='bob')
+    backend.newresult(name='a', user=alice.id)
+    backend.newresult(name='b', user=bob.id)
+    assert [r['name'] for r in backend.page('result', user='alice')['items']] == ['a']
+    assert [r['name'] for r in backend.page('result', user=str(bob.id))['items']] == ['b']
+
+def test_page_bad_requests(backend, testclient):
+    add_vars(backend, 3)
+    get = lambda path, **params: testclient.get(path, params=params).status_code
+    assert get('/api/page/var', after='notanid') == 422
+    assert get('/api/page/user', kind_is='int') == 400
+    assert get('/api/page/group', user='alice') == 400
+    assert get('/api/page/nokind') == 404
+    assert get('/api/stream/user', kind_is='int') == 400
+    assert get('/api/page/var', kind_is='int') == 200
+
+def test_routes_ahead_of_ipd(backend, testclient):
+    add_vars(backend, 3)
+    # where a catch all that ipd.crud registered before MLBBackend's routes would be
+    catch_all = APIRoute('/api/{kind}/{x}', lambda kind, x: 'catch all')
+    routes = backend.app.router.routes
+    routes.insert(len(backend.mlb_routes), catch_all)
+    try:
+        assert len(testclient.get('/api/page/var').json()['items']) == 3
+        assert testclient.get('/api/row/var/var0001').json()['name'] == 'var0001'
+        assert testclient.get('/api/nokind/x').json() == 'catch all'
+    finally:
+        routes.remove(catch_all)
+
+def test_iterate_backend(backend):
+    add_vars(backend, 25)
+    assert len(list(backend.iterate('var', page_size=7))) == 25
+
+def test_stream(backend, testclient):
+    add_vars(backend, 25)
+    response = testclient.get('/api/stream/var', params=dict(kind_is='str'))
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert len(items) == 13
+    assert all(item['kind'] == 'str' for item in items)
+
+def test_iterate_client(client):
+    add_vars(client, 25)
+    rows = client.iterate('var', page_size=10)
+    assert next(rows)['name'].startswith('var')
+    assert len(list(rows)) == 24
+    assert len(list(client.iterate('var', page_size=10, prefix='var001'))) == 10
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+from assertpy import assert_that as ASSERT
+
+sys.path.append(str(Path(__file__).parents[3] / 'benchmarks/backbone_and_seq_design/common_scripts'))
+import af2_batched
+
+def main():
+    test_merge_silents_keeps_first_headers()
+    test_af2_workers_one_process_per_device()
+
+HEADER = ['SEQUENCE: A\n', 'SCORE:     score plddt_binder description\n']
+REMARK = ['REMARK BINARY SILENTFILE\n']
+
+def silent(*tags):
+    lines = []
+    for tag in tags:
+        lines += [f'SCORE:     0.0 90.0 {tag}\n', f'ANNOTATED_SEQUENCE: AAA {tag}\n', f'L01 abcd {tag}\n']
+    return lines
+
+def test_merge_silents_keeps_first_headers():
+    with tempfile.TemporaryDirectory() as tmp:
+        fnames = []
+        bodies = [HEADER + silent('a', 'b'), HEADER + REMARK + silent('c'), HEADER + silent('description_d')]
+        for i, body in enumerate(bodies):
+            fnames.append(f'{tmp}/{i}.silent')
+            Path(fnames[-1]).write_text(''.join(body))
+        af2_batched.merge_silents(fnames, f'{tmp}/out.silent')
+        merged = Path(f'{tmp}/out.silent').read_text().splitlines(keepends=True)
+    expected = HEADER + silent('a', 'b') + REMARK + silent('c') + silent('description_d')
+    ASSERT(merged).is_equal_to(expected)
+
+# stands in for the AF2 script: copies in.silent to out.silent and notes the process and gpu it ran in
+FAKE_AF2 = """
+import os, sys
+assert sys.argv[1:] == ['-silent', 'in.silent']
+if os.path.exists('fail'): raise ValueError('no prediction')
+with open('in.silent') as inp, open('out.silent', 'w') as out:
+    out.write(f'{os.getpid()} {os.environ["CUDA_VISIBLE_DEVICES"]} ' + inp.read())
+"""
+
+def test_af2_workers_one_process_per_device():
+    with tempfile.TemporaryDirectory() as tmp:
+        Path(f'{tmp}/fake_af2.py').write_text(FAKE_AF2)
+        command = [sys.executable, '-u', af2_batched.af2_worker.__file__, f'{tmp}/fake_af2.py']
+        workers = af2_batched.AF2Workers(command)
+        try:
+            outs = []
+            for i, device in enumerate(['0', '1', '0', '1']):
+                os.makedirs(f'{tmp}/batch{i}')
+                Path(f'{tmp}/batch{i}/in.silent').write_text(f'batch{i}')
+                workers(f'{tmp}/batch{i}', device)
+                outs.append(Path(f'{tmp}/batch{i}/out.silent').read_text().split())
+            ASSERT([out[1:] for out in outs]).is_equal_to([['0', 'batch0'], ['1', 'batch1'], ['0', 'batch2'],
+                                                          ['1', 'batch3']])
+            ASSERT(outs[0][0]).is_equal_to(outs[2][0]).is_not_equal_to(outs[1][0])
+            ASSERT(outs[1][0]).is_equal_to(outs[3][0])
+
+            Path(f'{tmp}/batch0/fail').touch()
+            ASSERT(workers).raises(RuntimeError).when_called_with(f'{tmp}/batch0', '0').contains('af2.log')
+            ASSERT(Path(f'{tmp}/batch0/af2.log').read_text()).contains('no prediction')
+            workers(f'{tmp}/batch2', '0')
+            ASSERT(Path(f'{tmp}/batch2/out.silent').read_text().split()[0]).is_equal_to(outs[0][0])
+        finally:
+            workers.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from assertpy import assert_that as ASSERT
+
+sys.path.append(str(Path(__file__).parents[3] / 'benchmarks/backbone_and_seq_design/common_scripts'))
+import ppi_metrics
+
+def main():
+    test_window_motif_hits_pinned()
+    test_window_motif_hits_matches_loop()
+    test_sidechain_neighbors_blocked()
+    test_sidechain_neighbors_cutoff_float32_batch()
+    test_abego_from_torsions()
+    test_abego_from_torsions_matches_rosetta()
+
+def window_motif_hits_loop(froms, tos, im_in_ss, is_core, window_size=9):
+    """the original one-window-at-a-time loop from ppi_score.score_ppi_example"""
+    size = len(im_in_ss) - 1
+    is_ss = im_in_ss > -1
+    scores, starts, any_core_in_span = [], [], []
+    for start in range(1, size + 1):
+        end = start + window_size - 1
+        if end > size: continue
+        if not is_ss[start:end + 1].all(): continue
+        our_iss = im_in_ss[start]
+        if not (our_iss == im_in_ss[start:end + 1]).all(): continue
+        from_us = (froms >= start) & (froms <= end)
+        to_us = (tos >= start) & (tos <= end)
+        interesting = from_us ^ to_us
+        who = np.zeros(len(from_us), int)
+        who[:] = -2
+        who[~from_us] = im_in_ss[froms[~from_us]]
+        who[~to_us] = im_in_ss[tos[~to_us]]
+        who = who[interesting]
+        who = who[who != -1]
+        who = who[who != our_iss]
+        unique_who, unique_counts = np.unique(who, return_counts=True)
+        sorted_counts = unique_counts[np.argsort(unique_counts)[::-1]]
+        scores.append(sorted_counts[1:].sum() if len(sorted_counts) >= 2 else 0)
+        starts.append(start)
+        any_core_in_span.append(int(is_core[start - 1:end].any()))
+    return np.array(scores, int), np.array(starts, int), np.array(any_core_in_span, int)
+
+def ss_from_elems(size, elems):
+    im_in_ss = np.full(size + 1, -1)
+    for iss, (start, end) in enumerate(elems):
+        im_in_ss[start:end + 1] = iss
+    return im_in_ss
+
+def test_window_motif_hits_pinned():
+    im_in_ss = ss_from_elems(30, [(1, 10), (13, 22), (25, 30)])
+    froms = np.array([2, 3, 5, 9, 14, 15, 20, 26, 27, 11])
+    tos = np.array([14, 26, 15, 28, 26, 27, 4, 8, 3, 16])
+    is_core = np.zeros(30, bool)
+    is_core[[5, 21]] = True
+    scores, starts, any_core = ppi_metrics.window_motif_hits(froms, tos, im_in_ss, is_core)
+    ASSERT(starts.tolist()).is_equal_to([1, 2, 13, 14])
+    ASSERT(scores.tolist()).is_equal_to([3, 3, 2, 2])
+    ASSERT(any_core.tolist()).is_equal_to([1, 1, 0, 1])
+    ASSERT((scores >= 1).mean()).is_equal_to(1.0)
+
+def test_window_motif_hits_matches_loop():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        size = rng.integers(12, 120)
+        bounds = np.sort(rng.choice(np.arange(1, size + 1), 2 * rng.integers(0, 6), replace=False))
+        im_in_ss = ss_from_elems(size, bounds.reshape(-1, 2))
+        nhits = rng.integers(0, 3 * size)
+        froms = rng.integers(1, size + 1, nhits)
+        tos = rng.integers(1, size + 1, nhits)
+        is_core = rng.random(size) < 0.2
+        for window_size in (3, 9):
+            expected = window_motif_hits_loop(froms, tos, im_in_ss, is_core, window_size)
+            result = ppi_metrics.window_motif_hits(froms, tos, im_in_ss, is_core, window_size)
+            for e, r in zip(expected, result):
+                ASSERT(r.tolist()).is_equal_to(e.tolist())
+
+def sidechain_neighbors_full(binder_Ca, binder_Cb, else_Ca):
+    """the original version that builds the whole N x M x 3 displacement tensor"""
+    conevect = binder_Cb - binder_Ca
+    conevect /= np.sqrt(np.sum(np.square(conevect), axis=-1))[:, None]
+    vect = else_Ca[:, None] - binder_Cb[None, :]
+    vect_lengths = np.sqrt(np.sum(np.square(vect), axis=-1))
+    vect_normalized = vect / vect_lengths[:, :, None]
+    dist_term = 1 / (1 + np.exp(vect_lengths - 9))
+    angle_term = (((conevect[None, :] * vect_normalized).sum(axis=-1) + 0.5) / 1.5).clip(0, None)
+    return (dist_term * np.square(angle_term)).sum(axis=0)
+
+def random_chain(rng, size):
+    ca = np.cumsum(rng.normal(size=(size, 3)) * 2.2, axis=0)
+    cb = ca + rng.normal(size=(size, 3))
+    return ca, cb
+
+def test_sidechain_neighbors_blocked():
+    rng = np.random.default_rng(1)
+    ca, cb = random_chain(rng, 300)
+    expected = sidechain_neighbors_full(ca, cb, ca)
+    for max_pairs in (1, 1000, 1 << 22):
+        result = ppi_metrics.sidechain_neighbors(ca, cb, ca, max_pairs=max_pairs)
+        ASSERT(np.allclose(result, expected, rtol=1e-12, atol=0)).is_true()
+
+def test_sidechain_neighbors_cutoff_float32_batch():
+    rng = np.random.default_rng(2)
+    chains = [random_chain(rng, 200) for _ in range(3)]
+    ca = np.stack([c[0] for c in chains])
+    cb = np.stack([c[1] for c in chains])
+    expected = np.stack([sidechain_neighbors_full(a, b, a) for a, b in chains])
+    batch = ppi_metrics.sidechain_neighbors(ca, cb, ca)
+    ASSERT(batch.shape).is_equal_to((3, 200))
+    ASSERT(np.allclose(batch, expected, rtol=1e-12, atol=0)).is_true()
+    ASSERT(np.allclose(ppi_metrics.sidechain_neighbors(ca, cb, ca, max_pairs=1000), expected, rtol=1e-12,
+                       atol=0)).is_true()
+    cut = ppi_metrics.sidechain_neighbors(ca, cb, ca, cutoff=20)
+    ASSERT(np.abs(cut - expected).max()).is_less_than(1e-3)
+    each_cut = np.stack([ppi_metrics.sidechain_neighbors(a, b, a, cutoff=20) for a, b in chains])
+    ASSERT(np.allclose(cut, each_cut, rtol=1e-12, atol=0)).is_true()
+    f32 = ppi_metrics.sidechain_neighbors(ca, cb, ca, dtype=np.float32)
+    ASSERT(f32.dtype).is_equal_to(np.float32)
+    ASSERT(np.abs(f32 - expected).max()).is_less_than(1e-3)
+
+def test_abego_from_torsions():
+    phi = [-60, -60, -120, 60, 60, -60, 0, 179]
+    psi = [-45, 50, 130, 30, 180, -45, -100, -179]
+    omega = [180, 180, -180, 180, 180, 0, 180, 90]
+    abego = ppi_metrics.abego_from_torsions(phi, psi, omega)
+    ASSERT(''.join(abego)).is_equal_to('ABBGEOGE')
+
+def test_abego_from_torsions_matches_rosetta():
+    pyrosetta = pytest.importorskip('pyrosetta')
+    pyrosetta.init('-mute all')
+    abego_man = pyrosetta.rosetta.core.sequence.ABEGOManager()
+    rng = np.random.default_rng(3)
+    phi, psi, omega = rng.uniform(-180, 180, (3, 1000))
+    expected = [abego_man.index2symbol(abego_man.torsion2index_level1(*t)) for t in zip(phi, psi, omega)]
+    ASSERT(ppi_metrics.abego_from_torsions(phi, psi, omega).tolist()).is_equal_to(expected)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from assertpy import assert_that as ASSERT
+
+sys.path.append(str(Path(__file__).parents[3] / 'benchmarks/backbone_and_seq_design/common_scripts'))
+
+# needs pyrosetta and the lab npose / motif hash code. Skipped without them, except under CI where they
+# are installed and a failed import has to fail the run instead of quietly skipping the test
+if os.environ.get('CI'): import ppi_score
+else: ppi_score = pytest.importorskip('ppi_score')
+
+OFFSETS = [(0, 4, 0), (3, 6, 2), (0, 40, 0)]
+
+def main():
+    for offset in OFFSETS:
+        test_calc_ddg_norepack_matches_moving_chain_away(offset)
+
+def calc_ddg_norepack_move_away(pose, scorefxn):
+    """the original clone and move chain A 10 km away version"""
+    pose = pose.clone()
+    close_score = scorefxn(pose)
+    pose = ppi_score.move_chainA_far_away(pose)
+    far_score = scorefxn(pose)
+    return close_score - far_score
+
+def make_complex(binder_seq, target_seq, offset):
+    core = ppi_score.core
+    pose = ppi_score.pose_from_sequence(binder_seq)
+    target = ppi_score.pose_from_sequence(target_seq)
+    move = ppi_score.numeric.xyzVector_double_t(*offset)
+    everything = core.select.residue_selector.TrueResidueSelector().apply(target)
+    ppi_score.protocols.toolbox.pose_manipulation.rigid_body_move(move, 0, move, target, everything)
+    pose.append_pose_by_jump(target, 1)
+    pose.pdb_info(core.pose.PDBInfo(pose))
+    return pose
+
+@pytest.mark.parametrize('offset', OFFSETS)
+def test_calc_ddg_norepack_matches_moving_chain_away(offset):
+    pose = make_complex('DEEIRKLAEEALRLAKEG', 'SPEELLKKAIELAKRLLEEG', offset)
+    scorefxn = ppi_score.scorefxn_beta_soft
+    expected = calc_ddg_norepack_move_away(pose, scorefxn)
+    before = pose.clone()
+    ASSERT(pose.energies().energies_updated()).is_false()
+    ddg = ppi_score.calc_ddg_norepack(pose, scorefxn)
+    ASSERT(pose.energies().energies_updated()).is_false()
+    ASSERT(ddg).is_close_to(expected, tolerance=1e-6 * max(1, abs(expected)))
+    ASSERT(pose.size()).is_equal_to(before.size())
+    ASSERT(pose.residue(1).xyz('CA').distance(before.residue(1).xyz('CA'))).is_equal_to(0)
+    ddg_presplit = ppi_score.calc_ddg_norepack(pose, scorefxn, pose.split_by_chain())
+    ASSERT(ddg_presplit).is_equal_to(ddg)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from assertpy import assert_that as ASSERT
+
+sys.path.append(str(Path(__file__).parents[3] / 'benchmarks/backbone_and_seq_design/common_scripts'))
+import ppi_summary
+
+def main():
+    test_summary_matches_all_at_once()
+    test_tiered_matches_full()
+    test_write_score_outputs_chunked()
+    test_timing_writer()
+    test_report_af2_problems()
+    test_score_stream_keeps_last_run()
+    test_read_score_stream_needs_pyarrow()
+
+def random_scores(n, seed=0, empty_target=False):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(
+        dict(
+            target=rng.choice(['t1', 't2', 't3', 't4'], n),
+            other_hits_9=rng.uniform(0.7, 1, n),
+            any_core_9=rng.uniform(0.7, 1, n),
+            longest_loop=rng.integers(2, 12, n),
+            plddt_binder=rng.uniform(70, 95, n),
+            hotspot_satisfied7=rng.uniform(0, 1, n),
+            hotspot_satisfied10=rng.uniform(0.5, 1, n),
+            interface_rmsd=rng.uniform(0, 6, n),
+            pae_interaction=rng.uniform(3, 20, n),
+            frac_H=rng.uniform(0, 1, n),
+            frac_E=rng.uniform(0, 1, n),
+            frac_L=rng.uniform(0, 1, n),
+        ))
+    for term in ppi_summary.MEAN_ONLY_OF_ALMOST_ORDERABLE:
+        df[term] = rng.normal(0, 10, n)
+    df.loc[df.index[::7], 'contact_patch'] = np.nan
+    # a target without any almost_orderable design makes those terms NaN
+    if empty_target: df.loc[df['target'] == 't4', 'plddt_binder'] = 50
+    return df
+
+def summary_all_at_once(df):
+    """the original version that kept every row in one DataFrame"""
+    df = ppi_summary.add_pass_columns(df.copy())
+    summary_results = {term: df[term].mean() for term in ppi_summary.MEAN_SCORES}
+    for term in ppi_summary.MEAN_ONLY_OF_ALMOST_ORDERABLE:
+        each_target = []
+        for target, subdf in df.groupby('target'):
+            subdf = subdf[subdf['almost_orderable']]
+            each_target.append(np.nan if len(subdf) == 0 else subdf[term].mean())
+        summary_results[term] = np.mean(each_target)
+    return summary_results
+
+def assert_summaries_equal(summary, expected):
+    ASSERT(set(summary)).is_equal_to(set(expected))
+    for term, value in expected.items():
+        if np.isnan(value): ASSERT(summary[term]).is_nan()
+        else: ASSERT(summary[term]).is_close_to(value, 1e-9)
+
+def test_summary_matches_all_at_once():
+    df = random_scores(1000)
+    summary = ppi_summary.ScoreSummary()
+    for lb in range(0, len(df), 64):
+        summary.add(ppi_summary.add_pass_columns(df.iloc[lb:lb + 64].copy()))
+    assert_summaries_equal(summary.results(), summary_all_at_once(df))
+
+def tiered(df):
+    """df as --tiered would have scored it: no rosetta metrics for designs that fail the gates"""
+    df = df.copy()
+    for i, row in df.iterrows():
+        af2_pass = ppi_summary.passes_af2_gates(row)
+        if not ppi_summary.tiered_runs_rosetta(af2_pass, row['hotspot_satisfied10']):
+            df.loc[i, ppi_summary.MEAN_ONLY_OF_ALMOST_ORDERABLE] = np.nan
+    return df
+
+def test_tiered_matches_full():
+    full = random_scores(2000, seed=2)
+    tier = tiered(full)
+    ASSERT(tier['ddg_norepack_soft'].isna().sum()).is_greater_than(1000)
+    full_pass, tier_pass = ppi_summary.add_pass_columns(full.copy()), ppi_summary.add_pass_columns(tier.copy())
+    pass_columns = [c for c in full_pass.columns if c not in full.columns]
+    pd.testing.assert_frame_equal(full_pass[pass_columns], tier_pass[pass_columns])
+    ASSERT(tier_pass.loc[tier_pass['almost_orderable'], 'ddg_norepack_soft'].isna().any()).is_false()
+    summaries = []
+    for df in [full, tier]:
+        summary = ppi_summary.ScoreSummary()
+        for lb in range(0, len(df), 100):
+            summary.add(ppi_summary.add_pass_columns(df.iloc[lb:lb + 100].copy()))
+        summaries.append(summary.results())
+    ASSERT(summaries[1]).is_equal_to(summaries[0])
+    ASSERT(np.isnan(summaries[0]['ddg_norepack_soft'])).is_false()
+
+def test_write_score_outputs_chunked():
+    df = random_scores(300, seed=1, empty_target=True)
+    os.chdir(tempfile.mkdtemp())
+    chunks = (df.iloc[lb:lb + 50].copy() for lb in range(0, len(df), 50))
+    summary = ppi_summary.write_score_outputs(chunks)
+    assert_summaries_equal(summary, summary_all_at_once(df))
+    ASSERT(len(pd.read_csv('score_individual.csv'))).is_equal_to(300)
+    ASSERT(pd.read_csv('final_scores.csv').columns.tolist()).is_equal_to(list(summary))
+
+def test_timing_writer():
+    fname = f'{tempfile.mkdtemp()}/timings.csv'
+    writer = ppi_summary.TimingWriter(fname, ['dssp', 'delta_sasa'])
+    writer.append('a', dict(dssp=1.0, delta_sasa=3.0))
+    writer.append('b', dict(dssp=2.0))
+    writer.close()
+    df = pd.read_csv(fname)
+    ASSERT(df['description'].tolist()).is_equal_to(['a', 'b'])
+    ASSERT(df['dssp'].tolist()).is_equal_to([1.0, 2.0])
+    ASSERT(np.isnan(df['delta_sasa'][1])).is_true()
+    ASSERT(writer.sums['dssp'] / writer.counts['dssp']).is_equal_to(1.5)
+
+def test_report_af2_problems():
+    ASSERT(ppi_summary.report_af2_problems('af2.sc', 3, set(), [])).is_true()
+    ASSERT(ppi_summary.report_af2_problems('af2.sc', 3, {'a'}, [])).is_true()
+    ASSERT(ppi_summary.report_af2_problems('af2.sc', 3, set(), ['b'])).is_false()
+    ASSERT(ppi_summary.report_af2_problems('af2.sc', 3, set(), [], {'x_bb0': 'x'})).is_false()
+
+def write_stream(fname, df, crash=False):
+    writer = ppi_summary.ScoreStreamWriter(fname, flush_every=10)
+    for row in df.to_dict('records'):
+        writer.append(row)
+    if crash: writer.flush()
+    else: writer.close()
+
+def test_score_stream_keeps_last_run():
+    pytest.importorskip('pyarrow')
+    fname = f'{tempfile.mkdtemp()}/scores.arrow'
+    df = random_scores(25)
+    write_stream(fname, df)
+    write_stream(fname, df.iloc[:12], crash=True)
+    ASSERT(len(pd.concat(ppi_summary.read_score_stream(fname)))).is_equal_to(25)
+    partial = ppi_summary.partial_stream_fname(fname)
+    ASSERT(len(pd.concat(ppi_summary.read_score_stream(partial)))).is_equal_to(12)
+    write_stream(fname, df.iloc[:5])
+    ASSERT(len(pd.concat(ppi_summary.read_score_stream(fname)))).is_equal_to(5)
+    ASSERT(os.path.exists(partial)).is_false()
+
+def test_read_score_stream_needs_pyarrow():
+    pa, ppi_summary.pa = ppi_summary.pa, None
+    try:
+        with pytest.raises(ImportError, match='pyarrow'):
+            next(ppi_summary.read_score_stream('scores.arrow'))
+    finally:
+        ppi_summary.pa = pa
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import collections
+import threading
+import time
+
+from assertpy import assert_that as ASSERT
+
+import mlb
+
+def main():
+    test_plan_af2_batches()
+    test_run_af2_batches_steals_work()
+    test_run_af2_batches_errors()
+
+def test_plan_af2_batches():
+    lengths = {f'a{i}': 100 for i in range(25)} | {f'b{i}': 103 for i in range(3)} | {'c0': 250}
+    batches = mlb.run.plan_af2_batches(lengths, max_residues=1000)
+    ASSERT([(b.length, len(b.names)) for b in batches]).is_equal_to([(100, 10), (100, 10), (100, 5), (103, 3),
+                                                                     (250, 1)])
+    ASSERT(sorted(n for b in batches for n in b.names)).is_equal_to(sorted(lengths))
+    for batch in batches:
+        ASSERT(batch.residues).is_less_than_or_equal_to(1000)
+
+    ASSERT(mlb.run.plan_af2_batches({'big': 5000}, max_residues=1000)[0].names).is_equal_to(['big'])
+
+def test_run_af2_batches_steals_work():
+    lengths = {f'a{i}': 100 for i in range(40)} | {f'b{i}': 200 for i in range(2)}
+    batches = mlb.run.plan_af2_batches(lengths, max_residues=400)
+    compiled = collections.defaultdict(set)
+    lock = threading.Lock()
+
+    def predict(batch, device):
+        with lock:
+            compiled[device].add(batch.length)
+        time.sleep(0.002 * batch.residues / 100)
+        return {name: 0.9 for name in batch.names}
+
+    results = mlb.run.run_af2_batches(batches, predict, devices=['gpu0', 'gpu1', 'gpu2'])
+    ASSERT(results).is_length(len(batches))
+    ASSERT([r.error for r in results if r.error]).is_empty()
+    scores = {name: plddt for r in results for name, plddt in r.result.items()}
+    ASSERT(sorted(scores)).is_equal_to(sorted(lengths))
+    per_device = collections.Counter(r.device for r in results)
+    ASSERT(set(per_device)).is_equal_to({'gpu0', 'gpu1', 'gpu2'})
+    ASSERT(sum(len(c) for c in compiled.values())).is_less_than(len(batches))
+
+def test_run_af2_batches_errors():
+    batches = mlb.run.plan_af2_batches({'x': 10, 'y': 20, 'z': 30}, max_residues=10)
+
+    def predict(batch, device):
+        if batch.names == ['y']: raise RuntimeError('out of memory')
+        return batch.names
+
+    results = mlb.run.run_af2_batches(batches, predict, devices=[0])
+    ASSERT(results).is_length(3)
+    failed = [r for r in results if r.error]
+    ASSERT(failed).is_length(1)
+    ASSERT(failed[0].batch.names).is_equal_to(['y'])
+    ASSERT(failed[0].error).contains('out of memory')
+
+if __name__ == '__main__':
+    main()
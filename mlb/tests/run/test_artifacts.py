@@ -0,0 +1,82 @@
+import os
+import pathlib
+import tempfile
+
+from assertpy import assert_that as ASSERT
+
+import mlb
+
+def main():
+    test_artifact_key(pathlib.Path(tempfile.mkdtemp()))
+    test_artifact_cache_stage(pathlib.Path(tempfile.mkdtemp()))
+    test_artifact_cache_generator(pathlib.Path(tempfile.mkdtemp()))
+    test_artifact_evict(pathlib.Path(tempfile.mkdtemp()))
+
+def test_artifact_key(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    cache = mlb.run.ArtifactCache(tmpdir / 'cache')
+    script = tmpdir / 'mpnn.sh'
+    script.write_text('echo v1')
+    key = cache.key('target.pdb A1,A2 60', dict(n_mpnn=2), files=[script], containers=[tmpdir / 'mlfold.sif'])
+    ASSERT(cache.key('target.pdb A1,A2 60', dict(n_mpnn=2), files=[script],
+                     containers=[tmpdir / 'mlfold.sif'])).is_equal_to(key)
+    ASSERT(cache.key('target.pdb A1,A2 60', dict(n_mpnn=3), files=[script])).is_not_equal_to(key)
+    os.utime(script, ns=(0, 0))
+    script.write_text('echo v2')
+    ASSERT(cache.key('target.pdb A1,A2 60', dict(n_mpnn=2), files=[script],
+                     containers=[tmpdir / 'mlfold.sif'])).is_not_equal_to(key)
+
+def test_artifact_cache_stage(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    cache = mlb.run.ArtifactCache(tmpdir / 'cache')
+    calls = []
+
+    def af2(design):
+        calls.append(design)
+        out = tmpdir / 'out' / f'{design}_oracle.pdb'
+        out.parent.mkdir(exist_ok=True)
+        out.write_text(f'{design} prediction')
+        return dict(pdb=str(out), plddt=90.0)
+
+    cached_af2 = cache.cached(af2, key=lambda d: cache.key('af2', d))
+    first = cached_af2('des1')
+    (tmpdir / 'out/des1_oracle.pdb').unlink()
+    ASSERT(cached_af2('des1')).is_equal_to(first)
+    ASSERT((tmpdir / 'out/des1_oracle.pdb').read_text()).is_equal_to('des1 prediction')
+    cached_af2('des2')
+    ASSERT(calls).is_equal_to(['des1', 'des2'])
+
+def test_artifact_cache_generator(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    cache = mlb.run.ArtifactCache(tmpdir / 'cache')
+    calls = []
+
+    def diffusion(target):
+        calls.append(target)
+        for i in range(3):
+            yield (f'{target}_bb{i}', 2)
+
+    cached_diffusion = cache.cached(diffusion, key=lambda t: cache.key(t))
+    pipeline = mlb.run.Pipeline([mlb.run.Stage('diffusion', cached_diffusion)])
+    first = pipeline.run(['t0', 't1']).outputs['diffusion']
+    second = pipeline.run(['t0', 't1']).outputs['diffusion']
+    ASSERT(sorted(map(list, first))).is_equal_to(sorted(second))
+    ASSERT(sorted(calls)).is_equal_to(['t0', 't1'])
+
+def test_artifact_evict(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    cache = mlb.run.ArtifactCache(tmpdir / 'cache', max_bytes=3500)
+    for i in range(3):
+        fname = tmpdir / f'bb{i}.pdb'
+        fname.write_text('x' * 1000)
+        cache.put(f'k{i}', str(fname))
+        os.utime(cache.root / f'k{i}', (i, i))
+    ASSERT(cache.get('k0')).is_not_none()  # now k1 is the least recently used
+    fname = tmpdir / 'bb3.pdb'
+    fname.write_text('x' * 1000)
+    cache.put('k3', str(fname))
+    ASSERT(sorted(e.name for e, _, _ in cache.entries())).is_equal_to(['k0', 'k2', 'k3'])
+    ASSERT(cache.get('k1')).is_none()
+
+if __name__ == '__main__':
+    main()
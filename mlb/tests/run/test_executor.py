@@ -0,0 +1,82 @@
+import pathlib
+import tempfile
+import time
+import types
+
+import pytest
+from assertpy import assert_that as ASSERT
+
+import mlb
+
+def main():
+    test_parse_gpus()
+    test_method_jobs()
+    test_local_executor(pathlib.Path(tempfile.mkdtemp()))
+    test_local_executor_gpus(pathlib.Path(tempfile.mkdtemp()))
+    test_local_executor_in_flight(pathlib.Path(tempfile.mkdtemp()))
+    test_submitit_executor(pathlib.Path(tempfile.mkdtemp()))
+
+def fake_method(name='mpnn', path='/bin/echo', gpus=''):
+    return types.SimpleNamespace(name=name, exe=types.SimpleNamespace(path=path, apptainer=None), gpus=gpus)
+
+def test_parse_gpus():
+    ASSERT(mlb.run.parse_gpus('')).is_equal_to((0, ''))
+    ASSERT(mlb.run.parse_gpus('2')).is_equal_to((2, ''))
+    ASSERT(mlb.run.parse_gpus('a4000')).is_equal_to((1, 'a4000'))
+    ASSERT(mlb.run.parse_gpus('a4000:2')).is_equal_to((2, 'a4000'))
+
+def test_method_jobs():
+    jobs = mlb.run.method_jobs(fake_method(path='/containers/af2.sif', gpus='a4000'),
+                               [dict(pdb='a.pdb'), dict(pdb='b.pdb')], outdir='/out')
+    ASSERT(jobs).is_length(2)
+    ASSERT(jobs[1].cmd).is_equal_to(['apptainer', 'run', '--nv', '/containers/af2.sif', '--pdb=b.pdb'])
+    ASSERT(jobs[1].workdir).is_equal_to('/out/mpnn/000001')
+    ASSERT(jobs[0].resources).is_equal_to(mlb.run.Resources(gpus=1, gpu_type='a4000'))
+
+def test_local_executor(tmpdir):
+    jobs = mlb.run.method_jobs(fake_method(), [dict(n=i) for i in range(5)], tmpdir)
+    jobs.append(mlb.run.Job('fail', ['sh', '-c', 'exit 3'], str(tmpdir / 'fail')))
+    with mlb.run.LocalExecutor(max_workers=3, gpus=[]) as executor:
+        results = [f.result() for f in executor.submit_array(jobs)]
+    ASSERT([r.returncode for r in results]).is_equal_to([0, 0, 0, 0, 0, 3])
+    ASSERT((pathlib.Path(tmpdir) / 'mpnn/000004/stdout.log').read_text()).is_equal_to('--n=4\n')
+
+def test_local_executor_gpus(tmpdir):
+    cmd = ['sh', '-c', 'echo $CUDA_VISIBLE_DEVICES; sleep 0.1']
+    onegpu = mlb.run.Resources(gpus=1)
+    jobs = [mlb.run.Job(f'j{i}', cmd, str(pathlib.Path(tmpdir) / f'j{i}'), onegpu) for i in range(6)]
+    jobs.append(mlb.run.Job('cpu', cmd, str(pathlib.Path(tmpdir) / 'cpu')))
+    start = time.perf_counter()
+    with mlb.run.LocalExecutor(max_workers=8, gpus=['3', '5']) as executor:
+        results = [f.result() for f in executor.submit_array(jobs)]
+        with pytest.raises(ValueError):
+            executor.submit(mlb.run.Job('big', cmd, str(tmpdir), mlb.run.Resources(gpus=3)))
+    ASSERT(time.perf_counter() - start).is_greater_than(0.3)
+    seen = [pathlib.Path(r.workdir, 'stdout.log').read_text().strip() for r in results]
+    ASSERT(sorted(set(seen[:6]))).is_equal_to(['3', '5'])
+    ASSERT(seen[6]).is_equal_to('')
+
+def test_local_executor_in_flight(tmpdir):
+    jobs = [mlb.run.Job(f'j{i}', ['sleep', '0.2'], str(pathlib.Path(tmpdir) / f'j{i}')) for i in range(3)]
+    with mlb.run.LocalExecutor(max_workers=4, gpus=[], max_in_flight=2) as executor:
+        start = time.perf_counter()
+        executor.submit(jobs[0])
+        executor.submit(jobs[1])
+        ASSERT(time.perf_counter() - start).is_less_than(0.1)
+        executor.submit(jobs[2])
+        ASSERT(time.perf_counter() - start).is_greater_than(0.15)
+
+def test_submitit_executor(tmpdir):
+    pytest.importorskip('submitit')
+    jobs = mlb.run.method_jobs(fake_method(), [dict(n=i) for i in range(5)], pathlib.Path(tmpdir) / 'runs')
+    executor = mlb.run.SubmititExecutor(pathlib.Path(tmpdir) / 'submitit', cluster='local', array_size=2,
+                                        max_in_flight=4, poll=0.05)
+    submitted = executor.submit_array(jobs)
+    results = [job.result() for job in submitted]
+    ASSERT([r.name for r in results]).is_equal_to([job.name for job in jobs])
+    ASSERT({r.returncode for r in results}).is_equal_to({0})
+    ASSERT(executor.parameters(mlb.run.Resources(gpus=2, gpu_type='a6000'))).contains_entry(
+        {'slurm_gres': 'gpu:a6000:2'})
+
+if __name__ == '__main__':
+    main()
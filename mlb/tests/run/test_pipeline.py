@@ -0,0 +1,172 @@
+import pathlib
+import tempfile
+import threading
+import time
+
+import pytest
+from assertpy import assert_that as ASSERT
+
+import mlb
+
+def main():
+    test_pipeline_streams_items_downstream()
+    test_pipeline_limits()
+    test_pipeline_device_pool()
+    test_pipeline_gather_and_errors()
+    test_pipeline_bad_graph()
+    test_pipeline_batches()
+    test_watch_files(pathlib.Path(tempfile.mkdtemp()))
+
+def test_pipeline_streams_items_downstream():
+    def diffusion(target):
+        for i in range(4):
+            time.sleep(0.05)
+            yield f'{target}_bb{i}'
+
+    def mpnn(bb):
+        return [f'{bb}_mpnn0', f'{bb}_mpnn1']
+
+    first = []
+    pipeline = mlb.run.Pipeline([
+        mlb.run.Stage('diffusion', diffusion, resource='gpu', concurrency=1),
+        mlb.run.Stage('mpnn', mpnn, after='diffusion'),
+        mlb.run.Stage('af2', lambda d: f'{d}_oracle', after='mpnn', resource='gpu'),
+        mlb.run.Stage('score', lambda d: (d, time.perf_counter()), after='af2'),
+    ], resources=dict(cpu=4, gpu=2))
+    start = time.perf_counter()
+    result = pipeline.run(['t0', 't1'], on_output=lambda stage, item: first.append(time.perf_counter()))
+    total = time.perf_counter() - start
+    ASSERT(result.errors).is_empty()
+    ASSERT(sorted(d for d, _ in result.outputs['score'])).is_length(16).contains('t1_bb3_mpnn1_oracle')
+    ASSERT(first[0] - start).is_less_than(total / 3)
+
+def test_pipeline_limits():
+    lock = threading.Lock()
+    active, peak = dict(cpu=0, gpu=0, slow=0), dict(cpu=0, gpu=0, slow=0)
+
+    def tracked(*tags):
+        def fn(item):
+            with lock:
+                for tag in tags:
+                    active[tag] += 1
+                    peak[tag] = max(peak[tag], active[tag])
+            time.sleep(0.02)
+            with lock:
+                for tag in tags:
+                    active[tag] -= 1
+            return item
+
+        return fn
+
+    pipeline = mlb.run.Pipeline([
+        mlb.run.Stage('a', tracked('gpu'), resource='gpu'),
+        mlb.run.Stage('b', tracked('gpu'), after='a', resource='gpu'),
+        mlb.run.Stage('c', tracked('cpu', 'slow'), after='a', concurrency=2),
+        mlb.run.Stage('d', tracked('cpu'), after='c'),
+    ], resources=dict(cpu=3, gpu=2))
+    result = pipeline.run(range(10))
+    ASSERT(sorted(result.outputs['b'])).is_equal_to(list(range(10)))
+    ASSERT(sorted(result.outputs['d'])).is_equal_to(list(range(10)))
+    ASSERT(peak['gpu']).is_less_than_or_equal_to(2)
+    ASSERT(peak['cpu']).is_less_than_or_equal_to(3)
+    ASSERT(peak['slow']).is_equal_to(2)
+
+def test_pipeline_device_pool():
+    lock = threading.Lock()
+    held, used = set(), []
+
+    def af2(design, device):
+        with lock:
+            ASSERT(held).does_not_contain(device)
+            held.add(device)
+            used.append(device)
+        time.sleep(0.02)
+        with lock:
+            held.remove(device)
+        return f'{design}_oracle_{device}'
+
+    pipeline = mlb.run.Pipeline([
+        mlb.run.Stage('mpnn', lambda t: [f'{t}_{i}' for i in range(4)]),
+        mlb.run.Stage('af2', af2, after='mpnn', resource='gpu'),
+    ], resources=dict(cpu=2, gpu=['3', '5']))
+    result = pipeline.run(['t0', 't1', 't2'])
+    ASSERT(result.errors).is_empty()
+    ASSERT(result.outputs['af2']).is_length(12)
+    ASSERT(set(used)).is_equal_to({'3', '5'})
+    ASSERT(held).is_empty()
+    with pytest.raises(AssertionError):
+        mlb.run.Pipeline([mlb.run.Stage('a', str, resource='gpu')], resources=dict(cpu=1, gpu=[]))
+
+def test_pipeline_gather_and_errors():
+    def fail_on_3(x):
+        if x == 3: raise ValueError('bad design')
+        return x * 10
+
+    pipeline = mlb.run.Pipeline([
+        mlb.run.Stage('score', fail_on_3),
+        mlb.run.Stage('summary', lambda xs: sum(xs), after='score', gather=True),
+    ])
+    result = pipeline.run(range(5))
+    ASSERT(result.outputs).is_equal_to(dict(summary=[70]))
+    ASSERT(result.errors).is_length(1)
+    stage, item, trace = result.errors[0]
+    ASSERT((stage, item)).is_equal_to(('score', 3))
+    ASSERT(trace).contains('bad design')
+
+def test_pipeline_bad_graph():
+    with pytest.raises(AssertionError):
+        mlb.run.Pipeline([mlb.run.Stage('a', str, after='b'), mlb.run.Stage('b', str, after='a')])
+    with pytest.raises(AssertionError):
+        mlb.run.Pipeline([mlb.run.Stage('a', str, after='nope')])
+    with pytest.raises(AssertionError):
+        mlb.run.Pipeline([mlb.run.Stage('a', str, resource='gpu')], resources=dict(cpu=1, gpu=0))
+
+def test_pipeline_batches():
+    def diffusion(target):
+        for i in range(5):
+            time.sleep(0.01)
+            yield f'{target}_bb{i}'
+
+    batches = []
+
+    def mpnn(bbs):
+        batches.append(bbs)
+        return [f'{bb}_mpnn0' for bb in bbs]
+
+    pipeline = mlb.run.Pipeline([
+        mlb.run.Stage('diffusion', diffusion, resource='gpu'),
+        mlb.run.Stage('mpnn', mpnn, after='diffusion', concurrency=1, batch_size=3, batch_wait=10),
+    ], resources=dict(cpu=1, gpu=1))
+    result = pipeline.run(['t0', 't1'])
+    ASSERT(result.outputs['mpnn']).is_length(10).contains('t1_bb4_mpnn0')
+    ASSERT([len(b) for b in batches]).is_equal_to([3, 3, 3, 1])
+
+    batches.clear()
+    pipeline = mlb.run.Pipeline([
+        mlb.run.Stage('diffusion', lambda t: (time.sleep(0.2 if t == 't1' else 0), t)[1]),
+        mlb.run.Stage('mpnn', mpnn, after='diffusion', batch_size=3, batch_wait=0.05),
+    ], resources=dict(cpu=2))
+    pipeline.run(['t0', 't1'])
+    ASSERT(batches).is_equal_to([['t0'], ['t1']])
+
+def test_watch_files(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    stop = threading.Event()
+
+    def writer():
+        for i in range(3):
+            (tmpdir / f'bb{i}.pdb').write_text('ATOM')
+            time.sleep(0.03)
+            (tmpdir / f'bb{i}.trb').write_text('')
+        (tmpdir / 'bb3.pdb').write_text('ATOM')
+        stop.set()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    ready = lambda path: pathlib.Path(path).with_suffix('.trb').exists()
+    found = list(mlb.run.watch_files(str(tmpdir / '*.pdb'), until=stop.is_set, ready=ready, poll=0.01))
+    thread.join()
+    ASSERT([pathlib.Path(f).name for f in found]).is_equal_to(['bb0.pdb', 'bb1.pdb', 'bb2.pdb', 'bb3.pdb'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import random
+import threading
+import time
+import types
+
+import pytest
+from assertpy import assert_that as ASSERT
+
+import mlb
+
+def main():
+    test_protocol_graph()
+    test_protocol_graph_errors()
+    test_critical_path()
+    test_run_protocol_concurrent()
+    test_run_protocol_priority()
+    test_run_protocol_failure()
+    test_run_protocol_random_dags()
+
+def method(name, required=(), guaranteed=()):
+    return types.SimpleNamespace(name=name, param=types.SimpleNamespace(required=list(required)),
+                                 result=types.SimpleNamespace(guaranteed=list(guaranteed)))
+
+def diamond():
+    return [
+        method('diffusion', ['target'], ['backbones']),
+        method('mpnn', ['backbones'], ['sequences']),
+        method('rosetta_relax', ['backbones'], ['relaxed']),
+        method('af2', ['sequences', 'relaxed'], ['predictions']),
+    ]
+
+def test_protocol_graph():
+    graph = mlb.run.protocol_graph(diamond(), available=['target'])
+    ASSERT(graph).is_equal_to(
+        dict(diffusion=set(), mpnn={'diffusion'}, rosetta_relax={'diffusion'}, af2={'mpnn', 'rosetta_relax'}))
+
+def test_protocol_graph_errors():
+    with pytest.raises(AssertionError, match='diffusion requires target'):
+        mlb.run.protocol_graph(diamond())
+    cycle = [method('a', ['y'], ['x']), method('b', ['x'], ['y']), method('c', ['x'], ['z'])]
+    with pytest.raises(AssertionError, match=r"cycle: \['a', 'b', 'c'\]"):
+        mlb.run.protocol_graph(cycle)
+
+def test_critical_path():
+    graph = mlb.run.protocol_graph(diamond(), available=['target'])
+    priority, path = mlb.run.critical_path(graph, dict(diffusion=10, mpnn=1, rosetta_relax=5, af2=3))
+    ASSERT(path).is_equal_to(['diffusion', 'rosetta_relax', 'af2'])
+    ASSERT(priority).is_equal_to(dict(diffusion=18, mpnn=4, rosetta_relax=8, af2=3))
+
+def test_run_protocol_concurrent():
+    wide = [method('prep', [], ['x'])] + [method(f'm{i}', ['x'], [f'y{i}']) for i in range(8)]
+    wide.append(method('summary', [f'y{i}' for i in range(8)], []))
+    finished, lock = {}, threading.Lock()
+
+    def run(m):
+        time.sleep(0.1)
+        with lock:
+            finished[m.name] = time.perf_counter()
+        return m.name.upper()
+
+    start = time.perf_counter()
+    result = mlb.run.run_protocol(wide, run)
+    ASSERT(time.perf_counter() - start).is_less_than(0.5)
+    ASSERT(result.errors).is_empty()
+    ASSERT(result.results['summary']).is_equal_to('SUMMARY')
+    ASSERT(result.started[0]).is_equal_to('prep')
+    ASSERT(result.started[-1]).is_equal_to('summary')
+    ASSERT(min(finished[f'm{i}'] for i in range(8))).is_greater_than(finished['prep'])
+
+def test_run_protocol_priority():
+    methods = [method('short', [], [])] + diamond()
+    durations = dict(short=1, diffusion=10, mpnn=1, rosetta_relax=5, af2=3)
+    result = mlb.run.run_protocol(methods, lambda m: None, available=['target'], max_parallel=1,
+                                  durations=durations)
+    ASSERT(result.started).is_equal_to(['diffusion', 'rosetta_relax', 'mpnn', 'af2', 'short'])
+
+def test_run_protocol_failure():
+    def run(m):
+        if m.name == 'mpnn': raise RuntimeError('mpnn crashed')
+        return m.name
+
+    result = mlb.run.run_protocol(diamond() + [method('other', ['target'], [])], run, available=['target'])
+    ASSERT(result.errors).contains_key('mpnn')
+    ASSERT(result.errors['mpnn']).contains('mpnn crashed')
+    ASSERT(result.skipped).is_equal_to(['af2'])
+    ASSERT(sorted(result.results)).is_equal_to(['diffusion', 'other', 'rosetta_relax'])
+
+def test_run_protocol_random_dags():
+    rng = random.Random(0)
+    for _ in range(20):
+        names = [f'm{i}' for i in range(12)]
+        methods = []
+        for i, name in enumerate(names):
+            required = [f'{up}_out' for up in names[:i] if rng.random() < 0.3]
+            methods.append(method(name, required, [f'{name}_out']))
+        rng.shuffle(methods)
+        done, lock = set(), threading.Lock()
+
+        def run(m):
+            with lock:
+                ASSERT(done.issuperset(r[:-4] for r in m.param.required)).is_true()
+            time.sleep(rng.random() * 0.005)
+            with lock:
+                done.add(m.name)
+
+        result = mlb.run.run_protocol(methods, run, max_parallel=4)
+        ASSERT(sorted(result.results)).is_equal_to(sorted(names))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+from assertpy import assert_that as ASSERT
+
+import mlb
+
+def main():
+    for mode in ['auto', 'hardlink', 'symlink', 'copy']:
+        test_build_rundir(pathlib.Path(tempfile.mkdtemp()), mode)
+    test_verify_rundir(pathlib.Path(tempfile.mkdtemp()))
+    test_bench_rundir(pathlib.Path(tempfile.mkdtemp()))
+    test_rundir_command_line(pathlib.Path(tempfile.mkdtemp()))
+
+def make_sources(method, bench):
+    (method / 'scripts').mkdir(parents=True)
+    (bench / 'inputs').mkdir(parents=True)
+    (method / 'generate.sh').write_text('#!/bin/bash\necho method\n')
+    os.chmod(method / 'generate.sh', 0o755)
+    (method / 'scripts' / 'score.sh').write_text('method version')
+    (bench / 'scripts').mkdir()
+    (bench / 'scripts' / 'score.sh').write_text('bench version')
+    (bench / 'inputs' / 'target.pdb').write_text('ATOM' * 1000)
+    (bench / 'empty').mkdir()
+    os.symlink('../somewhere', bench / 'ml_benchmarks')
+    return method, bench
+
+def test_build_rundir(tmpdir, mode='auto'):
+    tmpdir = pathlib.Path(tmpdir)
+    method, bench = make_sources(tmpdir / 'method', tmpdir / 'bench')
+    store = mlb.run.ContentStore(tmpdir / 'store')
+    for name in ['run1', 'run2']:
+        run_dir = tmpdir / name
+        mlb.run.build_rundir(run_dir, [method, bench], store, mode=mode, links=dict(ml_benchmarks=str(tmpdir)))
+        ASSERT((run_dir / 'scripts/score.sh').read_text()).is_equal_to('bench version')
+        ASSERT((run_dir / 'inputs/target.pdb').read_text()).is_equal_to('ATOM' * 1000)
+        ASSERT(os.access(run_dir / 'generate.sh', os.X_OK)).is_true()
+        ASSERT((run_dir / 'empty').is_dir()).is_true()
+        ASSERT(os.readlink(run_dir / 'ml_benchmarks')).is_equal_to(str(tmpdir))
+        ASSERT(mlb.run.verify_rundir(run_dir)).is_empty()
+    stored = [p for p in (tmpdir / 'store').glob('??/*')]
+    ASSERT(stored).is_length(4)
+    if mode == 'hardlink':
+        ASSERT((tmpdir / 'run2/inputs/target.pdb').stat().st_nlink).is_equal_to(3)
+    if mode == 'symlink':
+        ASSERT((tmpdir / 'run1/inputs/target.pdb').is_symlink()).is_true()
+
+def test_verify_rundir(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    method, bench = make_sources(tmpdir / 'method', tmpdir / 'bench')
+    mlb.run.build_rundir(tmpdir / 'run', [method, bench], tmpdir / 'store', mode='copy')
+    (tmpdir / 'run/scripts/score.sh').write_text('edited')
+    (tmpdir / 'run/generate.sh').unlink()
+    ASSERT(sorted(mlb.run.verify_rundir(tmpdir / 'run'))).is_equal_to(['generate.sh', 'scripts/score.sh'])
+
+    # an edited source is hashed again even though the store remembers its old hash
+    time.sleep(0.01)
+    (bench / 'inputs' / 'target.pdb').write_text('HETATM')
+    mlb.run.build_rundir(tmpdir / 'run', [method, bench], tmpdir / 'store', mode='copy')
+    ASSERT((tmpdir / 'run/inputs/target.pdb').read_text()).is_equal_to('HETATM')
+    ASSERT(mlb.run.verify_rundir(tmpdir / 'run')).is_empty()
+
+def test_bench_rundir(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    make_sources(tmpdir / 'methods/ppi_type/ppi/demo', tmpdir / 'benchmarks/ppi_type/ppi')
+    mlb.run.bench_rundir('ppi_type', 'ppi', 'demo', root=tmpdir)
+    run_dir = tmpdir / 'runs/ppi_type/ppi/demo'
+    ASSERT((run_dir / 'generate.sh').exists()).is_true()
+    ASSERT(os.readlink(run_dir / 'ml_benchmarks')).is_equal_to(str(tmpdir.resolve()))
+    ASSERT((tmpdir / 'runs/.store/index.json').exists()).is_true()
+
+def test_rundir_command_line(tmpdir):
+    tmpdir = pathlib.Path(tmpdir)
+    make_sources(tmpdir / 'methods/ppi_type/ppi/demo', tmpdir / 'benchmarks/ppi_type/ppi')
+    env = dict(os.environ, PYTHONPATH=str(pathlib.Path(mlb.run.__file__).parents[2]))
+
+    def rundir(*args):
+        cmd = [sys.executable, '-m', 'mlb.run', 'rundir', 'ppi_type', 'ppi', 'demo', *args]
+        return subprocess.run(cmd, cwd=tmpdir, env=env, capture_output=True, text=True)
+
+    ASSERT(rundir().returncode).is_equal_to(0)
+    ASSERT((tmpdir / 'runs/ppi_type/ppi/demo/generate.sh').exists()).is_true()
+    ASSERT(rundir('--verify').returncode).is_equal_to(0)
+    os.remove(tmpdir / 'runs/ppi_type/ppi/demo/generate.sh')
+    result = rundir('--verify')
+    ASSERT(result.returncode).is_equal_to(1)
+    ASSERT(result.stdout).contains('changed: generate.sh')
+    ASSERT(result.stderr).is_empty()
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,23 @@
+import asyncio
+import os
+import pathlib
+import tempfile
+import time
+
 import ipd
 import mlb
+import pytest
 from assertpy import assert_that as ASSERT
 
 def main():
     test_bash()
+    test_abash()
+    test_abash_streams()
+    test_abash_timeout_and_cancel()
+    test_abash_long_line()
+    test_abash_rss()
+    test_bash_many()
+    test_rotating_log(pathlib.Path(tempfile.mkdtemp()))
 
 def test_bash():
     ASSERT(('foo\n', '', 0)).is_equal_to(ipd.dev.bash('echo foo'))
@@ -21,5 +35,85 @@ def test_bash():
         0,
     )).is_equal_to(ipd.dev.bash('wXyZ; echo bar'))
 
+def test_abash():
+    for cmd in ['echo foo', 'echo foo; echo bar', 'wXyZ; echo bar', 'wXyZ && echo bar', 'exit 3']:
+        ASSERT(asyncio.run(mlb.run.abash(cmd))).is_equal_to(mlb.run.bash(cmd))
+    stdout, stderr, returncode = asyncio.run(mlb.run.abash('echo foo'))
+    ASSERT(stdout).is_equal_to('foo\n')
+
+def test_abash_streams():
+    lines = []
+
+    async def run():
+        cmd = 'for i in 1 2 3; do echo $i; sleep 0.2; done'
+        task = asyncio.create_task(mlb.run.abash(cmd, on_stdout=lines.append, capture=False))
+        while not lines:
+            await asyncio.sleep(0.01)
+        seen, done = list(lines), task.done()
+        return seen, done, await task
+
+    seen, done, result = asyncio.run(run())
+    ASSERT(done).is_false()
+    ASSERT(len(seen)).is_less_than(3)
+    ASSERT(lines).is_equal_to(['1\n', '2\n', '3\n'])
+    ASSERT(result.stdout).is_equal_to('')
+    ASSERT(result.wall_time).is_greater_than(0.25)
+
+def test_abash_timeout_and_cancel():
+    start = time.perf_counter()
+    result = asyncio.run(mlb.run.abash('echo started; sleep 5 & sleep 10; echo never', timeout=0.3))
+    ASSERT(time.perf_counter() - start).is_less_than(3)
+    ASSERT(result.timed_out).is_true()
+    ASSERT(result.stdout).is_equal_to('started\n')
+    ASSERT(result.returncode).is_not_equal_to(0)
+
+    async def cancel():
+        task = asyncio.create_task(mlb.run.abash('sleep 10'))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+
+    start = time.perf_counter()
+    ASSERT(asyncio.run(cancel())).is_true()
+    ASSERT(time.perf_counter() - start).is_less_than(3)
+
+def test_abash_long_line():
+    fds = len(os.listdir('/proc/self/fd'))
+    limit, mlb.run.shell._STREAM_LIMIT = mlb.run.shell._STREAM_LIMIT, 1000
+    start = time.perf_counter()
+    try:
+        with pytest.raises(ValueError):
+            asyncio.run(mlb.run.abash('python -c "print(5000 * \'x\')"; sleep 10'))
+    finally:
+        mlb.run.shell._STREAM_LIMIT = limit
+    ASSERT(time.perf_counter() - start).is_less_than(3)
+    ASSERT(len(os.listdir('/proc/self/fd'))).is_equal_to(fds)
+
+def test_abash_rss():
+    small = asyncio.run(mlb.run.abash('true'))
+    big = asyncio.run(mlb.run.abash('python -c "x = bytearray(200 * 2**20); x[::4096] = bytes(51200)"'))
+    ASSERT(big.returncode).is_equal_to(0)
+    ASSERT(big.max_rss_kb).is_greater_than(200 * 2**10)
+    ASSERT(small.max_rss_kb).is_less_than(100 * 2**10)
+
+def test_bash_many():
+    start = time.perf_counter()
+    results = mlb.run.bash_many([f'sleep 0.2; echo {i}' for i in range(8)], max_parallel=4)
+    ASSERT([r.stdout for r in results]).is_equal_to([f'{i}\n' for i in range(8)])
+    ASSERT(time.perf_counter() - start).is_between(0.4, 1.5)
+
+def test_rotating_log(tmpdir):
+    log = pathlib.Path(tmpdir) / 'af2.log'
+    cmd = 'for i in $(seq 1000); do echo line $i; done'
+    with mlb.run.rotating_log(log, 2000, 2) as on_stdout:
+        result = asyncio.run(mlb.run.abash(cmd, on_stdout=on_stdout, capture=False))
+    ASSERT(on_stdout.handler.stream).is_none()
+    ASSERT(result.returncode).is_equal_to(0)
+    ASSERT(sorted(p.name for p in log.parent.iterdir())).is_equal_to(['af2.log', 'af2.log.1', 'af2.log.2'])
+    ASSERT(log.read_text().splitlines()[-1]).is_equal_to('line 1000')
+
 if __name__ == '__main__':
     main()